@@ -1 +1,5 @@
+from guardian.startup import startup
+
 __version__ = "0.1.0"
+
+startup.begin("import")  # ended by guardian.main once the application is built
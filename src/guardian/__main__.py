@@ -1,11 +1,31 @@
+import sys
+
 from uvicorn import run
 
 from guardian.config import guardian
+from guardian.server import Prefork, available_cpus
 
-run(
-    "guardian.main:app",
-    host="0.0.0.0",
-    port=guardian.server.PORT,
-    reload=guardian.server.ENABLE_RELOAD,
-    log_level=guardian.logging.level,
-)
+if guardian.server.MODE == "production":
+    sys.exit(
+        Prefork(
+            "guardian.main:app",
+            host="0.0.0.0",
+            port=guardian.server.PORT,
+            workers=guardian.server.WORKERS or available_cpus(),
+            max_requests=guardian.server.MAX_REQUESTS,
+            max_requests_jitter=guardian.server.MAX_REQUESTS_JITTER,
+            preload=guardian.server.PRELOAD,
+            preload_hook="guardian.main:import_subsystems",
+            graceful_timeout=guardian.server.GRACEFUL_TIMEOUT,
+            log_level=guardian.logging.level,
+            max_startup_failures=guardian.server.MAX_STARTUP_FAILURES,
+        ).run()
+    )
+else:
+    run(
+        "guardian.main:app",
+        host="0.0.0.0",
+        port=guardian.server.PORT,
+        reload=guardian.server.ENABLE_RELOAD,
+        log_level=guardian.logging.level,
+    )
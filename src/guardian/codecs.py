@@ -0,0 +1,207 @@
+"""Serialization of small payloads (sessions, cached entities) to bytes.
+
+Encoded payloads start with a 3 byte header: a marker byte, the codec id and
+the compression id, so any configured encoder can be changed without losing
+data written by a previous one. Payloads without the header are read as the
+plain JSON documents written before codecs were introduced.
+"""
+
+import json
+import zlib
+from typing import Any, Literal, Protocol
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+MARKER = 0xFF  # never the first byte of a UTF-8 encoded JSON document
+
+CodecName = Literal["json", "orjson", "msgpack"]
+CompressionName = Literal["none", "zlib", "lz4"]
+
+
+class CodecUnavailableError(RuntimeError):
+    pass
+
+
+class Codec(Protocol):
+    id: int
+    name: str
+
+    def dumps(self, obj: Any) -> bytes: ...
+
+    def loads(self, data: bytes) -> Any: ...
+
+
+class JSONCodec:
+    id = 1
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrJSONCodec(JSONCodec):
+    # Same wire format as JSONCodec, so either one can read the other's payloads
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgPackCodec:
+    id = 2
+    name = "msgpack"
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+class Compression(Protocol):
+    id: int
+    name: str
+
+    def compress(self, data: bytes) -> bytes: ...
+
+    def decompress(self, data: bytes) -> bytes: ...
+
+
+class NoCompression:
+    id = 0
+    name = "none"
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+
+class ZlibCompression:
+    id = 1
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LZ4Compression:
+    id = 2
+    name = "lz4"
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.decompress(data)
+
+
+def get_codec(name: CodecName) -> Codec:
+    if name == "json":
+        return JSONCodec()
+    if name == "orjson":
+        if orjson is None:
+            raise CodecUnavailableError("The 'orjson' codec requires the orjson package")
+        return OrJSONCodec()
+    if name == "msgpack":
+        if msgpack is None:
+            raise CodecUnavailableError("The 'msgpack' codec requires the msgpack package")
+        return MsgPackCodec()
+    raise ValueError(f"Unknown codec {name!r}")
+
+
+def get_compression(name: CompressionName) -> Compression:
+    if name == "none":
+        return NoCompression()
+    if name == "zlib":
+        return ZlibCompression()
+    if name == "lz4":
+        if lz4 is None:
+            raise CodecUnavailableError("The 'lz4' compression requires the lz4 package")
+        return LZ4Compression()
+    raise ValueError(f"Unknown compression {name!r}")
+
+
+class Serializer:
+    """Encodes with the configured codec, compressing payloads above a size threshold.
+
+    Decoding picks the codec and compression from the payload header, so it reads
+    whatever any (available) configuration wrote, including legacy plain JSON.
+    """
+
+    def __init__(
+        self, codec: CodecName = "json", compression: CompressionName = "none", compression_threshold: int = 1024
+    ):
+        self.codec = get_codec(codec)
+        self.compression = get_compression(compression)
+        self.compression_threshold = compression_threshold
+
+        self.decoders: dict[int, Codec] = {JSONCodec.id: OrJSONCodec() if orjson is not None else JSONCodec()}
+        if msgpack is not None:
+            self.decoders[MsgPackCodec.id] = MsgPackCodec()
+        self.decompressors: dict[int, Compression] = {
+            NoCompression.id: NoCompression(),
+            ZlibCompression.id: ZlibCompression(),
+        }
+        if lz4 is not None:
+            self.decompressors[LZ4Compression.id] = LZ4Compression()
+
+    def dumps(self, obj: Any) -> bytes:
+        data = self.codec.dumps(obj)
+        compression: Compression = NoCompression()
+        if len(data) > self.compression_threshold and self.compression.id != NoCompression.id:
+            compressed = self.compression.compress(data)
+            if len(compressed) < len(data):
+                compression, data = self.compression, compressed
+        return bytes((MARKER, self.codec.id, compression.id)) + data
+
+    def loads(self, data: bytes | str) -> Any:
+        """Decode a payload, raising ValueError when it is corrupt.
+
+        Compression libraries and codecs fail with their own exceptions (zlib.error,
+        RuntimeError from lz4, ...), callers only have to handle ValueError and
+        CodecUnavailableError.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not data or data[0] != MARKER:
+            decoder, compression, body = self.decoders[JSONCodec.id], NoCompression(), data
+        else:
+            if len(data) < 3:
+                raise ValueError(f"Truncated payload header of {len(data)} bytes")
+            codec_id, compression_id = data[1], data[2]
+            if codec_id not in self.decoders or compression_id not in self.decompressors:
+                raise CodecUnavailableError(
+                    f"Cannot decode payload with codec {codec_id} and compression {compression_id}"
+                )
+            decoder, compression, body = self.decoders[codec_id], self.decompressors[compression_id], data[3:]
+        try:
+            return decoder.loads(compression.decompress(body))
+        except Exception as e:  # pylint: disable=broad-except
+            raise ValueError(f"Corrupt payload: {type(e).__name__}: {e}") from e
@@ -1,18 +1,46 @@
 from dataclasses import dataclass, field
 from pathlib import Path
+from typing import TYPE_CHECKING, Literal
 
 from ls_logging import LoggingSettings
 from pydantic import BaseSettings
-from yarl import URL
+
+from guardian.codecs import CodecName, CompressionName
+from guardian.startup import startup
+
+if TYPE_CHECKING:
+    from httpx import Limits, Timeout
+    from yarl import URL
 
 
 class ServerSettings(BaseSettings):
     PORT: int = 8080
     ENABLE_RELOAD: bool = False
+    MODE: Literal["development", "production"] = "development"  # production runs a preforked worker pool
+    WORKERS: int = 0  # worker processes in production mode, 0 runs one per available CPU
+    MAX_REQUESTS: int = 0  # requests after which a worker is replaced, 0 never replaces them
+    MAX_REQUESTS_JITTER: int = 0  # up to this many more requests per worker, so they do not restart together
+    PRELOAD: bool = True  # import the app before forking, the workers share its memory copy-on-write
+    GRACEFUL_TIMEOUT: float = 30.0  # seconds a stopping worker gets to finish its requests
+    MAX_STARTUP_FAILURES: int = 5  # consecutive workers failing to start before the server exits
     SECRET_KEY: str = "secret"
     SESSION_COOKIE_NAME: str = "SESSION"
+    SESSION_CODEC: CodecName = "orjson"
+    SESSION_COMPRESSION: CompressionName = "zlib"
+    SESSION_COMPRESSION_THRESHOLD: int = 1024  # bytes, smaller sessions are stored uncompressed
+    SESSION_BACKEND: Literal["redis", "cookie"] = "redis"
+    SESSION_COOKIE_MAX_SIZE: int = 4096  # bytes, larger cookie sessions are stored in Redis instead
+    SESSION_ENCRYPTION_KEY: str = ""  # Fernet key, encrypts cookie sessions when set
     STATIC_FILES_DIR: Path = Path(__file__).parent / "static"
     JINJA2_TEMPLATES_DIR: Path = Path(__file__).parent / "templates"
+    JINJA2_BYTECODE_CACHE: bool = True
+    JINJA2_BYTECODE_CACHE_DIR: Path | None = None  # defaults to a per-user directory in the system temp dir
+    ADMISSION_CONCURRENCY: int = 64  # admission controlled requests in flight per worker
+    ADMISSION_TOKEN_CONCURRENCY: int = 24  # /oauth/token and /oauth/revoke requests in flight per worker
+    ADMISSION_AUTHORIZE_CONCURRENCY: int = 16  # /oauth/authorize requests in flight per worker
+    ADMISSION_INTROSPECT_CONCURRENCY: int = 64  # /oauth/introspect requests in flight per worker, admitted first
+    ADMISSION_INTERACTIVE_QUEUE_TIME: float = 0.25  # seconds token and authorize requests wait before a 503
+    ADMISSION_INTROSPECT_QUEUE_TIME: float = 1.0  # seconds introspection requests wait before a 503
 
     class Config:
         env_prefix = "SERVER_"
@@ -23,14 +51,86 @@ class DynamoDBSettings(BaseSettings):
     PORT: str = "8000"
     REGION: str = "eu-central-1"
     TABLE_NAME: str = "openid"
+    MAX_CONNECTIONS: int = 100
+    MAX_KEEPALIVE_CONNECTIONS: int = 20
+    KEEPALIVE_EXPIRY: float = 30.0
+    CONNECT_TIMEOUT: float = 2.0
+    READ_TIMEOUT: float = 5.0
+    POOL_TIMEOUT: float = 2.0
+    CREATE_SCHEMA: bool = True  # create the table on startup when it does not exist
+    BILLING_MODE: Literal["PROVISIONED", "PAY_PER_REQUEST"] = "PROVISIONED"  # on demand ignores the capacities below
+    READ_CAPACITY: int = 1  # provisioned read capacity units of the table
+    WRITE_CAPACITY: int = 1  # provisioned write capacity units of the table
+    INDEX_CAPACITY: dict[str, tuple[int, int]] = {}  # read and write units by index, JSON, others get the table's
+    SCHEMA_CHECK_INTERVAL: float = 300.0  # seconds between background schema checks, 0 disables them
+    EXPIRY_SWEEP_INTERVAL: float = 0.0  # seconds between deleting expired items where TTL never runs, 0 disables it
+    EXPIRY_SWEEP_BATCH_SIZE: int = 25  # expired items deleted per BatchWriteItem call, at most 25
+    EXPIRY_SWEEP_RATE: float = 50.0  # expired items deleted per second at most, 0 removes the limit
 
     class Config:
         env_prefix = "DYNAMO_"
 
     @property
-    def endpoint(self) -> URL:
+    def endpoint(self) -> "URL":
+        from yarl import URL  # pylint: disable=import-outside-toplevel
+
         return URL(f"{self.HOST}:{self.PORT}")
 
+    @property
+    def limits(self) -> "Limits":
+        # httpx, imported here and in timeout, is only needed once the lifespan creates the DynamoDB client
+        from httpx import Limits  # pylint: disable=import-outside-toplevel
+
+        return Limits(
+            max_connections=self.MAX_CONNECTIONS,
+            max_keepalive_connections=self.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=self.KEEPALIVE_EXPIRY,
+        )
+
+    @property
+    def timeout(self) -> "Timeout":
+        from httpx import Timeout  # pylint: disable=import-outside-toplevel
+
+        return Timeout(self.READ_TIMEOUT, connect=self.CONNECT_TIMEOUT, pool=self.POOL_TIMEOUT)
+
+
+class OAuthSettings(BaseSettings):
+    DISCOVERY_MAX_AGE: int = 3600  # seconds relying parties may cache the discovery document
+    PROVIDER_THREADS: int = 8  # threads running the synchronous oauthlib provider
+    PROVIDER_MAX_PENDING: int = 256  # running and queued provider calls before answering 503
+    PROVIDER_BRIDGE_TIMEOUT: float = 10.0  # seconds a validator waits on an async client call
+    CLIENT_CACHE_SIZE: int = 1024  # clients cached per worker
+    CLIENT_CACHE_TTL: float = 300.0  # seconds a client is cached, 0 disables the cache
+    CLIENT_CACHE_NEGATIVE_TTL: float = 30.0  # seconds an unknown client id is cached
+    CLIENT_CACHE_CHANNEL: str = "guardian:clients:invalidate"  # Redis pub/sub channel for client changes
+    CODE_STORE: Literal["redis", "dynamodb"] = "redis"  # where authorization codes are kept until redeemed
+    TOKEN_CACHE_MAX_TTL: int = 60  # seconds an access token is served from Redis, bounds missed revocations
+    ACCESS_TOKEN_FORMAT: Literal["opaque", "jwt"] = "opaque"  # jwt tokens are verified without a lookup
+    REVOCATION_CHANNEL: str = "guardian:tokens:revoked"  # Redis pub/sub channel announcing revoked token ids
+    REVOCATION_KEY: str = "guardian:tokens:revoked"  # Redis sorted set of revoked token ids by expiry
+    REVOCATION_FILTER_CAPACITY: int = 100_000  # revoked, unexpired tokens the filter is sized for
+    REVOCATION_FILTER_ERROR_RATE: float = 0.001  # false positives at capacity, each costs a Redis lookup (~180 KB)
+    REVOCATION_FILTER_REBUILD_INTERVAL: float = 3600.0  # seconds between rebuilds dropping expired token ids
+    INTROSPECTION_CACHE_TTL: int = 30  # seconds an introspection response is cached in Redis, 0 disables the cache
+    INTROSPECTION_CACHE_LOCAL_TTL: float = 5.0  # seconds an introspection response is cached per worker
+    INTROSPECTION_CACHE_SIZE: int = 10_000  # tokens with cached introspection responses per worker
+    INTROSPECTION_CACHE_CHANNEL: str = "guardian:introspection:invalidate"  # Redis pub/sub channel for revocations
+    INTROSPECTION_BATCH_SIZE: int = 100  # tokens per batch introspection request
+    SIGNING_KEYS_DIR: Path | None = None  # PEM RSA keys signing tokens, required in production, else generated
+    SIGNING_KEY_ACTIVATION_DELAY: float = 300.0  # seconds a new key is published in the JWKS before it signs
+    SIGNING_KEY_ROTATION_INTERVAL: float = 0.0  # seconds between rotating generated keys, 0 disables rotation
+    SIGNING_KEY_RETENTION: float = 7200.0  # seconds a replaced generated key stays published, covers token lifetimes
+    SIGNING_KEYS_REFRESH_INTERVAL: float = 60.0  # seconds between reloading SIGNING_KEYS_DIR and rotating keys
+    JWKS_MAX_AGE: int = 300  # seconds relying parties may cache the JWKS, keep below SIGNING_KEY_ACTIVATION_DELAY
+    PASSWORD_HASH_PROCESSES: int = 2  # processes hashing passwords per worker, 0 hashes in the provider threads
+    PASSWORD_HASH_MAX_PENDING: int = 8  # running and queued logins before answering 503, client checks skip it
+    PASSWORD_HASH_N: int = 2**14  # scrypt CPU/memory cost of new hashes, logins rehash older ones
+    PASSWORD_HASH_R: int = 8  # scrypt block size of new hashes
+    PASSWORD_HASH_P: int = 1  # scrypt parallelism of new hashes
+
+    class Config:
+        env_prefix = "OAUTH_"
+
 
 class RedisSettings(BaseSettings):
     HOST: str = "localhost"
@@ -56,8 +156,10 @@ class RedisSettings(BaseSettings):
 class Guardian:
     dynamodb: DynamoDBSettings = field(default_factory=DynamoDBSettings)
     logging: LoggingSettings = field(default_factory=LoggingSettings)
+    oauth: OAuthSettings = field(default_factory=OAuthSettings)
     redis: RedisSettings = field(default_factory=RedisSettings)
     server: ServerSettings = field(default_factory=ServerSettings)
 
 
-guardian = Guardian()
+with startup.phase("configuration"):
+    guardian = Guardian()
@@ -1,2 +1,12 @@
+from .bloom import BloomFilter
+from .bootstrap import SchemaMonitor, SchemaStatus, bootstrap_schema, check_schema
 from .client import dynamodb_client, ensure_table_exists
+from .client_cache import ClientCache, ClientCacheInvalidation
+from .code_store import CodeStore
+from .introspection_cache import IntrospectionCache
+from .repository import EntityRef, Repository, WriteConflictError
+from .revocation import RevocationList
 from .schema import SCHEMA
+from .schema_manager import Capacity, Change, apply, plan, plan_table
+from .sweeper import ExpirySweeper
+from .token_store import TokenStore
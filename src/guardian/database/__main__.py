@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import sys
+
+from guardian.config import guardian
+
+from .bootstrap import bootstrap_schema, check_schema
+from .client import dynamodb_client
+from .schema import SCHEMA
+from .schema_manager import Capacity, Change, apply, plan_table
+
+
+async def bootstrap(args: argparse.Namespace) -> bool:
+    capacity = Capacity.from_settings(guardian.dynamodb)
+    async with dynamodb_client(guardian.dynamodb.REGION, guardian.dynamodb.endpoint) as client:
+        if args.check_only:
+            status = await check_schema(client, guardian.dynamodb.TABLE_NAME, SCHEMA, capacity)
+        else:
+            status = await bootstrap_schema(client, guardian.dynamodb.TABLE_NAME, SCHEMA, capacity=capacity)
+
+    state = "OK" if status.ok else "DEGRADED" if status.ready else "NOT OK"
+    print(f"{status.table}: {state} (status={status.status})")
+    if status.missing_indexes:
+        print(f"  missing indexes: {', '.join(status.missing_indexes)}")
+    if status.outdated_indexes:
+        print(f"  outdated indexes: {', '.join(status.outdated_indexes)}")
+    for change in status.pending_changes:
+        print(f"  pending: {change}")
+    if status.ttl_status:
+        print(f"  ttl: {status.ttl_status}")
+    if status.error:
+        print(f"  error: {status.error}")
+    # Drift is left to `plan` and `apply`, only a table that cannot serve fails the bootstrap
+    return status.ready
+
+
+def print_plan(table_name: str, changes: list[Change]):
+    if not changes:
+        print(f"{table_name}: up to date")
+        return
+    print(f"{table_name}: {len(changes)} change{'s' if len(changes) > 1 else ''}")
+    for number, change in enumerate(changes, 1):
+        print(f"  {number}. {change.summary}")
+
+
+async def migrate(args: argparse.Namespace) -> bool:
+    table_name = guardian.dynamodb.TABLE_NAME
+    async with dynamodb_client(guardian.dynamodb.REGION, guardian.dynamodb.endpoint) as client:
+        changes = await plan_table(client, table_name, SCHEMA, Capacity.from_settings(guardian.dynamodb))
+        print_plan(table_name, changes)
+        if args.command == "plan" or args.dry_run or not changes:
+            return True
+        await apply(
+            client,
+            table_name,
+            changes,
+            poll_interval=args.poll_interval,
+            timeout=args.timeout,
+            switch_delay=args.switch_delay,
+        )
+    print(f"{table_name}: applied {len(changes)} changes")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m guardian.database", description="Manage the DynamoDB schema.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bootstrap_parser = commands.add_parser("bootstrap", help="Verify the table and GSIs, creating the table if missing")
+    bootstrap_parser.add_argument("--check-only", action="store_true", help="Only verify, never create")
+    bootstrap_parser.set_defaults(handler=bootstrap)
+
+    plan_parser = commands.add_parser("plan", help="List the changes bringing the table in line with the settings")
+    plan_parser.set_defaults(handler=migrate)
+
+    apply_parser = commands.add_parser("apply", help="Apply the planned changes, one at a time")
+    apply_parser.add_argument("--dry-run", action="store_true", help="Only print the plan")
+    apply_parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between status checks")
+    apply_parser.add_argument("--timeout", type=float, help="Seconds to wait for each change, e.g. a backfill")
+    apply_parser.add_argument(
+        "--switch-delay",
+        type=float,
+        # Every worker has checked the schema since the backfill, workers not checking it only move when restarted
+        default=max(2 * guardian.dynamodb.SCHEMA_CHECK_INTERVAL, 60.0),
+        help="Seconds between a replacement index backfilling and dropping the index it replaces",
+    )
+    apply_parser.set_defaults(handler=migrate)
+
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(args.handler(args)) else 1)
+
+
+main()
@@ -0,0 +1,49 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """A fixed size set of strings answering "definitely not in it" or "possibly in it".
+
+    Sized for `capacity` items at a false positive rate of `error_rate`, which
+    takes about -capacity * ln(error_rate) / ln(2)^2 bits. Items cannot be
+    removed, the filter is rebuilt instead. Lookups only read the bit array,
+    so they need no lock while a single thread adds items.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.bits)
+
+    @property
+    def expected_error_rate(self) -> float:
+        """The false positive rate at the current number of items."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def _positions(self, item: str):
+        # Double hashing (Kirsch and Mitzenmacher) derives all positions from one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,212 @@
+import asyncio
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+from aiodynamo.client import Client
+from aiodynamo.errors import TableNotFound
+from structlog import get_logger
+
+from .schema import ACCESS_PATTERNS, TTL_ATTRIBUTE
+from .schema_manager import (
+    Capacity,
+    create_table,
+    describe_table,
+    describe_ttl,
+    index_matches,
+    index_versions,
+    plan,
+    query_index_names,
+)
+
+log = get_logger()
+
+# Tables in these states serve reads and writes, UPDATING covers capacity, billing and index changes
+SERVING_STATUSES = ("ACTIVE", "UPDATING")
+
+# Indexes queried while serving requests, the others are only read in the background
+REQUEST_INDEXES = frozenset(pattern.index for pattern in ACCESS_PATTERNS.values() if pattern.serves_requests)
+
+
+@dataclass(frozen=True)
+class SchemaStatus:
+    """The live table compared against the declared schema.
+
+    `ready` is set when the table serves and no index queried by requests is
+    missing, and `ok` when everything also matches the declaration. A table
+    that is ready but not ok has drifted, e.g. in capacity or an index
+    projection, or is backfilling an index, and still serves. `reachable` is
+    unset when DynamoDB could not be asked, which says nothing about the table.
+    `index_names` maps each declared index to the live one to query, which
+    differ while a changed index is replaced, see `schema_manager.plan`.
+    """
+
+    table: str
+    ok: bool
+    ready: bool = False
+    reachable: bool = True
+    status: str | None = None
+    missing_indexes: list[str] = field(default_factory=list)
+    outdated_indexes: list[str] = field(default_factory=list)  # keyed or projected differently than declared
+    pending_changes: list[str] = field(default_factory=list)  # what `python -m guardian.database apply` would do
+    ttl_status: str | None = None
+    index_names: dict[str, str] = field(default_factory=dict)
+    error: str | None = None
+    checked_at: datetime = field(default_factory=datetime.utcnow)
+
+
+async def enable_ttl(client: Client, table_name: str, attribute: str = TTL_ATTRIBUTE):
+    """Turn on DynamoDB TTL for `attribute`, unless TTL is already on or being turned on."""
+    description = await describe_ttl(client, table_name)
+    if description.get("TimeToLiveStatus", "DISABLED") in ("ENABLED", "ENABLING"):
+        if description.get("AttributeName") != attribute:
+            log.warning(f"DynamoDB table {table_name!r} expires items by {description.get('AttributeName')!r}")
+        return
+    await client.send_request(
+        action="UpdateTimeToLive",
+        payload={"TableName": table_name, "TimeToLiveSpecification": {"Enabled": True, "AttributeName": attribute}},
+    )
+    log.info(f"Enabled TTL on {attribute!r} for DynamoDB table {table_name!r}")
+
+
+async def check_schema(client: Client, table_name: str, schema: dict, capacity: Capacity | None = None) -> SchemaStatus:
+    """Compare the live table against the declared schema without changing anything.
+
+    With `capacity`, the changes needed to reach it are listed as well.
+    """
+    try:
+        description = await describe_table(client, table_name)
+    except TableNotFound:
+        return SchemaStatus(table=table_name, ok=False, error="Table does not exist")
+    except Exception as e:  # pylint: disable=broad-except
+        return SchemaStatus(table=table_name, ok=False, reachable=False, error=f"{type(e).__name__}: {e}")
+
+    live_indexes = {index["IndexName"]: index for index in description.get("GlobalSecondaryIndexes", [])}
+    versions = {gsi.name: index_versions(gsi.name, live_indexes) for gsi in schema["gsis"] or []}
+    missing_indexes = [name for name, names in versions.items() if not names]
+    # An index cannot be changed in place, the schema manager builds a new version next to it
+    outdated_indexes = [
+        gsi.name
+        for gsi in schema["gsis"] or []
+        if versions[gsi.name] and not any(index_matches(gsi, live_indexes[name]) for name in versions[gsi.name])
+    ]
+    inactive_indexes = [name for name, index in live_indexes.items() if index.get("IndexStatus", "ACTIVE") != "ACTIVE"]
+    try:
+        ttl = await describe_ttl(client, table_name)
+        ttl_status = ttl.get("TimeToLiveStatus")
+    except Exception as e:  # pylint: disable=broad-except
+        ttl, ttl_status = None, f"unknown ({type(e).__name__})"
+    pending_changes = []
+    if capacity is not None and ttl is not None:
+        pending_changes = [change.summary for change in plan(table_name, schema, capacity, description, ttl)]
+
+    ready = description["TableStatus"] in SERVING_STATUSES and not REQUEST_INDEXES.intersection(missing_indexes)
+    return SchemaStatus(
+        table=table_name,
+        ok=ready
+        and description["TableStatus"] == "ACTIVE"
+        and not missing_indexes
+        and not inactive_indexes
+        and not outdated_indexes
+        and not pending_changes,
+        ready=ready,
+        status=description["TableStatus"],
+        missing_indexes=missing_indexes,
+        outdated_indexes=outdated_indexes,
+        pending_changes=pending_changes,
+        ttl_status=ttl_status,
+        index_names=query_index_names(schema, description),
+        error=f"Indexes not active: {', '.join(inactive_indexes)}" if inactive_indexes else None,
+    )
+
+
+async def bootstrap_schema(
+    client: Client, table_name: str, schema: dict, create: bool = True, capacity: Capacity | None = None
+) -> SchemaStatus:
+    """Verify the table and its GSIs, creating the table and enabling TTL first when `create` is set.
+
+    A missing table is created with `capacity`, by default the throughput in
+    `schema`. Existing tables are never changed, see `python -m guardian.database plan`.
+    """
+    if create:
+        try:
+            try:
+                await describe_table(client, table_name)
+            except TableNotFound:
+                log.warning(f"DynamoDB table {table_name!r} does not exist, creating it")
+                await create_table(client, table_name, schema, capacity or Capacity.from_schema(schema))
+            await enable_ttl(client, table_name)
+        except Exception as e:  # pylint: disable=broad-except
+            log.error(f"Could not bootstrap DynamoDB table {table_name!r}: {e}")
+
+    status = await check_schema(client, table_name, schema, capacity)
+    if status.ok:
+        log.info(f"DynamoDB table {table_name!r} matches the declared schema")
+    elif status.ready:
+        log.warning(f"DynamoDB table {table_name!r} differs from the declared schema", **asdict(status))
+    else:
+        log.error(f"DynamoDB table {table_name!r} does not match the declared schema", **asdict(status))
+    return status
+
+
+class SchemaMonitor:
+    """Holds the last known schema status and refreshes it in the background.
+
+    `index_names` is updated in place with every status, so queries holding it
+    move to a replaced index once it has backfilled.
+    """
+
+    def __init__(
+        self, client: Client, table_name: str, schema: dict, interval: float, capacity: Capacity | None = None
+    ):
+        self.client = client
+        self.table_name = table_name
+        self.schema = schema
+        self.interval = interval
+        self.capacity = capacity
+        self.status: SchemaStatus | None = None
+        self.index_names: dict[str, str] = {}
+        self._task: asyncio.Task | None = None
+
+    async def bootstrap(self, create: bool = True) -> SchemaStatus:
+        self.status = await bootstrap_schema(
+            self.client, self.table_name, self.schema, create=create, capacity=self.capacity
+        )
+        self.index_names.update(self.status.index_names)
+        return self.status
+
+    async def check(self) -> SchemaStatus:
+        status = await check_schema(self.client, self.table_name, self.schema, self.capacity)
+        if not status.reachable and self.status is not None:
+            # A throttled or failed DescribeTable says nothing about the table, every worker would turn unready at once
+            log.warning(
+                f"Could not check the DynamoDB schema of {self.table_name!r}, keeping the last status: {status.error}"
+            )
+            return self.status
+        if self.status is not None and (status.ready, status.ok) != (self.status.ready, self.status.ok):
+            log.warning(
+                f"DynamoDB schema status of {self.table_name!r} changed",
+                ready=status.ready,
+                ok=status.ok,
+                error=status.error,
+            )
+        self.status = status
+        self.index_names.update(status.index_names)
+        return status
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="dynamodb-schema-monitor")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -4,7 +4,7 @@ from typing import AsyncGenerator
 from aiodynamo.client import Client, Table
 from aiodynamo.credentials import Credentials
 from aiodynamo.http.httpx import HTTPX
-from httpx import AsyncClient
+from httpx import AsyncClient, Limits, Timeout
 from structlog import get_logger
 from yarl import URL
 
@@ -12,10 +12,25 @@ log = get_logger()
 
 
 @asynccontextmanager
-async def dynamodb_client(
-    region: str, endpoint: URL, credentials: Credentials = Credentials.auto()
+async def dynamodb_client(  # pylint: disable=too-many-arguments
+    region: str,
+    endpoint: URL,
+    credentials: Credentials = Credentials.auto(),
+    limits: Limits | None = None,
+    timeout: Timeout | None = None,
 ) -> AsyncGenerator[Client, None]:
-    async with AsyncClient() as http:
+    """Yield a DynamoDB client backed by a single pooled HTTP client.
+
+    The client is meant to live for the whole application lifetime, so that
+    TCP/TLS connections to DynamoDB are kept alive and reused across requests.
+    """
+    options = {}
+    if limits is not None:
+        options["limits"] = limits
+    if timeout is not None:
+        options["timeout"] = timeout
+
+    async with AsyncClient(**options) as http:
         yield Client(
             http=HTTPX(http),
             credentials=credentials,
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from redis import asyncio as redis
+
+from guardian.metrics import Registry, registry
+from guardian.models import Client
+
+from .pubsub import RedisSubscriber
+
+CLEAR_ALL = "*"
+
+
+class ClientCache:
+    """Client records by client id, kept in process for `ttl` seconds.
+
+    Unknown client ids are cached as None for `negative_ttl` seconds, so
+    requests with made up ids do not all reach DynamoDB. At most `maxsize`
+    entries are kept, evicting the least recently used one. The cache is read
+    from the provider threads, so every access holds a lock.
+
+    A client can change between a miss and caching the record read after it,
+    so callers pass the `invalidations` count seen before the read to `set`,
+    which caches nothing when an invalidation arrived in between.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        negative_ttl: float,
+        metrics: Registry = registry,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.entries: OrderedDict[str, tuple[float, Client | None]] = OrderedDict()
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+        self.hits = metrics.counter("client_cache_hits_total")
+        self.negative_hits = metrics.counter("client_cache_negative_hits_total")
+        self.misses = metrics.counter("client_cache_misses_total")
+        self.evictions = metrics.counter("client_cache_evictions_total")
+        self.races = metrics.counter("client_cache_races_total")
+        metrics.gauge("client_cache_size", lambda: len(self.entries))
+
+    def get(self, client_id: str) -> tuple[bool, Client | None]:
+        """Whether the client id is cached, and the client or None for an unknown id."""
+        with self._lock:
+            entry = self.entries.get(client_id)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self.entries[client_id]
+                self.misses.inc()
+                return False, None
+
+            self.entries.move_to_end(client_id)
+            if entry[1] is None:
+                self.negative_hits.inc()
+            else:
+                self.hits.inc()
+            return True, entry[1]
+
+    def set(self, client_id: str, client: Client | None, invalidations: int | None = None):
+        ttl = self.ttl if client is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if invalidations is not None and invalidations != self.invalidations:
+                self.races.inc()
+                return
+            self.entries[client_id] = (self.clock() + ttl, client)
+            self.entries.move_to_end(client_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions.inc()
+
+    def invalidate(self, client_id: str = CLEAR_ALL):
+        with self._lock:
+            self.invalidations += 1
+            if client_id == CLEAR_ALL:
+                self.entries.clear()
+            else:
+                self.entries.pop(client_id, None)
+
+
+class ClientCacheInvalidation(RedisSubscriber):
+    """Keeps the client caches of all workers in sync through a Redis pub/sub channel.
+
+    A changed client id is published on the channel and every subscribed
+    worker, including the publishing one, drops it from its cache. The whole
+    cache is cleared whenever the subscription drops, as changes published in
+    the meantime are lost.
+    """
+
+    name = "client-cache-invalidation"
+
+    def __init__(self, cache: ClientCache, client: redis.Redis, channel: str, retry_interval: float = 1.0):
+        super().__init__(client, channel, retry_interval)
+        self.cache = cache
+
+    async def publish(self, client_id: str = CLEAR_ALL):
+        self.cache.invalidate(client_id)
+        await self.client.publish(self.channel, client_id)
+
+    async def on_subscribe(self):
+        self.cache.invalidate()
+
+    def on_disconnect(self):
+        self.cache.invalidate()
+
+    def on_message(self, data: str):
+        self.cache.invalidate(data)
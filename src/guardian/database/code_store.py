@@ -0,0 +1,34 @@
+import math
+from datetime import datetime
+
+from redis import asyncio as redis
+
+from guardian.models import AuthorizationCode
+
+
+class CodeStore:
+    """Authorization codes in Redis, consumed by the first read.
+
+    Codes live for seconds and are used once, so they are not written to
+    DynamoDB. A code is stored with SETEX for its remaining lifetime and read
+    with GETDEL, which returns and deletes it in one atomic round trip: of
+    concurrent token requests redeeming the same code only one gets it, and
+    a replayed code is simply gone. The PKCE challenge and the nonce are
+    stored with the code.
+    """
+
+    def __init__(self, client: redis.Redis, prefix: str = "guardian:code:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get_key(self, code: str) -> str:
+        return self.prefix + code
+
+    async def put_authorization_code(self, code: AuthorizationCode):
+        ttl = math.ceil((code.expires_at - datetime.utcnow()).total_seconds())
+        if ttl > 0:
+            await self.client.setex(self.get_key(code.code), ttl, code.json())
+
+    async def consume_authorization_code(self, code: str) -> AuthorizationCode | None:
+        data = await self.client.getdel(self.get_key(code))
+        return AuthorizationCode.parse_raw(data) if data is not None else None
@@ -0,0 +1,210 @@
+import hashlib
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from redis import asyncio as redis
+from redis.exceptions import RedisError, WatchError
+from structlog import get_logger
+
+from guardian.metrics import Registry, registry
+
+from .pubsub import RedisSubscriber
+
+log = get_logger()
+
+
+def digest(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class Generation:
+    """What a cache miss saw: the group's generation in Redis and the worker's invalidation count."""
+
+    redis: bytes | None
+    local: int
+
+
+def _decode_entry(data: bytes | str) -> tuple[float, str] | None:
+    """The expiry and response of a Redis entry, None for one in another format."""
+    expires_at, _, body = (data.decode("utf-8") if isinstance(data, bytes) else data).partition(":")
+    try:
+        return float(expires_at), body
+    except ValueError:
+        return None
+
+
+class IntrospectionCache(RedisSubscriber):
+    """Introspection responses by token and client credentials, in process and in Redis.
+
+    Responses are grouped by the id the token is revoked under, the access or
+    refresh token itself or the jti of a JWT access token, and within a group
+    keyed by the token and the credentials the client authenticated with.
+    Only SHA-256 digests are used as keys, so neither tokens nor secrets are
+    stored, and a response is only served again to the same credentials.
+
+    A response is kept in Redis for at most `ttl` seconds and per worker for
+    at most `local_ttl` seconds, both capped by the token's remaining
+    lifetime. The group of a JWT comes from its unverified jti, so any client
+    can add entries to another token's group: every entry carries its own
+    expiry, which a group's Redis TTL, reset by each `set`, cannot extend. `invalidate` drops a group from Redis and announces it on the
+    pub/sub channel, so every worker drops it from its own tier as well.
+
+    A revocation can land between a miss and caching the response looked up
+    after it, so `get` returns the generation it saw with every miss and
+    `set` only caches when nothing was invalidated since: in Redis when the
+    group's generation, bumped by `invalidate`, is unchanged, in the worker
+    when it has received no invalidation at all.
+    """
+
+    name = "introspection-cache-invalidation"
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        channel: str,
+        ttl: int,
+        local_ttl: float,
+        maxsize: int,
+        prefix: str = "guardian:introspection:",
+        retry_interval: float = 1.0,
+        metrics: Registry = registry,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(client, channel, retry_interval)
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.maxsize = maxsize
+        self.prefix = prefix
+        self.clock = clock
+        self.entries: OrderedDict[str, dict[str, tuple[float, str]]] = OrderedDict()
+        self.invalidations = 0  # received by this worker, a miss only fills its tier when none arrived since
+
+        self.local_hits = metrics.counter("introspection_cache_local_hits_total")
+        self.redis_hits = metrics.counter("introspection_cache_redis_hits_total")
+        self.misses = metrics.counter("introspection_cache_misses_total")
+        self.races = metrics.counter("introspection_cache_invalidated_before_set_total")
+        metrics.gauge("introspection_cache_size", lambda: len(self.entries))
+
+    @staticmethod
+    def keys(token_id: str, token: str, credentials: str) -> tuple[str, str]:
+        return digest(token_id), digest(token, credentials)
+
+    def generation_key(self, group: str) -> str:
+        return self.prefix + "generation:" + group
+
+    def _get_local(self, group: str, field: str) -> str | None:
+        entry = self.entries.get(group, {}).get(field)
+        if entry is None or entry[0] <= self.clock():
+            return None
+        self.entries.move_to_end(group)
+        return entry[1]
+
+    def _set_local(self, group: str, field: str, body: str, expires_at: float):
+        self.entries.setdefault(group, {})[field] = (expires_at, body)
+        self.entries.move_to_end(group)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def get(self, token_id: str, token: str, credentials: str) -> tuple[str | None, Generation | None]:
+        """The cached response, or None and the generation to pass to `set` with the looked up one."""
+        if self.ttl <= 0:
+            return None, None
+        group, field = self.keys(token_id, token, credentials)
+        if (body := self._get_local(group, field)) is not None:
+            self.local_hits.inc()
+            return body, None
+
+        local = self.invalidations
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.hget(self.prefix + group, field)
+                pipe.get(self.generation_key(group))
+                data, generation = await pipe.execute()
+        except RedisError as e:
+            log.warning(f"Redis introspection cache lookup failed: {e}")
+            # Without a generation to compare the response is not cached
+            self.misses.inc()
+            return None, None
+
+        entry = _decode_entry(data) if data is not None else None
+        if entry is None or entry[0] <= self.clock():
+            self.misses.inc()
+            return None, Generation(generation, local)
+        self.redis_hits.inc()
+        expires_at, body = entry
+        if self.invalidations == local:
+            self._set_local(group, field, body, min(self.clock() + self.local_ttl, expires_at))
+        return body, None
+
+    async def set(
+        self,
+        token_id: str,
+        token: str,
+        credentials: str,
+        body: str,
+        expires_at: float | None = None,
+        generation: Generation | None = None,
+    ):
+        """Cache a response, until `expires_at` (a timestamp) at the latest.
+
+        With the `generation` of the miss, nothing is cached if the token was
+        invalidated since.
+        """
+        ttl = self.ttl if expires_at is None else min(self.ttl, int(expires_at - self.clock()))
+        if ttl <= 0:
+            return
+        group, field = self.keys(token_id, token, credentials)
+        if generation is None or self.invalidations == generation.local:
+            self._set_local(group, field, body, self.clock() + min(self.local_ttl, ttl))
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                if generation is not None:
+                    # Fails the transaction when an invalidation bumps the generation in between
+                    await pipe.watch(self.generation_key(group))
+                    if await pipe.get(self.generation_key(group)) != generation.redis:
+                        self.races.inc()
+                        return
+                    pipe.multi()
+                pipe.hset(self.prefix + group, field, f"{self.clock() + ttl:.3f}:{body}")
+                pipe.expire(self.prefix + group, ttl)
+                await pipe.execute()
+        except WatchError:
+            self.races.inc()
+        except RedisError as e:
+            log.warning(f"Could not update the Redis introspection cache: {e}")
+
+    async def invalidate(self, token_ids: Iterable[str]):
+        groups = [digest(token_id) for token_id in token_ids]
+        self._drop(groups)
+        if not groups:
+            return
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.delete(*(self.prefix + group for group in groups))
+                for group in groups:
+                    # Outlives every response cached before it, which is all a racing `set` could add
+                    pipe.incr(self.generation_key(group))
+                    pipe.expire(self.generation_key(group), self.ttl)
+                    pipe.publish(self.channel, group)
+                await pipe.execute()
+        except RedisError as e:
+            log.warning(f"Could not invalidate the Redis introspection cache: {e}")
+
+    def _drop(self, groups: Iterable[str] | None = None):
+        self.invalidations += 1
+        if groups is None:
+            self.entries.clear()
+        for group in groups or ():
+            self.entries.pop(group, None)
+
+    async def on_subscribe(self):
+        self._drop()
+
+    def on_disconnect(self):
+        self._drop()
+
+    def on_message(self, data: str):
+        self._drop([data])
@@ -0,0 +1,67 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+from redis import asyncio as redis
+from structlog import get_logger
+
+log = get_logger()
+
+
+class RedisSubscriber(ABC):
+    """Listens on a Redis pub/sub channel in a background task, resubscribing after failures.
+
+    Subclasses handle each message in `on_message`. Messages published while
+    the subscription is down are lost, so subclasses resynchronise their state
+    in `on_subscribe`, which runs on every (re)subscribe.
+    """
+
+    name = "redis-subscriber"
+
+    def __init__(self, client: redis.Redis, channel: str, retry_interval: float = 1.0):
+        self.client = client
+        self.channel = channel
+        self.retry_interval = retry_interval
+        self._task: asyncio.Task | None = None
+
+    async def on_subscribe(self):
+        pass
+
+    def on_disconnect(self):
+        pass
+
+    @abstractmethod
+    def on_message(self, data: str):
+        pass
+
+    def handle(self, message: dict):
+        if message["type"] == "message":
+            data = message["data"]
+            self.on_message(data.decode("utf-8") if isinstance(data, bytes) else data)
+
+    async def _run(self):
+        while True:
+            try:
+                async with self.client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    await self.on_subscribe()
+                    async for message in pubsub.listen():
+                        self.handle(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                log.warning(f"Redis channel {self.channel!r} failed, resubscribing: {e}")
+                self.on_disconnect()
+                await asyncio.sleep(self.retry_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
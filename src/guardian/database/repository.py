@@ -0,0 +1,304 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from aiodynamo.client import Client as DynamoDBClient
+from aiodynamo.errors import ConditionalCheckFailed, ItemNotFound, TransactionCanceled
+from aiodynamo.expressions import F, HashKey, RangeKey
+from aiodynamo.models import BatchGetRequest
+from aiodynamo.operations import Delete, Put
+from pydantic import BaseModel
+
+from guardian.models import AuthorizationCode, BearerToken, Client, User
+
+from .client_cache import ClientCache, ClientCacheInvalidation
+from .schema import Attributes
+
+CLIENT = "Client"
+USER = "User"
+AUTHORIZATION_CODE = "AuthorizationCode"
+BEARER_TOKEN = "BearerToken"
+REFRESH_TOKEN = "RefreshToken"
+
+MODELS: dict[str, type[BaseModel]] = {
+    CLIENT: Client,
+    USER: User,
+    AUTHORIZATION_CODE: AuthorizationCode,
+    BEARER_TOKEN: BearerToken,
+    REFRESH_TOKEN: BearerToken,  # the token the refresh token was issued with
+}
+
+MAX_BATCH_GET_ATTEMPTS = 5
+MAX_BATCH_GET_KEYS = 100  # BatchGetItem limit per call
+
+
+class WriteConflictError(Exception):
+    """A conditional write lost against a concurrent change, e.g. a code that was already used."""
+
+
+@dataclass(frozen=True)
+class EntityRef:
+    """Identifies an entity; every entity is its own item with PK = SK = `<type>#<id>`."""
+
+    type: str
+    id: str
+
+    @property
+    def key(self) -> dict[str, str]:
+        value = f"{self.type}#{self.id}"
+        return {Attributes.PK: value, Attributes.SK: value}
+
+    @classmethod
+    def from_item(cls, item: dict) -> "EntityRef":
+        return cls(item[Attributes.EntityType], item[Attributes.EntityId])
+
+
+def expiry(expires_at: datetime) -> int:
+    # DynamoDB TTL takes seconds since the epoch, the models hold naive UTC datetimes
+    return int(expires_at.replace(tzinfo=timezone.utc).timestamp())
+
+
+def to_item(ref: EntityRef, model: BaseModel, **attributes: str | int | None) -> dict:
+    # Model fields are stored as top level attributes, next to the key and index attributes
+    item = json.loads(model.json(exclude_none=True))
+    item.update(ref.key)
+    item[Attributes.EntityType] = ref.type
+    item[Attributes.EntityId] = ref.id
+    item.update({name: value for name, value in attributes.items() if value is not None})
+    return item
+
+
+def from_item(ref: EntityRef, item: dict) -> BaseModel:
+    return MODELS[ref.type].parse_obj(item)
+
+
+def client_item(client: Client) -> dict:
+    return to_item(EntityRef(CLIENT, client.client_id), client, ClientId=client.client_id)
+
+
+def user_item(user: User) -> dict:
+    return to_item(EntityRef(USER, user.email), user, Username=user.email)
+
+
+def authorization_code_item(code: AuthorizationCode) -> dict:
+    return to_item(
+        EntityRef(AUTHORIZATION_CODE, code.code),
+        code,
+        ClientId=code.client_id,
+        Username=code.username,
+        ExpiresAt=expiry(code.expires_at),
+    )
+
+
+def token_items(token: BearerToken) -> list[dict]:
+    # Both items carry the access token as TokenId, so TokenIdIndex pairs them up. Refresh tokens
+    # do not expire, so only the access token item gets a TTL
+    attributes = {"ClientId": token.client_id, "Username": token.username, "TokenId": token.access_token}
+    items = [
+        to_item(EntityRef(BEARER_TOKEN, token.access_token), token, ExpiresAt=expiry(token.expires_at), **attributes)
+    ]
+    if token.refresh_token:
+        items.append(to_item(EntityRef(REFRESH_TOKEN, token.refresh_token), token, **attributes))
+    return items
+
+
+class Repository:
+    """Guardian's entities in the single table described by SCHEMA.
+
+    Reads are eventually consistent unless the caller asks otherwise, writes
+    touching more than one item go through a single TransactWriteItems call.
+    Clients are read through `client_cache` when one is given, and changes to
+    them are announced to the other workers through `client_invalidation`.
+    Indexes are queried under their live name in `index_names`, kept current
+    by the SchemaMonitor while an index is being replaced.
+    """
+
+    def __init__(
+        self,
+        client: DynamoDBClient,
+        table_name: str,
+        client_cache: ClientCache | None = None,
+        client_invalidation: ClientCacheInvalidation | None = None,
+        index_names: dict[str, str] | None = None,
+    ):
+        self.client = client
+        self.table_name = table_name
+        self.client_cache = client_cache
+        self.client_invalidation = client_invalidation
+        self.index_names = index_names if index_names is not None else {}
+
+    async def get(self, ref: EntityRef, consistent_read: bool = False) -> BaseModel | None:
+        try:
+            item = await self.client.get_item(self.table_name, ref.key, consistent_read=consistent_read)
+        except ItemNotFound:
+            return None
+        return from_item(ref, item)
+
+    async def get_many(self, refs: list[EntityRef], consistent_read: bool = False) -> dict[EntityRef, BaseModel | None]:
+        """Fetch several entities with one BatchGetItem call, retrying unprocessed keys."""
+        found: dict[EntityRef, BaseModel | None] = dict.fromkeys(refs)
+        # Seen before reading, a client invalidated during the read is not cached
+        invalidations = self.client_cache.invalidations if self.client_cache is not None else None
+        missing = [ref for ref in found if not self._cached(ref, found)]
+        if len(missing) == 1:
+            found[missing[0]] = await self.get(missing[0], consistent_read=consistent_read)
+        elif missing:
+            found.update(await self._batch_get(missing, consistent_read))
+
+        if self.client_cache is not None:
+            for ref in missing:
+                if ref.type == CLIENT:
+                    self.client_cache.set(ref.id, found[ref], invalidations)
+        return found
+
+    def _cached(self, ref: EntityRef, found: dict[EntityRef, BaseModel | None]) -> bool:
+        if ref.type != CLIENT or self.client_cache is None:
+            return False
+        hit, found[ref] = self.client_cache.get(ref.id)
+        return hit
+
+    async def _batch_get(self, refs: list[EntityRef], consistent_read: bool) -> dict[EntityRef, BaseModel]:
+        if len(refs) > MAX_BATCH_GET_KEYS:
+            chunks = [refs[i : i + MAX_BATCH_GET_KEYS] for i in range(0, len(refs), MAX_BATCH_GET_KEYS)]
+            results = await asyncio.gather(*(self._batch_get(chunk, consistent_read) for chunk in chunks))
+            return {ref: model for result in results for ref, model in result.items()}
+
+        found = {}
+        keys = [ref.key for ref in refs]
+        for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+            response = await self.client.batch_get(
+                {self.table_name: BatchGetRequest(keys=keys, consistent_read=consistent_read)}
+            )
+            for item in response.items.get(self.table_name, []):
+                ref = EntityRef.from_item(item)
+                found[ref] = from_item(ref, item)
+
+            keys = response.unprocessed_keys.get(self.table_name, [])
+            if not keys:
+                return found
+            await asyncio.sleep(0.05 * 2**attempt)
+
+        raise RuntimeError(f"BatchGetItem left {len(keys)} keys unprocessed after {MAX_BATCH_GET_ATTEMPTS} attempts")
+
+    async def get_client(self, client_id: str) -> Client | None:
+        ref = EntityRef(CLIENT, client_id)
+        return (await self.get_many([ref]))[ref]
+
+    async def get_user(self, email: str) -> User | None:
+        return await self.get(EntityRef(USER, email))
+
+    async def get_authorization_code(self, code: str) -> AuthorizationCode | None:
+        # Codes are single use, a stale read could accept one that was just redeemed
+        return await self.get(EntityRef(AUTHORIZATION_CODE, code), consistent_read=True)
+
+    async def get_bearer_token(self, access_token: str) -> BearerToken | None:
+        # Tokens are used right after they are issued, so retry a miss with a strong read
+        ref = EntityRef(BEARER_TOKEN, access_token)
+        return await self.get(ref) or await self.get(ref, consistent_read=True)
+
+    async def get_bearer_tokens(self, access_tokens: list[str]) -> dict[str, BearerToken | None]:
+        refs = [EntityRef(BEARER_TOKEN, access_token) for access_token in access_tokens]
+        found = await self.get_many(refs)
+        if missing := [ref for ref in refs if found[ref] is None]:
+            found.update(await self.get_many(missing, consistent_read=True))
+        return {ref.id: found[ref] for ref in refs}
+
+    async def is_revoked(self, access_token: str) -> bool:
+        # Revoked and expired tokens are deleted, there is nothing to tell them apart by
+        return await self.get_bearer_token(access_token) is None
+
+    async def get_refresh_token(self, refresh_token: str) -> BearerToken | None:
+        # Refresh tokens rotate on use, a stale read could accept a rotated one
+        return await self.get(EntityRef(REFRESH_TOKEN, refresh_token), consistent_read=True)
+
+    async def get_tokens_by_username(self, username: str) -> list[BearerToken]:
+        return await self._query_tokens(Attributes.Username, username)
+
+    async def get_tokens_by_client(self, client_id: str) -> list[BearerToken]:
+        return await self._query_tokens(Attributes.ClientId, client_id)
+
+    async def _query_tokens(self, attribute: str, value: str) -> list[BearerToken]:
+        # The index projects the token fields (see ACCESS_PATTERNS), so there is no GetItem per token
+        key_condition = HashKey(attribute, value) & RangeKey(Attributes.EntityType).equals(BEARER_TOKEN)
+        items = self.client.query(self.table_name, key_condition, index=self._index(attribute + "Index"))
+        # EntityId is not projected, a bearer token's id is its access token
+        return [from_item(EntityRef(BEARER_TOKEN, item["access_token"]), item) async for item in items]
+
+    def _index(self, name: str) -> str:
+        return self.index_names.get(name, name)
+
+    async def put_client(self, client: Client):
+        await self.client.put_item(self.table_name, client_item(client))
+        await self.invalidate_client(client.client_id)
+
+    async def delete_client(self, client_id: str):
+        await self.delete(EntityRef(CLIENT, client_id))
+        await self.invalidate_client(client_id)
+
+    async def invalidate_client(self, client_id: str):
+        if self.client_invalidation is not None:
+            await self.client_invalidation.publish(client_id)
+        elif self.client_cache is not None:
+            self.client_cache.invalidate(client_id)
+
+    async def put_user(self, user: User):
+        await self.client.put_item(self.table_name, user_item(user))
+
+    async def put_authorization_code(self, code: AuthorizationCode):
+        await self.client.put_item(self.table_name, authorization_code_item(code))
+
+    async def delete(self, ref: EntityRef):
+        await self.client.delete_item(self.table_name, ref.key)
+
+    async def write(self, operations: list[Put | Delete]):
+        """Apply the operations atomically, in one transaction when there is more than one."""
+        # A transaction costs twice the write capacity, so a single write goes out on its own
+        try:
+            if len(operations) > 1:
+                await self.client.transact_write_items(operations)
+            elif isinstance(operations[0], Put):
+                await self.client.put_item(self.table_name, operations[0].item, condition=operations[0].condition)
+            else:
+                await self.client.delete_item(self.table_name, operations[0].key, condition=operations[0].condition)
+        except (TransactionCanceled, ConditionalCheckFailed) as e:
+            raise WriteConflictError(str(e)) from e
+
+    async def save_token(
+        self,
+        token: BearerToken,
+        consume_code: str | None = None,
+        replace_refresh_token: str | None = None,
+        revoke_access_token: BearerToken | None = None,
+    ):
+        """Store a token and, in the same transaction, redeem the grant it was issued for.
+
+        A redeemed authorization code or a rotated refresh token must still exist,
+        so two concurrent requests for the same grant cannot both get a token.
+        """
+        operations: list[Put | Delete] = [Put(self.table_name, item) for item in token_items(token)]
+        if consume_code:
+            operations.append(
+                Delete(
+                    self.table_name,
+                    EntityRef(AUTHORIZATION_CODE, consume_code).key,
+                    condition=F(Attributes.PK).exists(),
+                )
+            )
+        if replace_refresh_token and replace_refresh_token != token.refresh_token:
+            operations.append(
+                Delete(
+                    self.table_name,
+                    EntityRef(REFRESH_TOKEN, replace_refresh_token).key,
+                    condition=F(Attributes.PK).exists(),
+                )
+            )
+        if revoke_access_token is not None and revoke_access_token.access_token != token.access_token:
+            operations.append(Delete(self.table_name, EntityRef(BEARER_TOKEN, revoke_access_token.access_token).key))
+        await self.write(operations)
+
+    async def revoke_token(self, token: BearerToken, include_refresh_token: bool = False):
+        operations = [Delete(self.table_name, EntityRef(BEARER_TOKEN, token.access_token).key)]
+        if include_refresh_token and token.refresh_token:
+            operations.append(Delete(self.table_name, EntityRef(REFRESH_TOKEN, token.refresh_token).key))
+        await self.write(operations)
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+from redis import asyncio as redis
+from redis.exceptions import RedisError
+from structlog import get_logger
+
+from .bloom import BloomFilter
+from .pubsub import RedisSubscriber
+
+log = get_logger()
+
+
+class RevocationList(RedisSubscriber):
+    """A Bloom filter of revoked token ids, checked in process without a round trip.
+
+    A JWT access token stays valid until it expires, unless its id was
+    revoked. Revoked ids are kept in a Redis sorted set scored by the token
+    expiry and announced on a pub/sub channel. Each worker keeps a Bloom
+    filter of them, so most tokens are cleared by `might_be_revoked` alone and
+    only filter hits, revoked tokens and the odd false positive, need an
+    authoritative lookup.
+
+    The filter is rebuilt from the sorted set whenever the subscription is
+    (re)established, and once it holds `capacity` ids or is older than
+    `rebuild_interval` seconds, which drops the ids of expired tokens.
+    """
+
+    name = "token-revocation-list"
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        channel: str,
+        key: str,
+        capacity: int = 100_000,
+        error_rate: float = 0.001,
+        rebuild_interval: float = 3600.0,
+        retry_interval: float = 1.0,
+    ):
+        super().__init__(client, channel, retry_interval)
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.filter = BloomFilter(capacity, error_rate)
+        self.built_at = time.monotonic()
+        self.rebuild_at = capacity  # filter size triggering a rebuild, doubles while live ids exceed capacity
+        self._pending: list[str] | None = None  # ids added while a rebuild is reading the sorted set
+        self._published: set[str] = set()  # ids revoked here, whose pub/sub echo is not added again
+        self._rebuild_task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def add(self, token_id: str):
+        self.filter.add(token_id)
+        if self._pending is not None:
+            self._pending.append(token_id)
+        if self._rebuild_task is None or self._rebuild_task.done():
+            if len(self.filter) >= self.rebuild_at or time.monotonic() - self.built_at >= self.rebuild_interval:
+                self._rebuild_task = asyncio.create_task(self.rebuild())
+
+    def might_be_revoked(self, token_id: str) -> bool:
+        return token_id in self.filter
+
+    async def is_revoked(self, token_id: str) -> bool:
+        """Whether the sorted set has the id, the authoritative answer for a filter hit."""
+        return await self.client.zscore(self.key, token_id) is not None
+
+    async def rebuild(self):
+        async with self._lock:
+            self._pending = []
+            try:
+                token_ids = await self.client.zrangebyscore(self.key, time.time(), "+inf")
+            except RedisError as e:
+                log.warning(f"Could not rebuild the revocation filter: {e}")
+                token_ids = None
+            pending, self._pending = self._pending, None
+            if token_ids is None:
+                return
+
+            bloom = BloomFilter(self.capacity, self.error_rate)
+            for token_id in token_ids:
+                bloom.add(token_id.decode("utf-8") if isinstance(token_id, bytes) else token_id)
+            for token_id in pending:
+                bloom.add(token_id)
+            if len(bloom) >= self.capacity:
+                log.warning(
+                    f"{len(bloom)} revoked tokens exceed the revocation filter capacity of {self.capacity}, "
+                    f"the false positive rate is now {bloom.expected_error_rate:.2%}"
+                )
+            self.filter = bloom
+            self.built_at = time.monotonic()
+            self.rebuild_at = max(self.capacity, 2 * len(bloom))
+
+    async def revoke(self, token_id: str, expires_at: float):
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.zadd(self.key, {token_id: expires_at})
+                pipe.zremrangebyscore(self.key, "-inf", time.time())
+                pipe.publish(self.channel, token_id)
+                self._published.add(token_id)
+                await pipe.execute()
+        except BaseException:
+            self._published.discard(token_id)
+            raise
+        finally:
+            # Added once the sorted set has it, so a concurrent rebuild cannot drop it
+            self.add(token_id)
+
+    async def on_subscribe(self):
+        # Echoes of earlier publications are lost with the old subscription, and the rebuild has their ids
+        self._published.clear()
+        await self.rebuild()
+
+    def on_message(self, data: str):
+        if data in self._published:
+            # Every id added counts towards the capacity, so this worker's own revocations are added once
+            self._published.discard(data)
+            return
+        self.add(data)
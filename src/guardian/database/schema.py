@@ -1,5 +1,9 @@
+from dataclasses import dataclass
+
 from aiodynamo.models import GlobalSecondaryIndex, KeySchema, KeySpec, KeyType, Projection, ProjectionType, Throughput
 
+from guardian.models import BearerToken
+
 
 class Attributes:
     PK = "PK"
@@ -9,6 +13,41 @@ class Attributes:
     Username = "Username"
     ClientId = "ClientId"
     TokenId = "TokenId"
+    ExpiresAt = "ExpiresAt"
+
+
+# Items with this attribute, a Unix timestamp, are deleted by DynamoDB once it has passed
+TTL_ATTRIBUTE = Attributes.ExpiresAt
+
+
+@dataclass(frozen=True)
+class AccessPattern:
+    """A query against a GSI and the non-key attributes it reads from the index items."""
+
+    index: str
+    attributes: tuple[str, ...] = ()
+    serves_requests: bool = True  # made while handling a request, so the index has to exist to serve
+
+
+# The index queries the code makes. An index projects the attributes its patterns read, so a query is
+# answered by the index alone instead of a GetItem per result. Projected attributes are written to the
+# index on every put, so only project what a pattern reads
+ACCESS_PATTERNS = {
+    "expired items by entity type": AccessPattern(
+        Attributes.EntityType + "Index", (Attributes.ExpiresAt,), serves_requests=False
+    ),
+    "tokens by username": AccessPattern(Attributes.Username + "Index", tuple(BearerToken.__fields__)),
+    "tokens by client": AccessPattern(Attributes.ClientId + "Index", tuple(BearerToken.__fields__)),
+}
+
+
+def projection(index: str) -> Projection:
+    attributes = sorted(
+        {name for pattern in ACCESS_PATTERNS.values() if pattern.index == index for name in pattern.attributes}
+    )
+    if not attributes:
+        return Projection(type=ProjectionType.keys_only)
+    return Projection(type=ProjectionType.include, attrs=attributes)
 
 
 SCHEMA = {
@@ -37,9 +76,7 @@ SCHEMA = {
                     type=KeyType.string,
                 ),
             ),
-            projection=Projection(
-                type=ProjectionType.keys_only,
-            ),
+            projection=projection(Attributes.SK + "Index"),
             throughput=Throughput(read=1, write=1),
         ),
         GlobalSecondaryIndex(
@@ -54,9 +91,7 @@ SCHEMA = {
                     type=KeyType.string,
                 ),
             ),
-            projection=Projection(
-                type=ProjectionType.keys_only,
-            ),
+            projection=projection(Attributes.EntityType + "Index"),
             throughput=Throughput(read=1, write=1),
         ),
         GlobalSecondaryIndex(
@@ -71,9 +106,7 @@ SCHEMA = {
                     type=KeyType.string,
                 ),
             ),
-            projection=Projection(
-                type=ProjectionType.keys_only,
-            ),
+            projection=projection(Attributes.Username + "Index"),
             throughput=Throughput(read=1, write=1),
         ),
         GlobalSecondaryIndex(
@@ -88,9 +121,7 @@ SCHEMA = {
                     type=KeyType.string,
                 ),
             ),
-            projection=Projection(
-                type=ProjectionType.keys_only,
-            ),
+            projection=projection(Attributes.ClientId + "Index"),
             throughput=Throughput(read=1, write=1),
         ),
         GlobalSecondaryIndex(
@@ -105,9 +136,7 @@ SCHEMA = {
                     type=KeyType.string,
                 ),
             ),
-            projection=Projection(
-                type=ProjectionType.keys_only,
-            ),
+            projection=projection(Attributes.TokenId + "Index"),
             throughput=Throughput(read=1, write=1),
         ),
     ],
@@ -0,0 +1,316 @@
+import asyncio
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Literal
+
+from aiodynamo.client import Client
+from aiodynamo.errors import TableNotFound
+from aiodynamo.models import GlobalSecondaryIndex, Throughput
+from structlog import get_logger
+
+from .schema import TTL_ATTRIBUTE
+
+log = get_logger()
+
+PROVISIONED = "PROVISIONED"
+PAY_PER_REQUEST = "PAY_PER_REQUEST"
+
+BillingMode = Literal["PROVISIONED", "PAY_PER_REQUEST"]
+
+
+@dataclass(frozen=True)
+class Capacity:
+    """How the table is billed, and the capacity of the table and each index when provisioned."""
+
+    billing_mode: BillingMode = PROVISIONED
+    table: Throughput = field(default_factory=lambda: Throughput(read=1, write=1))
+    indexes: dict[str, Throughput] = field(default_factory=dict)
+
+    @classmethod
+    def from_schema(cls, schema: dict) -> "Capacity":
+        return cls(PROVISIONED, schema["throughput"], {gsi.name: gsi.throughput for gsi in schema["gsis"] or []})
+
+    @classmethod
+    def from_settings(cls, settings) -> "Capacity":
+        indexes = {name: Throughput(read=read, write=write) for name, (read, write) in settings.INDEX_CAPACITY.items()}
+        return cls(
+            settings.BILLING_MODE, Throughput(read=settings.READ_CAPACITY, write=settings.WRITE_CAPACITY), indexes
+        )
+
+    def index(self, name: str) -> Throughput:
+        return self.indexes.get(name, self.table)
+
+
+@dataclass(frozen=True)
+class Change:
+    """One DynamoDB control plane request, applied after the table settled from the previous one."""
+
+    summary: str
+    action: str
+    payload: dict
+    after_switch: bool = False  # drops a replaced index, so waits for the workers to query its replacement
+
+
+async def describe_table(client: Client, table_name: str) -> dict:
+    # aiodynamo's TableDescription leaves out the secondary indexes, so use the raw response
+    response = await client.send_request(action="DescribeTable", payload={"TableName": table_name})
+    return response["Table"]
+
+
+async def describe_ttl(client: Client, table_name: str) -> dict:
+    response = await client.send_request(action="DescribeTimeToLive", payload={"TableName": table_name})
+    return response["TimeToLiveDescription"]
+
+
+def projection_matches(gsi: GlobalSecondaryIndex, description: dict) -> bool:
+    live = description.get("Projection", {})
+    declared = (gsi.projection.type.value, sorted(gsi.projection.attrs or []))
+    return (live.get("ProjectionType"), sorted(live.get("NonKeyAttributes", []))) == declared
+
+
+def index_matches(gsi: GlobalSecondaryIndex, description: dict) -> bool:
+    return description.get("KeySchema") == gsi.schema.encode() and projection_matches(gsi, description)
+
+
+def index_versions(name: str, live: dict[str, dict]) -> list[str]:
+    """The live indexes standing for the declared index `name`, oldest first.
+
+    A changed index is built again next to the old one as `<name>-2`,
+    `<name>-3` and so on, see `plan`.
+    """
+    versions = [live_name for live_name in live if live_name == name or _version(name, live_name) is not None]
+    return sorted(versions, key=lambda live_name: _version(name, live_name) or 1)
+
+
+def _version(name: str, live_name: str) -> int | None:
+    if live_name == name:
+        return 1
+    prefix, _, suffix = live_name.rpartition("-")
+    return int(suffix) if prefix == name and suffix.isdigit() else None
+
+
+def replacement_name(name: str, live: dict[str, dict]) -> str:
+    versions = index_versions(name, live)
+    return f"{name}-{(_version(name, versions[-1]) or 1) + 1}" if versions else name
+
+
+def query_index_names(schema: dict, description: dict) -> dict[str, str]:
+    """The live index each declared index is queried through.
+
+    The newest active version matching the declaration, else the newest active
+    one, so queries stay on the old index while its replacement backfills.
+    """
+    live = {index["IndexName"]: index for index in description.get("GlobalSecondaryIndexes", [])}
+    names = {}
+    for gsi in schema["gsis"] or []:
+        active = [
+            name for name in index_versions(gsi.name, live) if live[name].get("IndexStatus", "ACTIVE") == "ACTIVE"
+        ]
+        matching = [name for name in active if index_matches(gsi, live[name])]
+        names[gsi.name] = (matching or active or [gsi.name])[-1]
+    return names
+
+
+def billing_mode(description: dict) -> str:
+    return description.get("BillingModeSummary", {}).get("BillingMode", PROVISIONED)
+
+
+def throughput(description: dict) -> Throughput:
+    provisioned = description.get("ProvisionedThroughput", {})
+    return Throughput(read=provisioned.get("ReadCapacityUnits", 0), write=provisioned.get("WriteCapacityUnits", 0))
+
+
+def _throughput(capacity: Throughput) -> dict:
+    return {"ReadCapacityUnits": capacity.read, "WriteCapacityUnits": capacity.write}
+
+
+def _create_index(gsi: GlobalSecondaryIndex, capacity: Capacity, name: str | None = None) -> dict:
+    # aiodynamo always encodes an index throughput, which on-demand tables reject
+    index = {"IndexName": name or gsi.name, "KeySchema": gsi.schema.encode(), "Projection": gsi.projection.encode()}
+    if capacity.billing_mode == PROVISIONED:
+        index["ProvisionedThroughput"] = _throughput(capacity.index(gsi.name))
+    return index
+
+
+def _attribute_definitions(*schemas) -> list[dict]:
+    attributes = {name: kind for schema in schemas for name, kind in schema.to_attributes().items()}
+    return [{"AttributeName": name, "AttributeType": kind} for name, kind in attributes.items()]
+
+
+def create_table_change(table_name: str, schema: dict, capacity: Capacity) -> Change:
+    gsis = schema["gsis"] or []
+    payload = {
+        "TableName": table_name,
+        "AttributeDefinitions": _attribute_definitions(schema["keys"], *(gsi.schema for gsi in gsis)),
+        "KeySchema": schema["keys"].encode(),
+        "BillingMode": capacity.billing_mode,
+    }
+    if capacity.billing_mode == PROVISIONED:
+        payload["ProvisionedThroughput"] = _throughput(capacity.table)
+    if gsis:
+        payload["GlobalSecondaryIndexes"] = [_create_index(gsi, capacity) for gsi in gsis]
+    summary = f"Create table {table_name} ({capacity.billing_mode}) with {len(gsis)} indexes"
+    return Change(summary, "CreateTable", payload)
+
+
+def plan(
+    table_name: str,
+    schema: dict,
+    capacity: Capacity,
+    description: dict | None,
+    ttl: dict | None = None,
+    ttl_attribute: str = TTL_ATTRIBUTE,
+) -> list[Change]:
+    """The changes turning the live table, as described, into the declared one.
+
+    DynamoDB creates or deletes one index per UpdateTable call and rejects
+    further changes while an index backfills, so every change is its own call.
+    Removed indexes go first, then billing and capacity, then the new indexes.
+    An index cannot be changed in place: its replacement is created under the
+    next version name, and the old index is only deleted once the replacement
+    has backfilled, so queries always have an index to go to.
+    """
+    changes = []
+    if description is None:
+        changes.append(create_table_change(table_name, schema, capacity))
+    else:
+        changes.extend(_update_table(table_name, schema, capacity, description))
+
+    if ttl is None or ttl.get("TimeToLiveStatus", "DISABLED") not in ("ENABLED", "ENABLING"):
+        payload = {
+            "TableName": table_name,
+            "TimeToLiveSpecification": {"Enabled": True, "AttributeName": ttl_attribute},
+        }
+        changes.append(Change(f"Enable TTL on {ttl_attribute}", "UpdateTimeToLive", payload))
+    return changes
+
+
+def _delete_index(table_name: str, name: str, reason: str, after_switch: bool = False) -> Change:
+    payload = {"TableName": table_name, "GlobalSecondaryIndexUpdates": [{"Delete": {"IndexName": name}}]}
+    return Change(f"Delete index {name} ({reason})", "UpdateTable", payload, after_switch)
+
+
+def _update_table(table_name: str, schema: dict, capacity: Capacity, description: dict) -> list[Change]:
+    changes = []
+    declared = {gsi.name: gsi for gsi in schema["gsis"] or []}
+    live = {index["IndexName"]: index for index in description.get("GlobalSecondaryIndexes", [])}
+    versions = {name: index_versions(name, live) for name in declared}
+
+    undeclared = [name for name in live if not any(name in names for names in versions.values())]
+    for name in undeclared:
+        changes.append(_delete_index(table_name, name, "no longer declared"))
+    remaining = {name: declared_name for declared_name, names in versions.items() for name in names}
+
+    live_billing = billing_mode(description)
+    if capacity.billing_mode != live_billing:
+        payload = {"TableName": table_name, "BillingMode": capacity.billing_mode}
+        if capacity.billing_mode == PROVISIONED:
+            # Switching to provisioned capacity needs the capacity of every remaining index as well
+            payload["ProvisionedThroughput"] = _throughput(capacity.table)
+            if remaining:
+                payload["GlobalSecondaryIndexUpdates"] = [
+                    {"Update": {"IndexName": name, "ProvisionedThroughput": _throughput(capacity.index(declared_name))}}
+                    for name, declared_name in remaining.items()
+                ]
+        changes.append(Change(f"Switch billing from {live_billing} to {capacity.billing_mode}", "UpdateTable", payload))
+    elif capacity.billing_mode == PROVISIONED:
+        if throughput(description) != capacity.table:
+            payload = {"TableName": table_name, "ProvisionedThroughput": _throughput(capacity.table)}
+            summary = f"Set table capacity to {capacity.table.read} RCU / {capacity.table.write} WCU"
+            changes.append(Change(summary, "UpdateTable", payload))
+        for name, declared_name in remaining.items():
+            if throughput(live[name]) != capacity.index(declared_name):
+                index_capacity = capacity.index(declared_name)
+                update = {"Update": {"IndexName": name, "ProvisionedThroughput": _throughput(index_capacity)}}
+                payload = {"TableName": table_name, "GlobalSecondaryIndexUpdates": [update]}
+                summary = f"Set index {name} capacity to {index_capacity.read} RCU / {index_capacity.write} WCU"
+                changes.append(Change(summary, "UpdateTable", payload))
+
+    superseded = []
+    for name, gsi in declared.items():
+        matching = [version for version in versions[name] if index_matches(gsi, live[version])]
+        if matching:
+            # Left over from an interrupted replacement, the newest matching version is kept
+            superseded.extend(version for version in versions[name] if version != matching[-1])
+            continue
+        new_name = replacement_name(name, live)
+        payload = {
+            "TableName": table_name,
+            "AttributeDefinitions": _attribute_definitions(schema["keys"], gsi.schema),
+            "GlobalSecondaryIndexUpdates": [{"Create": _create_index(gsi, capacity, new_name)}],
+        }
+        changes.append(Change(f"Create index {new_name} and wait for its backfill", "UpdateTable", payload))
+        superseded.extend(versions[name])
+
+    # Only once every replacement has backfilled, queries move to it with the next schema check
+    for name in superseded:
+        reason = f"replaced by a newer version of {remaining[name]}"
+        changes.append(_delete_index(table_name, name, reason, after_switch=True))
+    return changes
+
+
+async def plan_table(client: Client, table_name: str, schema: dict, capacity: Capacity) -> list[Change]:
+    try:
+        description = await describe_table(client, table_name)
+    except TableNotFound:
+        return plan(table_name, schema, capacity, None)
+    return plan(table_name, schema, capacity, description, await describe_ttl(client, table_name))
+
+
+def settled(description: dict) -> bool:
+    indexes = description.get("GlobalSecondaryIndexes", [])
+    return description["TableStatus"] == "ACTIVE" and all(
+        index.get("IndexStatus", "ACTIVE") == "ACTIVE" and not index.get("Backfilling", False) for index in indexes
+    )
+
+
+async def wait_until_settled(
+    client: Client,
+    table_name: str,
+    poll_interval: float = 5.0,
+    timeout: float | None = None,
+    clock: Callable[[], float] = time.monotonic,
+):
+    """Wait until the table and all its indexes are ACTIVE, with every backfill done."""
+    deadline = None if timeout is None else clock() + timeout
+    while True:
+        try:
+            if settled(await describe_table(client, table_name)):
+                return
+        except TableNotFound:
+            pass  # a table being created can briefly be unknown
+        if deadline is not None and clock() >= deadline:
+            raise TimeoutError(f"DynamoDB table {table_name!r} did not settle within {timeout} seconds")
+        await asyncio.sleep(poll_interval)
+
+
+async def apply(
+    client: Client,
+    table_name: str,
+    changes: list[Change],
+    poll_interval: float = 5.0,
+    timeout: float | None = None,
+    switch_delay: float = 0.0,
+):
+    """Apply the changes one at a time, waiting for the table to settle before and after each.
+
+    Replaced indexes are dropped `switch_delay` seconds after the table
+    settled, time for every SchemaMonitor to move queries to the replacement.
+    """
+    switched = False
+    for change in changes:
+        if change.action != "CreateTable":
+            await wait_until_settled(client, table_name, poll_interval, timeout)
+        if change.after_switch and not switched:
+            log.info(f"Waiting {switch_delay:.0f}s for queries to move to the replacement indexes")
+            await asyncio.sleep(switch_delay)
+            switched = True
+        log.info(f"Applying to DynamoDB table {table_name!r}: {change.summary}")
+        await client.send_request(action=change.action, payload=change.payload)
+        if change.action != "UpdateTimeToLive":
+            await wait_until_settled(client, table_name, poll_interval, timeout)
+
+
+async def create_table(client: Client, table_name: str, schema: dict, capacity: Capacity, poll_interval: float = 1.0):
+    await apply(client, table_name, [create_table_change(table_name, schema, capacity)], poll_interval)
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from collections.abc import Callable
+
+from aiodynamo.client import Client
+from aiodynamo.expressions import F, HashKey
+from aiodynamo.models import BatchWriteRequest
+from structlog import get_logger
+
+from guardian.metrics import Registry, registry
+
+from .repository import AUTHORIZATION_CODE, BEARER_TOKEN
+from .schema import Attributes
+
+log = get_logger()
+
+MAX_BATCH_WRITE_ATTEMPTS = 5
+MAX_BATCH_WRITE_ITEMS = 25  # BatchWriteItem limit per call
+
+
+class ExpirySweeper:
+    """Deletes expired access tokens and authorization codes in the background.
+
+    DynamoDB TTL deletes them in AWS, within a few days of expiry. DynamoDB
+    Local and test tables never do, so there expired items are found through
+    EntityTypeIndex, which projects the expiry, and deleted `batch_size` at a
+    time, at most `max_deletes_per_second` per second, every `interval` seconds.
+    `index_names` maps EntityTypeIndex to its live name, see SchemaMonitor.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        table_name: str,
+        interval: float,
+        batch_size: int = MAX_BATCH_WRITE_ITEMS,
+        max_deletes_per_second: float = 0.0,
+        entity_types: tuple[str, ...] = (BEARER_TOKEN, AUTHORIZATION_CODE),
+        metrics: Registry = registry,
+        clock: Callable[[], float] = time.time,
+        index_names: dict[str, str] | None = None,
+    ):
+        self.client = client
+        self.table_name = table_name
+        self.interval = interval
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_WRITE_ITEMS))
+        self.max_deletes_per_second = max_deletes_per_second
+        self.entity_types = entity_types
+        self.clock = clock
+        self.index_names = index_names if index_names is not None else {}
+        self._task: asyncio.Task | None = None
+
+        self.deleted = metrics.counter("expired_items_deleted_total")
+
+    async def sweep(self) -> int:
+        """Delete the items that have expired by now, returns how many."""
+        now = int(self.clock())
+        index = Attributes.EntityType + "Index"
+        deleted = 0
+        for entity_type in self.entity_types:
+            keys = []
+            async for item in self.client.query(
+                self.table_name,
+                HashKey(Attributes.EntityType, entity_type),
+                index=self.index_names.get(index, index),
+                filter_expression=F(Attributes.ExpiresAt).lt(now),
+                projection=F(Attributes.PK) & F(Attributes.SK),
+            ):
+                keys.append({Attributes.PK: item[Attributes.PK], Attributes.SK: item[Attributes.SK]})
+                if len(keys) == self.batch_size:
+                    deleted += await self._delete(keys)
+                    keys = []
+            if keys:
+                deleted += await self._delete(keys)
+        if deleted:
+            log.info(f"Deleted {deleted} expired items from DynamoDB table {self.table_name!r}")
+        return deleted
+
+    async def _delete(self, keys: list[dict]) -> int:
+        count = len(keys)
+        for attempt in range(MAX_BATCH_WRITE_ATTEMPTS):
+            result = await self.client.batch_write({self.table_name: BatchWriteRequest(keys_to_delete=keys)})
+            keys = result[self.table_name].undeleted_keys if self.table_name in result else []
+            if not keys:
+                break
+            await asyncio.sleep(0.05 * 2**attempt)
+        else:
+            log.warning(f"BatchWriteItem left {len(keys)} expired items undeleted, retrying next sweep")
+
+        self.deleted.inc(count - len(keys))
+        if self.max_deletes_per_second > 0:
+            await asyncio.sleep(count / self.max_deletes_per_second)
+        return count - len(keys)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f"Could not sweep expired items: {e}")
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="dynamodb-expiry-sweeper")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
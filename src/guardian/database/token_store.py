@@ -0,0 +1,169 @@
+from datetime import datetime, timezone
+
+from redis import asyncio as redis
+from redis.exceptions import RedisError
+from structlog import get_logger
+
+from guardian.models import BearerToken
+
+from .introspection_cache import IntrospectionCache
+from .repository import Repository
+from .revocation import RevocationList
+
+log = get_logger()
+
+TOMBSTONE = b"-"  # marks a revoked access token until it would have expired
+
+
+def seconds_until(expires_at: datetime) -> int:
+    return int((expires_at - datetime.utcnow()).total_seconds())
+
+
+class TokenStore:
+    """Access tokens in Redis in front of the durable copy in DynamoDB.
+
+    Tokens are written to DynamoDB first and then to Redis, and looked up in
+    Redis first. A token is cached for its remaining lifetime, but at most
+    `max_ttl` seconds, so a revocation whose Redis write failed is still
+    picked up from DynamoDB within `max_ttl` seconds.
+
+    Revoking writes a tombstone to Redis before deleting the token from
+    DynamoDB, and adds the token id to `revocations`, the filter JWT access
+    tokens are checked against before `is_revoked` is asked. A revocation
+    that cannot reach the filter fails rather than leave the token valid
+    until it expires, and `is_revoked` asks the filter's sorted set when the
+    tombstone is missing. Cached introspection responses of revoked and
+    replaced tokens are dropped from `introspection`. Redis is only a cache: when it cannot be reached, lookups
+    fall back to DynamoDB and writes only go there.
+    """
+
+    def __init__(
+        self,
+        repository: Repository,
+        client: redis.Redis,
+        max_ttl: int,
+        prefix: str = "guardian:token:",
+        revocations: RevocationList | None = None,
+        introspection: IntrospectionCache | None = None,
+    ):
+        self.repository = repository
+        self.client = client
+        self.max_ttl = max_ttl
+        self.prefix = prefix
+        self.revocations = revocations
+        self.introspection = introspection
+
+    def get_key(self, access_token: str) -> str:
+        return self.prefix + access_token
+
+    def cache_ttl(self, token: BearerToken) -> int:
+        return min(seconds_until(token.expires_at), self.max_ttl)
+
+    async def _write(self, cached: list[BearerToken], revoked: list[BearerToken]):
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                for token in cached:
+                    if (ttl := self.cache_ttl(token)) > 0:
+                        pipe.setex(self.get_key(token.access_token), ttl, token.json())
+                for token in revoked:
+                    if (ttl := seconds_until(token.expires_at)) > 0:
+                        pipe.setex(self.get_key(token.access_token), ttl, TOMBSTONE)
+                await pipe.execute()
+        except RedisError as e:
+            log.warning(f"Could not update the Redis token cache: {e}")
+
+    async def _revoke(self, tokens: list[BearerToken]):
+        # Not a cache: JWT access tokens are only checked against DynamoDB when the filter has their id,
+        # so a failure propagates before the revocation is reported done
+        if self.revocations is not None:
+            for token in tokens:
+                await self.revocations.revoke(
+                    token.access_token, token.expires_at.replace(tzinfo=timezone.utc).timestamp()
+                )
+
+    async def _invalidate(self, token_ids: list[str]):
+        if self.introspection is not None and token_ids:
+            await self.introspection.invalidate(token_ids)
+
+    async def get_bearer_token(self, access_token: str) -> BearerToken | None:
+        try:
+            data = await self.client.get(self.get_key(access_token))
+        except RedisError as e:
+            log.warning(f"Redis token lookup failed, reading DynamoDB: {e}")
+            return await self.repository.get_bearer_token(access_token)
+
+        if data == TOMBSTONE:
+            return None
+        if data is not None:
+            return BearerToken.parse_raw(data)
+
+        token = await self.repository.get_bearer_token(access_token)
+        if token is not None:
+            await self._write([token], [])
+        return token
+
+    async def get_bearer_tokens(self, access_tokens: list[str]) -> dict[str, BearerToken | None]:
+        """Several access tokens with one Redis MGET, and one DynamoDB batch for the misses."""
+        try:
+            values = await self.client.mget([self.get_key(access_token) for access_token in access_tokens])
+        except RedisError as e:
+            log.warning(f"Redis token lookup failed, reading DynamoDB: {e}")
+            return await self.repository.get_bearer_tokens(access_tokens)
+
+        found: dict[str, BearerToken | None] = {}
+        missing = []
+        for access_token, data in zip(access_tokens, values):
+            if data == TOMBSTONE:
+                found[access_token] = None
+            elif data is not None:
+                found[access_token] = BearerToken.parse_raw(data)
+            else:
+                missing.append(access_token)
+
+        if missing:
+            loaded = await self.repository.get_bearer_tokens(missing)
+            found.update(loaded)
+            await self._write([token for token in loaded.values() if token is not None], [])
+        return found
+
+    async def is_revoked(self, token_id: str) -> bool:
+        try:
+            if await self.client.get(self.get_key(token_id)) == TOMBSTONE:
+                return True
+            # The tombstone write may have failed or the key been evicted, the filter's sorted set is written
+            # before a revocation is reported done
+            if self.revocations is not None:
+                return await self.revocations.is_revoked(token_id)
+        except RedisError as e:
+            log.warning(f"Redis revocation check failed, reading DynamoDB: {e}")
+        return await self.repository.is_revoked(token_id)
+
+    async def get_refresh_token(self, refresh_token: str) -> BearerToken | None:
+        # Refresh tokens are only used on the token endpoint, they are not cached
+        return await self.repository.get_refresh_token(refresh_token)
+
+    async def save_token(
+        self,
+        token: BearerToken,
+        consume_code: str | None = None,
+        replace_refresh_token: str | None = None,
+        revoke_access_token: BearerToken | None = None,
+    ):
+        # Revoked first, so a failure leaves the replaced tokens usable rather than the new one lost
+        await self._revoke([revoke_access_token] if revoke_access_token is not None else [])
+        await self.repository.save_token(
+            token,
+            consume_code=consume_code,
+            replace_refresh_token=replace_refresh_token,
+            revoke_access_token=revoke_access_token,
+        )
+        await self._write([token], [revoke_access_token] if revoke_access_token is not None else [])
+        replaced = [revoke_access_token.access_token] if revoke_access_token is not None else []
+        await self._invalidate(replaced + ([replace_refresh_token] if replace_refresh_token else []))
+
+    async def revoke_token(self, token: BearerToken, include_refresh_token: bool = False):
+        await self._write([], [token])
+        await self._revoke([token])
+        await self.repository.revoke_token(token, include_refresh_token=include_refresh_token)
+        refresh_tokens = [token.refresh_token] if include_refresh_token and token.refresh_token else []
+        await self._invalidate([token.access_token, *refresh_tokens])
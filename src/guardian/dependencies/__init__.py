@@ -1,2 +1,4 @@
-from .dynamodb import dynamodb_table
-from .jinja2_templates import get_jinja2_templates
+from .dynamodb import dynamodb_table, get_dynamodb_client, get_schema_monitor
+from .jinja2_templates import StreamingJinja2Templates, create_jinja2_templates, get_jinja2_templates
+from .provider import get_introspection_cache, get_key_manager, get_provider_executor
+from .session import get_session
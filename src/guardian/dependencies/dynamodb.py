@@ -1,18 +1,19 @@
-from typing import AsyncGenerator
-
-from aiodynamo.client import Table
-from structlog import get_logger
+from aiodynamo.client import Client, Table
+from fastapi import Request
 
 from guardian.config import guardian
-from guardian.database import SCHEMA, dynamodb_client, ensure_table_exists
+from guardian.database import SchemaMonitor
+
 
-log = get_logger()
+def get_dynamodb_client(request: Request) -> Client:
+    # Created once in the application lifespan, see guardian.main
+    return request.app.state.dynamodb
 
 
-async def dynamodb_table() -> AsyncGenerator[Table, None]:
-    async with dynamodb_client(guardian.dynamodb.REGION, guardian.dynamodb.endpoint) as client:
-        table = client.table(guardian.dynamodb.TABLE_NAME)
+def get_schema_monitor(request: Request) -> SchemaMonitor:
+    return request.app.state.schema_monitor
 
-        await ensure_table_exists(table, SCHEMA)
 
-        yield table
+def dynamodb_table(request: Request) -> Table:
+    # The table is verified once at startup and then by the schema monitor, not per request
+    return get_dynamodb_client(request).table(guardian.dynamodb.TABLE_NAME)
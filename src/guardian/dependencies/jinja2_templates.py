@@ -1,7 +1,75 @@
+from pathlib import Path
+from typing import Mapping
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from structlog import get_logger
+
+log = get_logger()
+
+TEMPLATE_EXTENSIONS = ("html",)
+
+
+class StreamingJinja2Templates(Jinja2Templates):
+    """Jinja2Templates with an async environment, rendering templates as a stream.
+
+    The environment is created with `enable_async=True`, so templates have to be
+    rendered through `stream` instead of the synchronous `TemplateResponse`.
+    """
+
+    def stream(
+        self,
+        name: str,
+        context: dict,
+        status_code: int = 200,
+        headers: Mapping[str, str] | None = None,
+        media_type: str = "text/html",
+    ) -> StreamingResponse:
+        if "request" not in context:
+            raise ValueError('context must include a "request" key')
+
+        request: Request = context["request"]
+        for context_processor in self.context_processors:
+            context.update(context_processor(request))
+
+        template = self.get_template(name)
+        return StreamingResponse(
+            template.generate_async(context),
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+        )
+
+    def precompile(self) -> list[str]:
+        """Load every template once, filling the in-memory and bytecode caches."""
+        names = self.env.list_templates(extensions=TEMPLATE_EXTENSIONS)
+        for name in names:
+            self.env.get_template(name)
+        return names
+
+
+def create_jinja2_templates(
+    directory: Path, bytecode_cache_dir: Path | None = None, use_bytecode_cache: bool = True, auto_reload: bool = False
+) -> StreamingJinja2Templates:
+    bytecode_cache = None
+    if use_bytecode_cache:
+        if bytecode_cache_dir is not None:
+            bytecode_cache_dir.mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(str(bytecode_cache_dir))
+        else:
+            # Defaults to a per-user directory in the system temp dir
+            bytecode_cache = FileSystemBytecodeCache()
 
-from guardian.config import guardian
+    return StreamingJinja2Templates(
+        directory=directory,
+        enable_async=True,
+        auto_reload=auto_reload,
+        bytecode_cache=bytecode_cache,
+    )
 
 
-def get_jinja2_templates() -> Jinja2Templates:
-    return Jinja2Templates(directory=guardian.server.JINJA2_TEMPLATES_DIR)
+def get_jinja2_templates(request: Request) -> StreamingJinja2Templates:
+    # Created and warmed up once in the application lifespan, see guardian.main
+    return request.app.state.templates
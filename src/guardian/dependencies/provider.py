@@ -0,0 +1,17 @@
+from fastapi import Request
+
+from guardian.database import IntrospectionCache
+from guardian.openid import KeyManager, ProviderExecutor
+
+
+def get_provider_executor(request: Request) -> ProviderExecutor:
+    # Started in the application lifespan, see guardian.main
+    return request.app.state.provider_executor
+
+
+def get_key_manager(request: Request) -> KeyManager:
+    return request.app.state.keys
+
+
+def get_introspection_cache(request: Request) -> IntrospectionCache:
+    return request.app.state.introspection_cache
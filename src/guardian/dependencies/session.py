@@ -0,0 +1,8 @@
+from fastapi import Request
+
+from guardian.middleware import Session
+
+
+async def get_session(request: Request) -> Session:
+    # SessionMiddleware only reads the session from Redis for routes that depend on this
+    return await request.scope["session"].load()
@@ -1,39 +1,279 @@
-from contextlib import asynccontextmanager
+import asyncio
+import importlib
+from contextlib import AsyncExitStack, asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from ls_logging import setup_logging
+from redis import asyncio as redis
+from redis.asyncio.connection import ConnectionPool
 from structlog import get_logger
 
+from guardian.codecs import Serializer
 from guardian.config import guardian
-from guardian.middleware import RedisMiddleware, SessionMiddleware
-from guardian.routers import auth, health
+from guardian.middleware import AdmissionMiddleware, RedisMiddleware, RouteLimit, SessionMiddleware
+from guardian.openid import ProviderBusyError
+from guardian.passwords import PasswordHasher, PasswordHasherBusyError
+from guardian.startup import startup
 
 log = get_logger()
 
+# Shared by RedisMiddleware and the application scoped Redis clients
+redis_pool = ConnectionPool.from_url(guardian.redis.uri)
+
+# Imported by import_subsystems, the routers import the provider and build it
+DEFERRED_MODULES = ("guardian.database", "guardian.dependencies", "guardian.routers.auth", "guardian.routers.health")
+
+
+def import_subsystems():
+    """Import what the lifespan defers, building the provider on the way.
+
+    DynamoDB, oauthlib, PyJWT, Jinja and the routers load in the lifespan
+    rather than with this module, which keeps importing the application fast.
+    The preforked server calls this before forking, so the workers share them.
+    """
+    with startup.phase("import"):
+        for name in DEFERRED_MODULES:
+            importlib.import_module(name)
+
 
 @asynccontextmanager
-async def lifespan(app: FastAPI):
-    setup_logging(guardian.logging)
+async def lifespan(app: FastAPI):  # pylint: disable=too-many-locals,too-many-statements
+    with startup.phase("configuration"):
+        setup_logging(guardian.logging)
+
+    with startup.phase("import"):
+        # pylint: disable=import-outside-toplevel
+        from guardian.database import (
+            SCHEMA,
+            Capacity,
+            ClientCache,
+            ClientCacheInvalidation,
+            CodeStore,
+            ExpirySweeper,
+            IntrospectionCache,
+            Repository,
+            RevocationList,
+            SchemaMonitor,
+            TokenStore,
+            dynamodb_client,
+        )
+        from guardian.dependencies import create_jinja2_templates
+        from guardian.openid import JWTAccessTokens, KeyManager, ProviderExecutor, provider, validator
+        from guardian.routers import auth, health
+
+    with startup.phase("configuration"):
+        log.info(f"Initializing API on port {guardian.server.PORT}")
+        app.mount("/static", StaticFiles(directory=guardian.server.STATIC_FILES_DIR), name="static")
+
+        # Register your routers here
+        app.include_router(health.router, prefix="/management")
+        app.include_router(auth.router, prefix="/oauth", tags=["OAuth2"])
+
+        app.state.templates = create_jinja2_templates(
+            guardian.server.JINJA2_TEMPLATES_DIR,
+            bytecode_cache_dir=guardian.server.JINJA2_BYTECODE_CACHE_DIR,
+            use_bytecode_cache=guardian.server.JINJA2_BYTECODE_CACHE,
+            auto_reload=guardian.server.ENABLE_RELOAD,
+        )
+    with startup.phase("warmup"):
+        log.info(f"Precompiled templates: {', '.join(app.state.templates.precompile())}")
+
+    async with AsyncExitStack() as stack:
+        # Application scoped resources, closed in reverse order on shutdown
+        startup.begin("pools")
+        app.state.dynamodb = await stack.enter_async_context(
+            dynamodb_client(
+                guardian.dynamodb.REGION,
+                guardian.dynamodb.endpoint,
+                limits=guardian.dynamodb.limits,
+                timeout=guardian.dynamodb.timeout,
+            )
+        )
+        startup.end("pools")
+
+        startup.begin("warmup")
+        app.state.schema_monitor = SchemaMonitor(
+            app.state.dynamodb,
+            guardian.dynamodb.TABLE_NAME,
+            SCHEMA,
+            interval=guardian.dynamodb.SCHEMA_CHECK_INTERVAL,
+            capacity=Capacity.from_settings(guardian.dynamodb),
+        )
+        await app.state.schema_monitor.bootstrap(create=guardian.dynamodb.CREATE_SCHEMA)
+        app.state.schema_monitor.start()
+        stack.push_async_callback(app.state.schema_monitor.stop)
+        startup.end("warmup")
+
+        startup.begin("pools")
+        app.state.expiry_sweeper = ExpirySweeper(
+            app.state.dynamodb,
+            guardian.dynamodb.TABLE_NAME,
+            interval=guardian.dynamodb.EXPIRY_SWEEP_INTERVAL,
+            batch_size=guardian.dynamodb.EXPIRY_SWEEP_BATCH_SIZE,
+            max_deletes_per_second=guardian.dynamodb.EXPIRY_SWEEP_RATE,
+            index_names=app.state.schema_monitor.index_names,
+        )
+        app.state.expiry_sweeper.start()
+        stack.push_async_callback(app.state.expiry_sweeper.stop)
+
+        # Shut down after the provider threads, which may be waiting on a hash
+        app.state.passwords = PasswordHasher(
+            processes=guardian.oauth.PASSWORD_HASH_PROCESSES,
+            max_pending=guardian.oauth.PASSWORD_HASH_MAX_PENDING,
+            n=guardian.oauth.PASSWORD_HASH_N,
+            r=guardian.oauth.PASSWORD_HASH_R,
+            p=guardian.oauth.PASSWORD_HASH_P,
+        )
+        app.state.passwords.start()
+        stack.callback(app.state.passwords.shutdown)
+
+        app.state.provider_executor = ProviderExecutor(
+            max_workers=guardian.oauth.PROVIDER_THREADS,
+            max_pending=guardian.oauth.PROVIDER_MAX_PENDING,
+            bridge_timeout=guardian.oauth.PROVIDER_BRIDGE_TIMEOUT,
+        )
+        await app.state.provider_executor.start()
+        stack.push_async_callback(app.state.provider_executor.shutdown)
+
+        stack.push_async_callback(redis_pool.disconnect)
+        app.state.client_cache = ClientCache(
+            maxsize=guardian.oauth.CLIENT_CACHE_SIZE,
+            ttl=guardian.oauth.CLIENT_CACHE_TTL,
+            negative_ttl=guardian.oauth.CLIENT_CACHE_NEGATIVE_TTL,
+        )
+        client_invalidation = ClientCacheInvalidation(
+            app.state.client_cache,
+            redis.Redis(connection_pool=redis_pool),
+            guardian.oauth.CLIENT_CACHE_CHANNEL,
+        )
+        client_invalidation.start()
+        stack.push_async_callback(client_invalidation.stop)
+
+        app.state.repository = Repository(
+            app.state.dynamodb,
+            guardian.dynamodb.TABLE_NAME,
+            client_cache=app.state.client_cache,
+            client_invalidation=client_invalidation,
+            index_names=app.state.schema_monitor.index_names,
+        )
+        startup.end("pools")
+
+        # Loads or generates the signing keys
+        startup.begin("warmup")
+        app.state.keys = KeyManager(
+            directory=guardian.oauth.SIGNING_KEYS_DIR,
+            activation_delay=guardian.oauth.SIGNING_KEY_ACTIVATION_DELAY,
+            rotation_interval=guardian.oauth.SIGNING_KEY_ROTATION_INTERVAL,
+            retention=guardian.oauth.SIGNING_KEY_RETENTION,
+            refresh_interval=guardian.oauth.SIGNING_KEYS_REFRESH_INTERVAL,
+            jwks_max_age=guardian.oauth.JWKS_MAX_AGE,
+            # Workers and replicas must all sign with, and publish, the same keys
+            allow_generated=guardian.server.MODE == "development",
+        )
+        app.state.keys.start()
+        stack.push_async_callback(app.state.keys.stop)
+        await asyncio.to_thread(app.state.passwords.warm_up)
+        startup.end("warmup")
+
+        startup.begin("pools")
+
+        jwt_tokens = JWTAccessTokens(app.state.keys)
+        revocations = None
+        if guardian.oauth.ACCESS_TOKEN_FORMAT == "jwt":
+            provider.bearer.token_generator = jwt_tokens
+
+            revocations = RevocationList(
+                redis.Redis(connection_pool=redis_pool),
+                guardian.oauth.REVOCATION_CHANNEL,
+                guardian.oauth.REVOCATION_KEY,
+                capacity=guardian.oauth.REVOCATION_FILTER_CAPACITY,
+                error_rate=guardian.oauth.REVOCATION_FILTER_ERROR_RATE,
+                rebuild_interval=guardian.oauth.REVOCATION_FILTER_REBUILD_INTERVAL,
+            )
+            revocations.start()
+            stack.push_async_callback(revocations.stop)
+
+        app.state.introspection_cache = IntrospectionCache(
+            redis.Redis(connection_pool=redis_pool),
+            guardian.oauth.INTROSPECTION_CACHE_CHANNEL,
+            ttl=guardian.oauth.INTROSPECTION_CACHE_TTL,
+            local_ttl=guardian.oauth.INTROSPECTION_CACHE_LOCAL_TTL,
+            maxsize=guardian.oauth.INTROSPECTION_CACHE_SIZE,
+        )
+        app.state.introspection_cache.start()
+        stack.push_async_callback(app.state.introspection_cache.stop)
+
+        app.state.tokens = TokenStore(
+            app.state.repository,
+            redis.Redis(connection_pool=redis_pool),
+            max_ttl=guardian.oauth.TOKEN_CACHE_MAX_TTL,
+            revocations=revocations,
+            introspection=app.state.introspection_cache,
+        )
+        app.state.codes = None
+        if guardian.oauth.CODE_STORE == "redis":
+            app.state.codes = CodeStore(redis.Redis(connection_pool=redis_pool))
+        validator.bind(
+            app.state.repository,
+            app.state.provider_executor.run_coroutine,
+            tokens=app.state.tokens,
+            jwt_tokens=jwt_tokens,
+            revocations=revocations,
+            keys=app.state.keys,
+            codes=app.state.codes,
+            passwords=app.state.passwords,
+        )
+        startup.end("pools")
+        startup.report()
+
+        yield
+
+        log.info("Shutting down API")
 
-    log.info(f"Initializing API on port {guardian.server.PORT}")
-    app.mount("/static", StaticFiles(directory=guardian.server.STATIC_FILES_DIR), name="static")
 
-    # Register your routers here
-    app.include_router(health.router, prefix="/management")
-    app.include_router(auth.router, prefix="/oauth", tags=["OAuth2"])
+def admission_routes() -> dict[str, RouteLimit]:
+    # Interactive flows queue behind introspection, which resource servers call on every request
+    settings = guardian.server
+    interactive = settings.ADMISSION_INTERACTIVE_QUEUE_TIME
+    introspect = RouteLimit(
+        "introspect", settings.ADMISSION_INTROSPECT_CONCURRENCY, settings.ADMISSION_INTROSPECT_QUEUE_TIME
+    )
+    token = RouteLimit("token", settings.ADMISSION_TOKEN_CONCURRENCY, interactive, priority=1)
+    authorize = RouteLimit("authorize", settings.ADMISSION_AUTHORIZE_CONCURRENCY, interactive, priority=1)
+    return {
+        "/oauth/introspect": introspect,
+        "/oauth/introspect/batch": introspect,
+        "/oauth/token": token,
+        "/oauth/revoke": token,
+        "/oauth/authorize": authorize,
+    }
 
-    yield
 
-    log.info("Shutting down API")
+async def provider_busy_handler(request: Request, exc: ProviderBusyError | PasswordHasherBusyError) -> JSONResponse:
+    log.warning(f"Rejected {request.url.path}: {exc}")
+    return JSONResponse({"detail": "Service busy"}, status_code=503, headers={"Retry-After": "1"})
 
 
 app = FastAPI(title="guardian", lifespan=lifespan)
+app.add_exception_handler(ProviderBusyError, provider_busy_handler)
+app.add_exception_handler(PasswordHasherBusyError, provider_busy_handler)
 app.add_middleware(
     SessionMiddleware,
     secret_key=guardian.server.SECRET_KEY,
     session_cookie=guardian.server.SESSION_COOKIE_NAME,
     same_site="none",
     https_only=False,
+    serializer=Serializer(
+        guardian.server.SESSION_CODEC,
+        guardian.server.SESSION_COMPRESSION,
+        guardian.server.SESSION_COMPRESSION_THRESHOLD,
+    ),
+    backend=guardian.server.SESSION_BACKEND,
+    max_cookie_size=guardian.server.SESSION_COOKIE_MAX_SIZE,
+    encryption_key=guardian.server.SESSION_ENCRYPTION_KEY or None,
 )
-app.add_middleware(RedisMiddleware, url=guardian.redis.uri)
+app.add_middleware(RedisMiddleware, connection_pool=redis_pool)
+app.add_middleware(AdmissionMiddleware, routes=admission_routes(), concurrency=guardian.server.ADMISSION_CONCURRENCY)
+startup.end("import")
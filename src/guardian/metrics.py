@@ -0,0 +1,79 @@
+import threading
+from bisect import bisect_left
+from typing import Any
+
+# Upper bounds in seconds, the last bucket catches everything above
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+class Gauge:
+    def __init__(self, func=None):
+        self.value = 0
+        self.func = func
+
+    def set(self, value: float):
+        self.value = value
+
+    def snapshot(self) -> float:
+        return self.func() if self.func is not None else self.value
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Registry:
+    """Process-wide metrics, reported by /management/metrics."""
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def register(self, name: str, metric):
+        self.metrics[name] = metric
+        return metric
+
+    def counter(self, name: str) -> Counter:
+        return self.register(name, Counter())
+
+    def gauge(self, name: str, func=None) -> Gauge:
+        return self.register(name, Gauge(func))
+
+    def histogram(self, name: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(name, Histogram(buckets))
+
+    def snapshot(self) -> dict[str, Any]:
+        return {name: metric.snapshot() for name, metric in sorted(self.metrics.items())}
+
+
+registry = Registry()
@@ -1,5 +1,12 @@
-import json
+import asyncio
+import base64
+import binascii
+import heapq
+import itertools
+import time
 import uuid
+from collections.abc import Iterator, MutableMapping
+from dataclasses import dataclass
 from typing import Any, Literal, Type
 
 import itsdangerous
@@ -8,13 +15,27 @@ from redis import asyncio as redis
 from redis.asyncio.connection import ConnectionPool
 from starlette.datastructures import MutableHeaders, Secret
 from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from guardian.codecs import CodecUnavailableError, Serializer
+from guardian.metrics import Registry, registry
+
+COOKIE_SESSION_PREFIX = "~"  # marks cookies holding the session itself rather than a Redis session id
+
 
 class RedisMiddleware:
-    def __init__(self, app: ASGIApp, url: str, connection_pool_class: Type[ConnectionPool] = ConnectionPool, **kwargs):
+    def __init__(
+        self,
+        app: ASGIApp,
+        url: str | None = None,
+        connection_pool_class: Type[ConnectionPool] = ConnectionPool,
+        connection_pool: ConnectionPool | None = None,
+        **kwargs,
+    ):
+        # Pass a connection_pool to share it with the rest of the application
         self.app = app
-        self.pool = connection_pool_class.from_url(url, **kwargs)
+        self.pool = connection_pool or connection_pool_class.from_url(url, **kwargs)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         scope["redis"] = redis.Redis(connection_pool=self.pool)
@@ -23,8 +44,9 @@ class RedisMiddleware:
 
 
 class SessionBackend:
-    def __init__(self, client: redis.Redis, prefix: str = "guardian:session:"):
+    def __init__(self, client: redis.Redis, serializer: Serializer | None = None, prefix: str = "guardian:session:"):
         self.client = client
+        self.serializer = serializer or Serializer()
         self.key_prefix = prefix
 
     def get_key(self, session_id: str) -> str:
@@ -32,14 +54,74 @@ class SessionBackend:
 
     async def get(self, session_id: str) -> dict[str, Any]:
         if data := await self.client.get(self.get_key(session_id)):
-            return json.loads(data)
+            try:
+                return self.serializer.loads(data)
+            except (CodecUnavailableError, ValueError):
+                # Written by a codec this worker lacks or corrupt, treated like an expired session
+                await self.delete(session_id)
         return {}
 
-    async def set(self, data: dict, max_age: int) -> str:
-        session_id = str(uuid.uuid4())
-        await self.client.setex(self.get_key(session_id), max_age, json.dumps(data))
+    async def set(self, data: dict, max_age: int, session_id: str | None = None) -> str:
+        session_id = session_id or str(uuid.uuid4())
+        await self.client.setex(self.get_key(session_id), max_age, self.serializer.dumps(data))
         return session_id
 
+    async def touch(self, session_id: str, max_age: int) -> bool:
+        return await self.client.expire(self.get_key(session_id), max_age)
+
+    async def delete(self, session_id: str) -> None:
+        await self.client.delete(self.get_key(session_id))
+
+
+class Session(MutableMapping[str, Any]):
+    """Session data, loaded from the backend on first use and tracking its own changes.
+
+    Nothing is read from the backend until `load` is awaited, routes do that through
+    the `guardian.dependencies.get_session` dependency. Changes are only tracked
+    for top-level keys, so nested values have to be re-assigned to be persisted.
+    """
+
+    def __init__(self, backend: SessionBackend, session_id: str | None = None, data: dict[str, Any] | None = None):
+        self.backend = backend
+        self.session_id = session_id
+        self.loaded = session_id is None  # without a session id there is nothing to load
+        self.modified = False
+        self.initially_empty = not data
+        self._data: dict[str, Any] = data or {}
+
+    async def load(self) -> "Session":
+        if not self.loaded:
+            self._data = await self.backend.get(self.session_id)
+            if not self._data:
+                # Expired or unknown, a new id will be issued when something gets stored
+                self.session_id = None
+            self.initially_empty = not self._data
+            self.loaded = True
+        return self
+
+    @property
+    def data(self) -> dict[str, Any]:
+        if not self.loaded:
+            raise RuntimeError("Session accessed before it was loaded, depend on guardian.dependencies.get_session")
+        return self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key: str) -> None:
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
 
 class SessionMiddleware:
     def __init__(  # pylint: disable=too-many-arguments
@@ -51,13 +133,28 @@ class SessionMiddleware:
         path: str = "/",
         same_site: Literal["lax", "strict", "none"] = "lax",
         https_only: bool = False,
+        serializer: Serializer | None = None,
+        backend: Literal["redis", "cookie"] = "redis",
+        max_cookie_size: int = 4096,
+        encryption_key: str | None = None,
     ) -> None:
         self.app = app
+        self.serializer = serializer or Serializer()
+        self.cookie_sessions = backend == "cookie"
+        self.max_cookie_size = max_cookie_size
+        self.fernet = None
+        self.decrypt_errors: tuple[type[Exception], ...] = ()
+        if encryption_key:
+            # cryptography is only imported for encrypted cookie sessions, it is slow to import
+            from cryptography.fernet import Fernet, InvalidToken  # pylint: disable=import-outside-toplevel
+
+            self.fernet = Fernet(encryption_key)
+            self.decrypt_errors = (InvalidToken,)
         self.signer = itsdangerous.TimestampSigner(str(secret_key))
         self.session_cookie = session_cookie
         self.max_age = max_age
         self.path = path
-        self.security_flags = "httponly; samesite=none" + same_site
+        self.security_flags = "httponly; samesite=" + same_site
         if https_only:  # Secure flag can be used with HTTPS only
             self.security_flags += "; secure"
 
@@ -69,19 +166,68 @@ class SessionMiddleware:
 
         return f"{self.session_cookie}={data}; path={self.path}; {expires}{max_age}{self.security_flags}"
 
-    async def extract_data_from_cookies(self, cookies: dict[str, str], backend: SessionBackend) -> dict[str, Any]:
-        if self.session_cookie in cookies:
-            signed_key = cookies[self.session_cookie]
-            try:
-                key = self.signer.unsign(signed_key, max_age=self.max_age).decode("utf-8")
-                return await backend.get(key)
-            except BadSignature:
-                return {}
-        return {}
+    def encode_cookie_session(self, data: dict[str, Any]) -> str:
+        payload = self.serializer.dumps(data)
+        if self.fernet is not None:
+            return self.fernet.encrypt(payload).decode("ascii")
+        return base64.urlsafe_b64encode(payload).rstrip(b"=").decode("ascii")
+
+    def decode_cookie_session(self, value: str) -> dict[str, Any]:
+        try:
+            if self.fernet is not None:
+                payload = self.fernet.decrypt(value.encode("ascii"), ttl=self.max_age)
+            else:
+                payload = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+            return self.serializer.loads(payload)
+        except (*self.decrypt_errors, binascii.Error, CodecUnavailableError, ValueError):
+            return {}
+
+    def load_session(self, cookies: dict[str, str], backend: SessionBackend) -> Session:
+        if self.session_cookie not in cookies:
+            return Session(backend)
+        try:
+            value = self.signer.unsign(cookies[self.session_cookie], max_age=self.max_age).decode("utf-8")
+        except BadSignature:
+            return Session(backend)
+
+        if value.startswith(COOKIE_SESSION_PREFIX):
+            # Accepted even when the Redis backend is selected, so switching backends keeps sessions
+            return Session(backend, data=self.decode_cookie_session(value.removeprefix(COOKIE_SESSION_PREFIX)))
+        return Session(backend, session_id=value)
+
+    async def store_session(self, session: Session, backend: SessionBackend) -> str | None:
+        """Persist the session if needed and return the cookie value to send, if any."""
+        if not session.loaded:
+            # Never accessed during this request, there is nothing to write or refresh
+            return None
+
+        if session and self.cookie_sessions:
+            if not session.modified and session.session_id is None:
+                # Unchanged and already held by the cookie
+                return None
+            value = self.signer.sign(COOKIE_SESSION_PREFIX + self.encode_cookie_session(dict(session))).decode("utf-8")
+            if len(self.get_cookie_value(value)) <= self.max_cookie_size:
+                if session.session_id is not None:
+                    # Moved out of Redis
+                    await backend.delete(session.session_id)
+                return value
+            # Too large for a cookie, fall back to Redis
+
+        if session:
+            if session.modified or session.session_id is None:
+                session.session_id = await backend.set(dict(session), self.max_age, session.session_id)
+            else:
+                # Unchanged, only slide the expiry of the stored session
+                await backend.touch(session.session_id, self.max_age)
+            return self.signer.sign(session.session_id).decode("utf-8")
+
+        if not session.initially_empty:
+            # The session has been cleared.
+            if session.session_id is not None:
+                await backend.delete(session.session_id)
+            return "null"
 
-    async def store_session_data(self, data: dict, backend: SessionBackend) -> str:
-        session_id = await backend.set(data, self.max_age)
-        return self.signer.sign(session_id).decode("utf-8")
+        return None
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] not in ("http", "websocket"):  # pragma: no cover
@@ -89,25 +235,135 @@ class SessionMiddleware:
             return
 
         connection = HTTPConnection(scope)
-        initial_session_was_empty = True
+        backend = SessionBackend(scope["redis"], self.serializer)
 
-        backend = SessionBackend(scope["redis"])
-
-        scope["session"] = await self.extract_data_from_cookies(connection.cookies, backend)
+        scope["session"] = self.load_session(connection.cookies, backend)
 
         async def send_wrapper(message: Message) -> None:
             if message["type"] == "http.response.start":
-                if scope["session"]:
-                    # We have session data to persist.
-                    headers = MutableHeaders(scope=message)
-                    data = await self.store_session_data(scope["session"], backend)
-                    header_value = self.get_cookie_value(data)
-                    headers.append("Set-Cookie", header_value)
-                elif not initial_session_was_empty:
-                    # The session has been cleared.
+                if cookie_value := await self.store_session(scope["session"], backend):
                     headers = MutableHeaders(scope=message)
-                    header_value = self.get_cookie_value("null")
-                    headers.append("Set-Cookie", header_value)
+                    headers.append("Set-Cookie", self.get_cookie_value(cookie_value))
             await send(message)
 
         await self.app(scope, receive, send_wrapper)
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    """The admission budget of a group of routes, lower `priority` values are admitted first."""
+
+    name: str
+    concurrency: int
+    queue_time: float
+    priority: int = 0
+
+
+class AdmissionMiddleware:
+    """Sheds load per route before a request reaches the session, Redis or the provider.
+
+    Requests to the paths in `routes` hold a slot while they run: at most
+    `concurrency` in total and at most `RouteLimit.concurrency` per route
+    group. A request without a free slot waits up to `RouteLimit.queue_time`
+    seconds and is then answered with a 503 and Retry-After. Freed slots go
+    to the waiting request with the lowest priority value, oldest first, so
+    keeping the interactive groups' limits below `concurrency` leaves room for
+    introspection however many logins are queued. Other paths pass through.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: dict[str, RouteLimit],
+        concurrency: int,
+        retry_after: int = 1,
+        metrics: Registry = registry,
+    ):
+        self.app = app
+        self.routes = routes
+        self.concurrency = concurrency
+        self.retry_after = retry_after
+        self.active = 0
+        self.active_by_group: dict[str, int] = {}
+        self.waiters: list[tuple[int, int, RouteLimit, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+        self.wait_time = metrics.histogram("admission_wait_seconds")
+        self.rejected = metrics.counter("admission_rejected_total")
+        metrics.gauge("admission_active", lambda: self.active)
+        metrics.gauge("admission_queued", lambda: len(self.waiters))
+
+    def _fits(self, limit: RouteLimit) -> bool:
+        return self.active < self.concurrency and self.active_by_group.get(limit.name, 0) < limit.concurrency
+
+    def _admit(self, limit: RouteLimit):
+        self.active += 1
+        self.active_by_group[limit.name] = self.active_by_group.get(limit.name, 0) + 1
+
+    def _release(self, limit: RouteLimit):
+        self.active -= 1
+        self.active_by_group[limit.name] -= 1
+        # Slots are handed over directly, so a new arrival cannot take one from a waiting request
+        skipped = []
+        while self.waiters and self.active < self.concurrency:
+            entry = heapq.heappop(self.waiters)
+            waiter_limit, future = entry[2], entry[3]
+            if self._fits(waiter_limit):
+                self._admit(waiter_limit)
+                future.set_result(None)
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.waiters, entry)
+
+    async def _acquire(self, limit: RouteLimit) -> bool:
+        if self._fits(limit):
+            self._admit(limit)
+            return True
+        if limit.queue_time <= 0:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (limit.priority, next(self._sequence), limit, future)
+        heapq.heappush(self.waiters, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), limit.queue_time)
+            return True
+        except asyncio.TimeoutError:
+            if future.done():  # admitted just as the budget ran out
+                return True
+            self._withdraw(entry)
+            return False
+        except BaseException:
+            if future.done():
+                self._release(limit)
+            else:
+                self._withdraw(entry)
+            raise
+
+    def _withdraw(self, entry: tuple[int, int, RouteLimit, asyncio.Future]):
+        entry[3].cancel()
+        self.waiters.remove(entry)
+        heapq.heapify(self.waiters)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limit = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        admitted = await self._acquire(limit)
+        self.wait_time.observe(time.perf_counter() - start)
+        if not admitted:
+            self.rejected.inc()
+            response = JSONResponse(
+                {"detail": "Service busy"}, status_code=503, headers={"Retry-After": str(self.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._release(limit)
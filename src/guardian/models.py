@@ -19,7 +19,7 @@ class GrantType(Enum):
 
 class User(BaseModel):
     email: EmailStr
-    password: str = Field(min_length=8, max_length=128)
+    password: str = Field(min_length=8, max_length=128)  # stored as a hash, see guardian.passwords
     first_name: str = Field(default="", max_length=150)
     last_name: str = Field(default="", max_length=150)
     is_active: bool = True
@@ -31,28 +31,32 @@ class User(BaseModel):
 
 class Client(BaseModel):
     client_id: str = Field(default_factory=uuid_str, max_length=36)  # unique client id
+    client_secret: str = ""  # hash of the secret, empty for public clients
     grant_type: GrantType = GrantType.AUTHORIZATION_CODE
     response_type: str
     scopes: list[str]
     default_scopes: list[str]
     redirect_uris: list[str]
     default_redirect_uri: list[str]
+    can_introspect: bool = False  # resource servers and gateways introspecting any client's tokens
 
 
 class BearerToken(BaseModel):
     client_id: str
     scopes: list[str]
     access_token: str = Field(max_length=100)  # unique
-    refresh_token: str = Field(max_length=100)  # unique
+    refresh_token: str | None = Field(default=None, max_length=100)  # unique
     expires_at: datetime
+    username: str | None = None  # resource owner, None for client credentials
 
 
 class AuthorizationCode(BaseModel):
     client_id: str
-    user: User
+    username: str | None = None
     scopes: list[str]
     redirect_uri: str
     code: str = Field(max_length=100)  # unique
     expires_at: datetime
     challenge: str = Field(default="", max_length=128)
     challenge_method: str = Field(default="", max_length=6)
+    nonce: str | None = None
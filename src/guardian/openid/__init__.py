@@ -1,12 +1,79 @@
-from oauthlib.openid import Server
+"""The OpenID Connect provider.
 
-from .request_validator import validator
-from .utils import enable_oauthlib_debug, extract_params
+Names are imported from their submodule on first use, so importing one of
+them, e.g. ProviderBusyError for an exception handler, does not import oauthlib,
+PyJWT and cryptography. The provider itself is built on first use as well.
+"""
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from oauthlib.openid import Server
+
+    from .discovery import CachedDocument, DiscoveryDocumentCache
+    from .executor import ProviderBusyError, ProviderExecutor
+    from .introspection import INTROSPECTION_HEADERS, BatchIntrospectEndpoint, expires_at, introspection_params
+    from .keys import KeyManager, SigningKey
+    from .request_validator import RequestValidator
+    from .tokens import JWTAccessTokens
+    from .utils import enable_oauthlib_debug, extract_params
+    from .validator import DynamoDBRequestValidator, validator
+
+    provider: Server
+
+_SUBMODULES = {
+    "INTROSPECTION_HEADERS": "introspection",
+    "BatchIntrospectEndpoint": "introspection",
+    "CachedDocument": "discovery",
+    "DiscoveryDocumentCache": "discovery",
+    "DynamoDBRequestValidator": "validator",
+    "JWTAccessTokens": "tokens",
+    "KeyManager": "keys",
+    "ProviderBusyError": "executor",
+    "ProviderExecutor": "executor",
+    "RequestValidator": "request_validator",
+    "SigningKey": "keys",
+    "enable_oauthlib_debug": "utils",
+    "expires_at": "introspection",
+    "extract_params": "utils",
+    "introspection_params": "introspection",
+    "validator": "validator",
+}
 
 __all__ = [
+    "INTROSPECTION_HEADERS",
+    "BatchIntrospectEndpoint",
+    "CachedDocument",
+    "DiscoveryDocumentCache",
+    "DynamoDBRequestValidator",
+    "JWTAccessTokens",
+    "KeyManager",
+    "ProviderBusyError",
+    "ProviderExecutor",
+    "RequestValidator",
+    "SigningKey",
     "enable_oauthlib_debug",
+    "expires_at",
     "extract_params",
+    "introspection_params",
     "provider",
+    "validator",
 ]
 
-provider = Server(validator)
+
+def __getattr__(name: str) -> Any:
+    if name == "provider":
+        from oauthlib.openid import Server  # pylint: disable=import-outside-toplevel
+
+        value = Server(__getattr__("validator"))
+    elif name in _SUBMODULES:
+        value = getattr(importlib.import_module(f".{_SUBMODULES[name]}", __name__), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value  # later lookups find it without calling __getattr__
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *__all__])
@@ -0,0 +1,92 @@
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import Request
+from fastapi.responses import Response
+from oauthlib.oauth2 import MetadataEndpoint
+from oauthlib.openid import Server
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 7232, section 3.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+
+@dataclass(frozen=True)
+class CachedDocument:
+    """A pre-rendered response body with a strong ETag, served as 200 or 304."""
+
+    body: bytes
+    etag: str
+    headers: dict[str, str]
+
+    @classmethod
+    def create(cls, body: str | bytes, headers: dict[str, str], max_age: int) -> "CachedDocument":
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        return cls(
+            body=body,
+            etag=etag,
+            headers={**headers, "ETag": etag, "Cache-Control": f"public, max-age={max_age}"},
+        )
+
+    def response(self, request: Request) -> Response:
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            headers = {key: value for key, value in self.headers.items() if key != "Content-Type"}
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, status_code=200, headers=self.headers)
+
+
+def discovery_claims(request: Request) -> dict:
+    return {
+        "issuer": f"{request.base_url}",
+        "scopes_supported": ["openid", "email", "profile"],
+        "grant_types_supported": [
+            "authorization_code",
+            "client_credentials",
+        ],
+        "token_endpoint": f"{request.url_for('token')}",
+        "authorization_endpoint": f"{request.url_for('authorize')}",
+        "revocation_endpoint": f"{request.url_for('revoke_token')}",
+        "introspection_endpoint": f"{request.url_for('introspect')}",
+        "userinfo_endpoint": f"{request.url_for('userinfo')}",
+        "jwks_uri": f"{request.url_for('jwks')}",
+    }
+
+
+class DiscoveryDocumentCache:
+    """Rendered OpenID discovery documents, one per base URL.
+
+    The document only depends on the base URL the API is reached under, so it
+    is built with a MetadataEndpoint once per base URL and then served from
+    memory. The number of cached base URLs is bounded, as they come from the
+    Host header.
+    """
+
+    def __init__(self, server: Server, max_age: int, maxsize: int = 16):
+        self.server = server
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self.documents: OrderedDict[str, CachedDocument] = OrderedDict()
+
+    def render(self, request: Request) -> CachedDocument:
+        endpoint = MetadataEndpoint([self.server], claims=discovery_claims(request))
+        headers, body, _ = endpoint.create_metadata_response(str(request.url), "GET")
+        return CachedDocument.create(body, headers, self.max_age)
+
+    def get(self, request: Request) -> CachedDocument:
+        key = str(request.base_url)
+        if key in self.documents:
+            self.documents.move_to_end(key)
+            return self.documents[key]
+
+        document = self.documents[key] = self.render(request)
+        if len(self.documents) > self.maxsize:
+            self.documents.popitem(last=False)
+        return document
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from collections.abc import Callable, Coroutine
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, TypeVar
+
+from structlog import get_logger
+
+from guardian.metrics import Registry, registry
+
+log = get_logger()
+
+T = TypeVar("T")
+
+
+class ProviderBusyError(Exception):
+    """Raised when more provider calls are pending than the executor accepts."""
+
+
+class ProviderExecutor:
+    """Runs the synchronous oauthlib Server off the event loop, in a bounded thread pool.
+
+    The validator does database I/O and hashing, so calling the provider from an
+    `async def` route would block the event loop for the whole call. Calls are
+    instead handed to `max_workers` threads, with at most `max_pending` calls
+    running or queued at once; beyond that `run` fails fast with ProviderBusyError.
+
+    Validator methods running in the pool use `run_coroutine` to await the
+    application's async Redis and DynamoDB clients on the event loop.
+
+    A cancelled `run` cannot stop a call its thread already started, so the
+    call stays counted as pending until the thread finishes it.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_pending: int,
+        bridge_timeout: float | None = None,
+        metrics: Registry = registry,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.bridge_timeout = bridge_timeout
+        self.pending = 0
+        self.active = 0
+        self._active_lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        self.wait_time = metrics.histogram("provider_executor_wait_seconds")
+        self.run_time = metrics.histogram("provider_executor_run_seconds")
+        self.rejected = metrics.counter("provider_executor_rejected_total")
+        metrics.gauge("provider_executor_queue_depth", lambda: self.queue_depth)
+        metrics.gauge("provider_executor_active", lambda: self.active)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.pending - self.active, 0)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="oauthlib-provider")
+        log.info(f"Started oauthlib provider executor with {self.max_workers} threads")
+
+    async def shutdown(self):
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _call(self, submitted: float, fn: Callable[..., T], args: tuple, kwargs: dict) -> T:
+        started = time.perf_counter()
+        self.wait_time.observe(started - submitted)
+        with self._active_lock:
+            self.active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._active_lock:
+                self.active -= 1
+            self.run_time.observe(time.perf_counter() - started)
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        if self._executor is None:
+            raise RuntimeError("ProviderExecutor.start() has not been awaited")
+        if self.pending >= self.max_pending:
+            self.rejected.inc()
+            raise ProviderBusyError(f"{self.pending} provider calls already pending")
+
+        self.pending += 1
+        future = self._executor.submit(self._call, time.perf_counter(), fn, args, kwargs)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future: Future):
+        # Runs in the provider thread, or in the loop when a queued call is cancelled
+        self._loop.call_soon_threadsafe(self._decrement_pending)
+
+    def _decrement_pending(self):
+        self.pending -= 1
+
+    def run_coroutine(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine on the event loop from a provider thread and wait for its result."""
+        if self._loop is None:
+            raise RuntimeError("ProviderExecutor.start() has not been awaited")
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            coro.close()
+            raise RuntimeError("run_coroutine would deadlock the event loop, await the coroutine instead")
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(self.bridge_timeout)
+        except FutureTimeoutError:
+            # Left running, the coroutine would keep its connection after the caller gave up on it
+            future.cancel()
+            raise
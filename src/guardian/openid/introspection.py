@@ -0,0 +1,84 @@
+import json
+from urllib.parse import parse_qsl
+
+import jwt
+from oauthlib.common import Request
+from oauthlib.oauth2 import InvalidRequestError, OAuth2Error
+from oauthlib.oauth2.rfc6749.endpoints.base import BaseEndpoint, catch_errors_and_unavailability
+
+from .tokens import JWTAccessTokens, is_jwt
+
+# The headers oauthlib answers introspection requests with
+INTROSPECTION_HEADERS = {"Content-Type": "application/json", "Cache-Control": "no-store", "Pragma": "no-cache"}
+
+
+def token_id(token: str) -> str:
+    """The id a token is revoked under, the jti of a JWT access token or the token itself.
+
+    The JWT is not verified here, the id only selects the introspection cache group.
+    """
+    if is_jwt(token):
+        try:
+            return JWTAccessTokens.token_id(token)
+        except (jwt.InvalidTokenError, KeyError):
+            pass
+    return token
+
+
+def introspection_params(body: bytes, headers: dict[str, str]) -> tuple[str, str, str] | None:
+    """The token id, token and client credentials of an introspection request, None without a token."""
+    params = dict(parse_qsl(body.decode("utf-8", errors="replace")))
+    token = params.get("token")
+    if not token:
+        return None
+    credentials = "\0".join(
+        (headers.get("authorization", ""), params.get("client_id", ""), params.get("client_secret", ""))
+    )
+    return token_id(token), token, credentials
+
+
+def expires_at(body: str) -> float | None:
+    return json.loads(body).get("exp")
+
+
+class BatchIntrospectEndpoint(BaseEndpoint):
+    """Token introspection (RFC 7662) of up to `max_tokens` tokens per request.
+
+    The request is an introspection request with the `token` parameter
+    repeated. The client is authenticated once for the whole batch, the
+    tokens are fetched with bulk reads, and the response lists the
+    introspection response of every token, in request order, as "results".
+    """
+
+    def __init__(self, request_validator, max_tokens: int):
+        super().__init__()
+        self.request_validator = request_validator
+        self.max_tokens = max_tokens
+        self.valid_request_methods = ("POST",)
+
+    @catch_errors_and_unavailability
+    def create_batch_introspect_response(
+        self, uri: str, http_method: str = "POST", body: bytes | None = None, headers: dict[str, str] | None = None
+    ) -> tuple[dict[str, str], str, int]:
+        request = Request(uri, http_method, body, headers)
+        try:
+            tokens = self.validate_batch_introspect_request(request)
+        except OAuth2Error as e:
+            return {**INTROSPECTION_HEADERS, **e.headers}, e.json, e.status_code
+
+        results = [
+            {"active": False} if claims is None else {**claims, "active": True}
+            for claims in self.request_validator.introspect_tokens(tokens, request)
+        ]
+        return INTROSPECTION_HEADERS, json.dumps({"results": results}), 200
+
+    def validate_batch_introspect_request(self, request: Request) -> list[str]:
+        self._raise_on_bad_method(request)
+        self._raise_on_bad_post_request(request)
+        tokens = [value for name, value in request.decoded_body or [] if name == "token" and value]
+        if not tokens:
+            raise InvalidRequestError(request=request, description="Missing token parameter.")
+        if len(tokens) > self.max_tokens:
+            raise InvalidRequestError(request=request, description=f"At most {self.max_tokens} tokens per request.")
+        self._raise_on_invalid_client(request)
+        return tokens
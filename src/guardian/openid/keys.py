@@ -0,0 +1,194 @@
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from structlog import get_logger
+
+from .discovery import CachedDocument
+
+log = get_logger()
+
+
+def b64url_uint(value: int) -> str:
+    data = value.to_bytes((value.bit_length() + 7) // 8 or 1, "big")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    """An RSA key pair, parsed once, with its public JWK and key id."""
+
+    kid: str
+    private_key: rsa.RSAPrivateKey
+    public_key: rsa.RSAPublicKey
+    jwk: dict[str, str]
+    created_at: float
+
+    @classmethod
+    def from_private_key(cls, private_key: rsa.RSAPrivateKey, created_at: float) -> "SigningKey":
+        numbers = private_key.public_key().public_numbers()
+        jwk = {"e": b64url_uint(numbers.e), "kty": "RSA", "n": b64url_uint(numbers.n)}
+        # The key id is the JWK thumbprint (RFC 7638), so every worker derives the same one
+        thumbprint = hashlib.sha256(json.dumps(jwk, separators=(",", ":"), sort_keys=True).encode("ascii"))
+        kid = base64.urlsafe_b64encode(thumbprint.digest()).rstrip(b"=").decode("ascii")
+        return cls(
+            kid=kid,
+            private_key=private_key,
+            public_key=private_key.public_key(),
+            jwk={**jwk, "kid": kid, "use": "sig", "alg": KeyManager.algorithm},
+            created_at=created_at,
+        )
+
+    @classmethod
+    def from_file(cls, path: Path) -> "SigningKey":
+        private_key = serialization.load_pem_private_key(path.read_bytes(), password=None)
+        if not isinstance(private_key, rsa.RSAPrivateKey):
+            raise ValueError(f"{path} is not an RSA private key")
+        return cls.from_private_key(private_key, created_at=path.stat().st_mtime)
+
+    @classmethod
+    def generate(cls, created_at: float) -> "SigningKey":
+        return cls.from_private_key(rsa.generate_private_key(public_exponent=65537, key_size=2048), created_at)
+
+
+class KeyManager:
+    """The keys signing ID tokens and JWT access tokens, and the JWKS publishing them.
+
+    Keys are parsed once and kept as key objects, so signing and verifying
+    never touch PEM. Tokens name their key in the `kid` header, and are
+    verified with any published key.
+
+    Keys either come from `directory`, one PEM file per key, or are generated
+    in process. Generated keys only verify in the process that generated
+    them, so with several workers or replicas `directory` must be shared and
+    `allow_generated` turned off, which makes a missing directory fail
+    startup. A new key is published for `activation_delay` seconds before
+    it signs, so relying parties caching the JWKS see it before the first token
+    signed with it. Generated keys are rotated every `rotation_interval`
+    seconds, and a replaced key stays published for `retention` seconds, which
+    must cover the longest token lifetime. Keys in `directory` are rotated by
+    adding a newer file and retired by deleting the old one.
+    """
+
+    algorithm = "RS256"
+
+    def __init__(
+        self,
+        directory: Path | None = None,
+        activation_delay: float = 0.0,
+        rotation_interval: float = 0.0,
+        retention: float = 0.0,
+        refresh_interval: float = 60.0,
+        jwks_max_age: int = 300,
+        allow_generated: bool = True,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.directory = directory
+        self.activation_delay = activation_delay
+        self.rotation_interval = rotation_interval
+        self.retention = retention
+        self.refresh_interval = refresh_interval
+        self.jwks_max_age = jwks_max_age
+        self.clock = clock
+        self.keys: dict[str, SigningKey] = {}
+        self.signing_key: SigningKey | None = None
+        self.jwks: CachedDocument | None = None
+        self._files: dict[Path, tuple[float, SigningKey]] = {}
+        self._task: asyncio.Task | None = None
+
+        if directory is None:
+            if not allow_generated:
+                raise RuntimeError("No signing keys directory, generated keys would only verify in this process")
+            log.warning("Signing tokens with generated keys, they only verify in this process")
+        self.refresh()
+
+    def refresh(self):
+        """Reload `directory` or rotate the generated key when due, then pick the signing key."""
+        now = self.clock()
+        if self.directory is not None:
+            keys = self._load_directory()
+        else:
+            keys = list(self.keys.values())
+            newest = max((key.created_at for key in keys), default=None)
+            if newest is None or (self.rotation_interval > 0 and now - newest >= self.rotation_interval):
+                keys.append(SigningKey.generate(created_at=now))
+                log.info("Generated a new signing key")
+            keys = self._retained(keys, now)
+
+        keys.sort(key=lambda key: key.created_at)
+        active = [key for key in keys if key.created_at + self.activation_delay <= now]
+        signing_key = active[-1] if active else keys[0] if keys else None
+        if signing_key is None:
+            raise RuntimeError(f"No signing keys in {self.directory}")
+
+        # Keys are added before they sign, so a token is never signed with a key missing here
+        self.keys = {key.kid: key for key in keys}
+        if signing_key is not self.signing_key:
+            log.info(f"Signing tokens with key {signing_key.kid}")
+        self.signing_key = signing_key
+        body = json.dumps({"keys": [key.jwk for key in keys]})
+        self.jwks = CachedDocument.create(body, {"Content-Type": "application/json"}, self.jwks_max_age)
+
+    def _load_directory(self) -> list[SigningKey]:
+        files = {}
+        for path in sorted(self.directory.glob("*.pem")):
+            mtime = path.stat().st_mtime
+            cached = self._files.get(path)
+            if cached is not None and cached[0] == mtime:
+                files[path] = cached
+                continue
+            try:
+                files[path] = (mtime, SigningKey.from_file(path))
+            except (OSError, ValueError) as e:
+                log.error(f"Could not load signing key {path}: {e}")
+        self._files = files
+        return [key for _, key in files.values()]
+
+    def _retained(self, keys: list[SigningKey], now: float) -> list[SigningKey]:
+        # A key stops signing once its successor is active, and is dropped `retention` seconds later
+        keys = sorted(keys, key=lambda key: key.created_at)
+        retained = []
+        for key, successor in zip(keys, [*keys[1:], None]):
+            if successor is None or successor.created_at + self.activation_delay + self.retention > now:
+                retained.append(key)
+        return retained
+
+    def sign(self, claims: dict) -> str:
+        key = self.signing_key
+        return jwt.encode(claims, key.private_key, algorithm=self.algorithm, headers={"kid": key.kid})
+
+    def verify(self, token: str, **kwargs) -> dict:
+        """The token's claims, raises jwt.InvalidTokenError unless a published key signed it."""
+        key = self.keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise jwt.InvalidSignatureError("Token signed with an unknown key")
+        return jwt.decode(token, key.public_key, algorithms=[self.algorithm], **kwargs)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f"Could not refresh signing keys: {e}")
+
+    def start(self):
+        if self.refresh_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="signing-key-manager")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -801,6 +801,3 @@ class OpenIDRequestValidatorMixin:
 
 class RequestValidator(BaseRequestValidator, OAuth2RequestValidatorMixin, OpenIDRequestValidatorMixin):
     pass
-
-
-validator = RequestValidator()
@@ -0,0 +1,71 @@
+import secrets
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from oauthlib.common import Request
+
+from guardian.models import BearerToken
+
+from .keys import KeyManager
+
+
+def is_jwt(token: str) -> bool:
+    return token.count(".") == 2
+
+
+class JWTAccessTokens:
+    """Self-contained access tokens, signed with RS256 and verified in process.
+
+    An instance is an oauthlib token generator, like
+    `oauthlib.oauth2.signed_token_generator`, but with per token claims: the
+    token id (jti), the resource owner (sub), the client and the scopes.
+    Tokens are signed and verified with the keys of a KeyManager.
+    """
+
+    def __init__(self, keys: KeyManager, issuer: str | None = None, leeway: float = 0):
+        self.keys = keys
+        self.issuer = issuer
+        self.leeway = leeway
+
+    def __call__(self, request: Request) -> str:
+        now = datetime.now(timezone.utc)
+        claims = {
+            "jti": secrets.token_urlsafe(16),
+            "client_id": request.client_id or request.client.client_id,
+            "scope": " ".join(request.scopes or []),
+            "iat": now,
+            "exp": now + timedelta(seconds=request.expires_in),
+        }
+        if request.user:
+            claims["sub"] = request.user
+        if self.issuer:
+            claims["iss"] = self.issuer
+        return self.keys.sign(claims)
+
+    def verify(self, token: str) -> dict | None:
+        try:
+            return self.keys.verify(
+                token,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={"require": ["jti", "exp", "client_id"]},
+            )
+        except jwt.InvalidTokenError:
+            return None
+
+    @staticmethod
+    def token_id(token: str) -> str:
+        # The signature is not checked, so a client can present any jti: outside tokens this process just
+        # signed, it only groups introspection cache entries (see IntrospectionCache) and never authorizes
+        return jwt.decode(token, options={"verify_signature": False})["jti"]
+
+    @staticmethod
+    def to_bearer_token(claims: dict) -> BearerToken:
+        """The stored form of a JWT access token, identified by its jti."""
+        return BearerToken(
+            client_id=claims["client_id"],
+            username=claims.get("sub"),
+            scopes=claims.get("scope", "").split(),
+            access_token=claims["jti"],
+            expires_at=datetime.utcfromtimestamp(claims["exp"]),
+        )
@@ -0,0 +1,540 @@
+import base64
+import binascii
+from collections.abc import Callable, Coroutine
+from datetime import datetime, timedelta, timezone
+from typing import Any, TypeVar
+from urllib.parse import unquote_plus, urlsplit
+
+from oauthlib.common import Request
+from oauthlib.oauth2 import InvalidGrantError
+from pydantic import BaseModel
+from structlog import get_logger
+
+from guardian.database.code_store import CodeStore
+from guardian.database.repository import (
+    AUTHORIZATION_CODE,
+    BEARER_TOKEN,
+    CLIENT,
+    REFRESH_TOKEN,
+    USER,
+    EntityRef,
+    Repository,
+    WriteConflictError,
+)
+from guardian.database.revocation import RevocationList
+from guardian.database.token_store import TokenStore
+from guardian.models import AuthorizationCode, BearerToken, Client, GrantType, User
+from guardian.passwords import (
+    PasswordHasher,
+    PasswordHasherBusyError,
+    verify_client_secret,
+    verify_password,
+)
+
+from .keys import KeyManager
+from .request_validator import RequestValidator
+from .tokens import JWTAccessTokens, is_jwt
+
+T = TypeVar("T")
+
+log = get_logger()
+
+AUTHORIZATION_CODE_TTL = timedelta(minutes=10)  # RFC 6749, section 4.1.2 recommends at most 10 minutes
+ID_TOKEN_TTL = timedelta(hours=1)
+
+# Grants a client may use on top of the one it was registered for
+IMPLIED_GRANT_TYPES = {
+    GrantType.AUTHORIZATION_CODE: {GrantType.REFRESH_TOKEN},
+    GrantType.PASSWORD: {GrantType.REFRESH_TOKEN},
+}
+
+
+def client_credentials(request: Request) -> tuple[str | None, str | None]:
+    """The client id and secret, from HTTP Basic authentication or the request body."""
+    scheme, _, value = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "basic" and value:
+        try:
+            client_id, _, secret = base64.b64decode(value, validate=True).decode("utf-8").partition(":")
+        except (binascii.Error, UnicodeDecodeError):
+            return None, None
+        return unquote_plus(client_id), unquote_plus(secret)
+    return request.client_id, request.client_secret
+
+
+def issuer(uri: str) -> str:
+    """The issuer identifier, the base URL the discovery document is served under."""
+    parts = urlsplit(uri)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+class DynamoDBRequestValidator(RequestValidator):
+    """RequestValidator storing clients, users, codes and tokens in the DynamoDB table.
+
+    oauthlib calls the validator synchronously from the provider threads, so
+    every repository call is handed to `run`, which awaits it on the event loop
+    (see ProviderExecutor.run_coroutine). Both are bound in the application
+    lifespan, once the DynamoDB client exists.
+
+    oauthlib asks for the same client, code or token from several callbacks,
+    so every entity read or written is kept in an identity map on the oauthlib
+    Request and fetched at most once per HTTP request. The entities a token
+    request needs are fetched up front with one BatchGetItem call in
+    `prefetch`, and the token is saved in the same transaction that redeems
+    the code or rotates the refresh token.
+
+    Tokens are read and written through `tokens`, the repository itself or a
+    TokenStore caching access tokens in Redis. When the provider issues JWT
+    access tokens, `jwt_tokens` verifies them without a lookup and only their
+    revocation is checked, looking up only the ids `revocations` might hold. ID tokens are
+    signed with the current key of `keys`.
+
+    Authorization codes are kept in `codes`, a CodeStore in Redis, when given.
+    Reading a code from it consumes it, so it is fetched on its own rather
+    than in the prefetch batch and is not deleted again with the token.
+    """
+
+    def __init__(self):
+        self.repository: Repository | None = None
+        self.tokens: Repository | TokenStore | None = None
+        self.jwt_tokens: JWTAccessTokens | None = None
+        self.revocations: RevocationList | None = None
+        self.keys: KeyManager | None = None
+        self.codes: CodeStore | None = None
+        self.passwords: PasswordHasher | None = None
+        self._run: Callable[[Coroutine[Any, Any, Any]], Any] | None = None
+
+    def bind(
+        self,
+        repository: Repository,
+        run: Callable[[Coroutine[Any, Any, Any]], Any],
+        tokens: TokenStore | None = None,
+        jwt_tokens: JWTAccessTokens | None = None,
+        revocations: RevocationList | None = None,
+        keys: KeyManager | None = None,
+        codes: CodeStore | None = None,
+        passwords: PasswordHasher | None = None,
+    ):
+        self.repository = repository
+        self.tokens = tokens or repository
+        self.jwt_tokens = jwt_tokens
+        self.revocations = revocations
+        self.keys = keys
+        self.codes = codes
+        self.passwords = passwords
+        self._run = run
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        if self._run is None:
+            coro.close()
+            raise RuntimeError("The request validator is not bound to a repository")
+        return self._run(coro)
+
+    # Entity lookup
+
+    @staticmethod
+    def entities(request: Request) -> dict[EntityRef, BaseModel | None]:
+        """The request's identity map, None marks an entity known not to exist."""
+        if getattr(request, "entities", None) is None:
+            request.entities = {}
+        return request.entities
+
+    def prefetch(self, request: Request):
+        """Fetch the client and the grant of a token request with a single BatchGetItem call."""
+        entities = self.entities(request)
+        client_id, _ = client_credentials(request)
+        refs = [EntityRef(CLIENT, client_id)] if client_id else []
+        consistent_read = False
+        if request.grant_type == GrantType.AUTHORIZATION_CODE.value and request.code and self.codes is None:
+            refs.append(EntityRef(AUTHORIZATION_CODE, request.code))
+            consistent_read = True
+        elif request.grant_type == GrantType.REFRESH_TOKEN.value and request.refresh_token:
+            refs.append(EntityRef(REFRESH_TOKEN, request.refresh_token))
+            consistent_read = True
+        elif request.grant_type == GrantType.PASSWORD.value and request.username:
+            refs.append(EntityRef(USER, request.username))
+
+        refs = [ref for ref in refs if ref not in entities]
+        if refs:
+            entities.update(self.run(self.repository.get_many(refs, consistent_read)))
+
+    def prefetch_tokens(self, tokens: list[str], request: Request):
+        """Fetch the tokens of a batch as access tokens, and the rest as refresh tokens, in bulk."""
+        entities = self.entities(request)
+        opaque = [token for token in dict.fromkeys(tokens) if self.jwt_tokens is None or not is_jwt(token)]
+
+        access_tokens = [token for token in opaque if EntityRef(BEARER_TOKEN, token) not in entities]
+        if access_tokens:
+            found = self.run(self.tokens.get_bearer_tokens(access_tokens))
+            entities.update({EntityRef(BEARER_TOKEN, token): found[token] for token in access_tokens})
+
+        refs = [EntityRef(REFRESH_TOKEN, token) for token in opaque if entities[EntityRef(BEARER_TOKEN, token)] is None]
+        refs = [ref for ref in refs if ref not in entities]
+        if refs:
+            entities.update(self.run(self.repository.get_many(refs, consistent_read=True)))
+
+    def _get(self, request: Request, ref: EntityRef, load: Callable[[str], Coroutine[Any, Any, T]]) -> T | None:
+        entities = self.entities(request)
+        if ref not in entities:
+            entities[ref] = self.run(load(ref.id))
+        return entities[ref]
+
+    def _client(self, client_id: str, request: Request) -> Client | None:
+        return self._get(request, EntityRef(CLIENT, client_id), self.repository.get_client)
+
+    def _code(self, code: str, request: Request) -> AuthorizationCode | None:
+        if self.codes is not None:
+            # Consumes the code, the identity map keeps it for the rest of the request
+            return self._get(request, EntityRef(AUTHORIZATION_CODE, code), self.codes.consume_authorization_code)
+        return self._get(request, EntityRef(AUTHORIZATION_CODE, code), self.repository.get_authorization_code)
+
+    def _refresh_token(self, refresh_token: str, request: Request) -> BearerToken | None:
+        return self._get(request, EntityRef(REFRESH_TOKEN, refresh_token), self.tokens.get_refresh_token)
+
+    def _bearer_token(self, access_token: str, request: Request) -> BearerToken | None:
+        if self.jwt_tokens is not None and is_jwt(access_token):
+            return self._jwt_bearer_token(access_token)
+        return self._get(request, EntityRef(BEARER_TOKEN, access_token), self.tokens.get_bearer_token)
+
+    def _jwt_bearer_token(self, access_token: str) -> BearerToken | None:
+        claims = self.jwt_tokens.verify(access_token)
+        if claims is None:
+            return None
+        # Only ids the revocation filter might contain need a lookup
+        if self.revocations is None or self.revocations.might_be_revoked(claims["jti"]):
+            if self.run(self.tokens.is_revoked(claims["jti"])):
+                return None
+        return JWTAccessTokens.to_bearer_token(claims)
+
+    def _user(self, username: str, request: Request) -> User | None:
+        return self._get(request, EntityRef(USER, username), self.repository.get_user)
+
+    # Client authentication
+
+    def client_authentication_required(self, request: Request, *args, **kwargs) -> bool:
+        self.prefetch(request)
+        client_id, secret = client_credentials(request)
+        if client_id is None or secret:
+            return True
+        client = self._client(client_id, request)
+        return client is None or bool(client.client_secret)
+
+    def authenticate_client(self, request: Request, *args, **kwargs) -> bool:
+        self.prefetch(request)
+        client_id, secret = client_credentials(request)
+        if not client_id or not secret:
+            return False
+        client = self._client(client_id, request)
+        if client is None or not client.client_secret:
+            return False
+        if not verify_client_secret(secret, client.client_secret):
+            return False
+        request.client = client
+        return True
+
+    def authenticate_client_id(self, client_id: str, request: Request, *args, **kwargs) -> bool:
+        self.prefetch(request)
+        client = self._client(client_id, request)
+        if client is None or client.client_secret:
+            return False
+        request.client = client
+        return True
+
+    def validate_client_id(self, client_id: str, request: Request, *args, **kwargs) -> bool:
+        client = self._client(client_id, request)
+        if client is None:
+            return False
+        request.client = client
+        return True
+
+    # Client registration
+
+    def get_default_redirect_uri(self, client_id: str, request: Request, *args, **kwargs) -> str | None:
+        client = self._client(client_id, request)
+        if client is None:
+            return None
+        if client.default_redirect_uri:
+            return client.default_redirect_uri[0]
+        return client.redirect_uris[0] if len(client.redirect_uris) == 1 else None
+
+    def get_default_scopes(self, client_id: str, request: Request, *args, **kwargs) -> list[str]:
+        client = self._client(client_id, request)
+        return client.default_scopes if client is not None else []
+
+    def validate_grant_type(
+        self, client_id: str, grant_type: str, client: Client, request: Request, *args, **kwargs
+    ) -> bool:
+        try:
+            requested = GrantType(grant_type)
+        except ValueError:
+            return False
+        return requested == client.grant_type or requested in IMPLIED_GRANT_TYPES.get(client.grant_type, set())
+
+    def validate_redirect_uri(self, client_id: str, redirect_uri: str, request: Request, *args, **kwargs) -> bool:
+        client = self._client(client_id, request)
+        return client is not None and redirect_uri in client.redirect_uris
+
+    def validate_response_type(
+        self, client_id: str, response_type: str, client: Client, request: Request, *args, **kwargs
+    ) -> bool:
+        return set(response_type.split()) <= set(client.response_type.split())
+
+    def validate_scopes(
+        self, client_id: str, scopes: list[str], client: Client, request: Request, *args, **kwargs
+    ) -> bool:
+        return set(scopes) <= set(client.scopes)
+
+    # Authorization codes
+
+    def save_authorization_code(self, client_id: str, code: dict, request: Request, *args, **kwargs) -> None:
+        authorization_code = AuthorizationCode(
+            client_id=client_id,
+            username=request.user,
+            scopes=request.scopes,
+            redirect_uri=request.redirect_uri,
+            code=code["code"],
+            expires_at=datetime.utcnow() + AUTHORIZATION_CODE_TTL,
+            challenge=request.code_challenge or "",
+            challenge_method=request.code_challenge_method or "",
+            nonce=request.nonce,
+        )
+        self.run((self.codes or self.repository).put_authorization_code(authorization_code))
+        self.entities(request)[EntityRef(AUTHORIZATION_CODE, authorization_code.code)] = authorization_code
+
+    def validate_code(self, client_id: str, code: str, client: Client, request: Request, *args, **kwargs) -> bool:
+        authorization_code = self._code(code, request)
+        if (
+            authorization_code is None
+            or authorization_code.client_id != client_id
+            or authorization_code.expires_at < datetime.utcnow()
+        ):
+            return False
+        request.user = authorization_code.username
+        request.scopes = authorization_code.scopes
+        return True
+
+    def confirm_redirect_uri(
+        self, client_id: str, code: str, redirect_uri: str, client: Client, request: Request, *args, **kwargs
+    ) -> bool:
+        authorization_code = self._code(code, request)
+        return authorization_code is not None and authorization_code.redirect_uri == redirect_uri
+
+    def get_code_challenge(self, code: str, request: Request) -> str | None:
+        authorization_code = self._code(code, request)
+        if authorization_code is None or not authorization_code.challenge:
+            return None
+        return authorization_code.challenge
+
+    def get_code_challenge_method(self, code: str, request: Request) -> str | None:
+        authorization_code = self._code(code, request)
+        if authorization_code is None or not authorization_code.challenge_method:
+            return None
+        return authorization_code.challenge_method
+
+    def get_authorization_code_scopes(self, client_id: str, code: str, redirect_uri: str, request) -> list[str]:
+        # The OpenID Connect dispatcher asks for the scopes before the client is authenticated
+        self.prefetch(request)
+        authorization_code = self._code(code, request)
+        return authorization_code.scopes if authorization_code is not None else []
+
+    def get_authorization_code_nonce(self, client_id: str, code: str, redirect_uri: str, request) -> str | None:
+        authorization_code = self._code(code, request)
+        return authorization_code.nonce if authorization_code is not None else None
+
+    def invalidate_authorization_code(self, client_id: str, code: str, request: Request, *args, **kwargs) -> None:
+        # Reading the code from Redis consumed it, and save_bearer_token already deleted a
+        # DynamoDB code in the transaction storing the token
+        if self.codes is None and not getattr(request, "code_redeemed", False):
+            self.run(self.repository.delete(EntityRef(AUTHORIZATION_CODE, code)))
+        self.entities(request)[EntityRef(AUTHORIZATION_CODE, code)] = None
+
+    # Tokens
+
+    def save_bearer_token(self, token: dict, request: Request, *args, **kwargs) -> None:
+        access_token = token["access_token"]
+        if self.jwt_tokens is not None and is_jwt(access_token):
+            # JWT access tokens are stored by their id, for revocation and refresh token rotation
+            access_token = self.jwt_tokens.token_id(access_token)
+
+        bearer_token = BearerToken(
+            client_id=request.client_id or request.client.client_id,
+            username=request.user,
+            scopes=request.scopes or [],
+            access_token=access_token,
+            refresh_token=token.get("refresh_token"),
+            expires_at=datetime.utcnow() + timedelta(seconds=token["expires_in"]),
+        )
+
+        consume_code = replace_refresh_token = revoke_access_token = None
+        if request.grant_type == GrantType.AUTHORIZATION_CODE.value and self.codes is None:
+            consume_code = request.code
+        elif request.grant_type == GrantType.REFRESH_TOKEN.value:
+            replace_refresh_token = request.refresh_token
+            previous = self._refresh_token(request.refresh_token, request)
+            revoke_access_token = previous
+
+        try:
+            self.run(
+                self.tokens.save_token(
+                    bearer_token,
+                    consume_code=consume_code,
+                    replace_refresh_token=replace_refresh_token,
+                    revoke_access_token=revoke_access_token,
+                )
+            )
+        except WriteConflictError as e:
+            # Another request redeemed the same code or refresh token first
+            raise InvalidGrantError(request=request) from e
+        request.code_redeemed = consume_code is not None
+
+        entities = self.entities(request)
+        if consume_code:
+            entities[EntityRef(AUTHORIZATION_CODE, consume_code)] = None
+        if replace_refresh_token:
+            entities[EntityRef(REFRESH_TOKEN, replace_refresh_token)] = None
+        if revoke_access_token is not None:
+            entities[EntityRef(BEARER_TOKEN, revoke_access_token.access_token)] = None
+        entities[EntityRef(BEARER_TOKEN, bearer_token.access_token)] = bearer_token
+        if bearer_token.refresh_token:
+            entities[EntityRef(REFRESH_TOKEN, bearer_token.refresh_token)] = bearer_token
+
+    def validate_bearer_token(self, token: str, scopes: list[str], request: Request) -> bool:
+        if not token:
+            return False
+        bearer_token = self._bearer_token(token, request)
+        if bearer_token is None or bearer_token.expires_at < datetime.utcnow():
+            return False
+        if not set(scopes or []) <= set(bearer_token.scopes):
+            return False
+        request.access_token = bearer_token
+        request.client_id = bearer_token.client_id
+        request.user = bearer_token.username
+        request.scopes = bearer_token.scopes
+        return True
+
+    def validate_refresh_token(self, refresh_token: str, client: Client, request: Request, *args, **kwargs) -> bool:
+        bearer_token = self._refresh_token(refresh_token, request)
+        if bearer_token is None or bearer_token.client_id != client.client_id:
+            return False
+        request.user = bearer_token.username
+        return True
+
+    def get_original_scopes(self, refresh_token: str, request: Request, *args, **kwargs) -> list[str]:
+        bearer_token = self._refresh_token(refresh_token, request)
+        return bearer_token.scopes if bearer_token is not None else []
+
+    def _find_token(self, token: str, token_type_hint: str | None, request: Request) -> tuple[BearerToken | None, bool]:
+        """The token record and whether `token` is its refresh token, trying the hinted type first."""
+        lookups = [(self._bearer_token, False), (self._refresh_token, True)]
+        if token_type_hint == "refresh_token":
+            lookups.reverse()
+        for find, is_refresh_token in lookups:
+            bearer_token = find(token, request)
+            if bearer_token is not None:
+                return bearer_token, is_refresh_token
+        return None, False
+
+    def introspect_token(self, token: str, token_type_hint: str, request: Request, *args, **kwargs) -> dict | None:
+        bearer_token, is_refresh_token = self._find_token(token, token_type_hint, request)
+        # RFC 7662, section 2.1: resource servers introspect tokens issued to other clients
+        if bearer_token is None or not (
+            bearer_token.client_id == request.client.client_id or request.client.can_introspect
+        ):
+            return None
+        if not is_refresh_token and bearer_token.expires_at < datetime.utcnow():
+            return None
+
+        claims = {
+            "scope": " ".join(bearer_token.scopes),
+            "client_id": bearer_token.client_id,
+            "username": bearer_token.username,
+            "token_type": "refresh_token" if is_refresh_token else "Bearer",
+        }
+        if not is_refresh_token:
+            claims["exp"] = int(bearer_token.expires_at.replace(tzinfo=timezone.utc).timestamp())
+        return {name: value for name, value in claims.items() if value is not None}
+
+    def introspect_tokens(self, tokens: list[str], request: Request) -> list[dict | None]:
+        """The introspect_token claims of every token, fetched with a few bulk reads."""
+        self.prefetch_tokens(tokens, request)
+        return [self.introspect_token(token, None, request) for token in tokens]
+
+    def revoke_token(self, token: str, token_type_hint: str, request: Request, *args, **kwargs) -> None:
+        bearer_token, is_refresh_token = self._find_token(token, token_type_hint, request)
+        # RFC 7009, section 2.1: clients may only revoke their own tokens, revoking a
+        # refresh token also revokes the access token issued with it
+        if bearer_token is not None and bearer_token.client_id == request.client.client_id:
+            self.run(self.tokens.revoke_token(bearer_token, include_refresh_token=is_refresh_token))
+            entities = self.entities(request)
+            entities[EntityRef(BEARER_TOKEN, bearer_token.access_token)] = None
+            if is_refresh_token:
+                entities[EntityRef(REFRESH_TOKEN, token)] = None
+
+    # OpenID Connect tokens
+
+    def finalize_id_token(self, id_token: dict, token: dict, token_handler, request: Request) -> str:
+        id_token["iss"] = issuer(request.uri)
+        id_token["sub"] = request.user
+        id_token["exp"] = id_token["iat"] + int(ID_TOKEN_TTL.total_seconds())
+        return self.keys.sign(id_token)
+
+    def get_jwt_bearer_token(self, token: dict, token_handler, request: Request) -> str:
+        return (self.jwt_tokens or JWTAccessTokens(self.keys))(request)
+
+    def validate_jwt_bearer_token(self, token: str, scopes: list[str], request: Request) -> bool:
+        return self.validate_bearer_token(token, scopes, request)
+
+    # Resource owners
+
+    def validate_user(self, username: str, password: str, client: Client, request: Request, *args, **kwargs) -> bool:
+        user = self._user(username, request)
+        if user is None or not user.is_active or not self._verify_password(password, user.password):
+            return False
+        if self.passwords is not None and self.passwords.needs_rehash(user.password):
+            self._rehash(user, password)
+        request.user = user.email
+        return True
+
+    def _verify_password(self, password: str, encoded: str) -> bool:
+        if self.passwords is None:
+            return verify_password(password, encoded)
+        return self.passwords.verify(password, encoded)
+
+    def _rehash(self, user: User, password: str):
+        # The password is only known in clear at login, so hashes move to new cost parameters then
+        try:
+            encoded = self.passwords.hash(password)
+            self.run(self.repository.put_user(user.copy(update={"password": encoded})))
+        except PasswordHasherBusyError:
+            return
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning(f"Could not rehash the password of {user.email}: {e}")
+            return
+        self.passwords.rehashed.inc()
+
+    def get_userinfo_claims(self, request: Request) -> dict | None:
+        user = self._user(request.user, request) if request.user else None
+        if user is None:
+            return None
+
+        claims = {"sub": user.email}
+        if "email" in request.scopes:
+            claims["email"] = user.email
+        if "profile" in request.scopes:
+            claims["given_name"] = user.first_name
+            claims["family_name"] = user.last_name
+            claims["name"] = f"{user.first_name} {user.last_name}".strip()
+        return claims
+
+    # There is no login session to authorize prompt=none requests against yet
+
+    def validate_silent_authorization(self, request: Request) -> bool:
+        return False
+
+    def validate_silent_login(self, request: Request) -> bool:
+        return False
+
+    def validate_user_match(self, id_token_hint: str, scopes: list[str], claims: dict, request: Request) -> bool:
+        return id_token_hint is None
+
+
+validator = DynamoDBRequestValidator()
@@ -0,0 +1,180 @@
+"""Password hashing with scrypt, and client secret digests.
+
+Password hashes are stored as `scrypt$<n>$<r>$<p>$<salt>$<hash>`, so the
+cost parameters can be raised without invalidating hashes written before.
+Client secrets are generated, high-entropy strings that a slow hash adds
+nothing to, so they are stored as `sha256$<digest>` and checked on every
+authenticated token, revocation and introspection request in microseconds.
+Client secrets stored in any other format never verify.
+"""
+
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, TypeVar
+
+from structlog import get_logger
+
+from guardian.metrics import Registry, registry
+
+T = TypeVar("T")
+
+log = get_logger()
+
+ALGORITHM = "scrypt"
+SECRET_ALGORITHM = "sha256"
+N, R, P = 2**14, 8, 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES, maxmem=256 * n * r * p)
+
+
+def hash_password(password: str, n: int = N, r: int = R, p: int = P) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    return "$".join((ALGORITHM, str(n), str(r), str(p), _b64encode(salt), _b64encode(_scrypt(password, salt, n, r, p))))
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    try:
+        algorithm, n, r, p, salt, expected = encoded.split("$")
+        if algorithm != ALGORITHM:
+            return False
+        derived = _scrypt(password, _b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived, _b64decode(expected))
+
+
+def hash_client_secret(secret: str) -> str:
+    return f"{SECRET_ALGORITHM}${hashlib.sha256(secret.encode('utf-8')).hexdigest()}"
+
+
+def is_client_secret_digest(encoded: str) -> bool:
+    return encoded.startswith(SECRET_ALGORITHM + "$")
+
+
+def verify_client_secret(secret: str, encoded: str) -> bool:
+    """Check a secret against hash_client_secret's digest, in constant time."""
+    if not is_client_secret_digest(encoded):
+        return False
+    return hmac.compare_digest(hash_client_secret(secret), encoded)
+
+
+def parameters(encoded: str) -> tuple[int, int, int] | None:
+    """The cost parameters of a hash, None if it is not an scrypt hash."""
+    try:
+        algorithm, n, r, p, _, _ = encoded.split("$")
+        return (int(n), int(r), int(p)) if algorithm == ALGORITHM else None
+    except ValueError:
+        return None
+
+
+def _timed(fn: Callable[..., T], *args) -> tuple[T, float]:
+    # Runs in the pool processes, the hashing time excludes queueing and pickling
+    start = time.perf_counter()
+    return fn(*args), time.perf_counter() - start
+
+
+class PasswordHasherBusyError(Exception):
+    """Raised when more password checks are pending than the hasher accepts."""
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords in a pool of `processes` processes.
+
+    A hash takes tens of milliseconds of CPU. Running it in a separate
+    process keeps it off the provider threads' share of the interpreter, and
+    bounding the checks keeps a burst of logins from occupying every provider
+    thread: beyond `max_pending` running or queued checks, `verify` fails fast
+    with PasswordHasherBusyError. With `processes=0` hashing runs in the
+    calling thread.
+
+    New hashes use the cost parameters `n`, `r` and `p`, and `needs_rehash`
+    tells hashes written with other parameters apart.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        max_pending: int,
+        n: int = N,
+        r: int = R,
+        p: int = P,
+        metrics: Registry = registry,
+    ):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.n, self.r, self.p = n, r, p
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+
+        self.hash_time = metrics.histogram("password_hash_seconds")
+        self.wait_time = metrics.histogram("password_hash_wait_seconds")
+        self.rejected = metrics.counter("password_hash_rejected_total")
+        self.rehashed = metrics.counter("password_rehash_total")
+        metrics.gauge("password_hash_pending", lambda: self.pending)
+
+    def start(self):
+        if self.processes > 0 and self._executor is None:
+            # Forking would copy the provider threads' locks in whatever state they are in
+            context = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            log.info(f"Started password hasher with {self.processes} processes")
+
+    def warm_up(self):
+        """Start every process now rather than on the first password checks, which would wait for them."""
+        if self._executor is not None:
+            for future in [self._executor.submit(os.getpid) for _ in range(self.processes)]:
+                future.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected.inc()
+                raise PasswordHasherBusyError(f"{self.pending} password checks already pending")
+            self.pending += 1
+        try:
+            submitted = time.perf_counter()
+            if self._executor is None:
+                result, elapsed = _timed(fn, *args)
+            else:
+                result, elapsed = self._executor.submit(_timed, fn, *args).result()
+            self.hash_time.observe(elapsed)
+            self.wait_time.observe(max(time.perf_counter() - submitted - elapsed, 0.0))
+            return result
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def hash(self, password: str) -> str:
+        return self._call(hash_password, password, self.n, self.r, self.p)
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return self._call(verify_password, password, encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return parameters(encoded) != (self.n, self.r, self.p)
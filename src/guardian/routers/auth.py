@@ -2,12 +2,32 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, Form, HTTPException, Request
 from fastapi.responses import HTMLResponse, RedirectResponse, Response
-from fastapi.templating import Jinja2Templates
-from oauthlib.oauth2 import FatalClientError, MetadataEndpoint, OAuth2Error
+from oauthlib.oauth2 import FatalClientError, OAuth2Error
 from structlog import get_logger
 
-from guardian.dependencies import get_jinja2_templates
-from guardian.openid import extract_params, provider
+from guardian.config import guardian
+from guardian.database import IntrospectionCache
+from guardian.dependencies import (
+    StreamingJinja2Templates,
+    get_introspection_cache,
+    get_jinja2_templates,
+    get_key_manager,
+    get_provider_executor,
+    get_session,
+)
+from guardian.middleware import Session
+from guardian.openid import (
+    INTROSPECTION_HEADERS,
+    BatchIntrospectEndpoint,
+    DiscoveryDocumentCache,
+    KeyManager,
+    ProviderExecutor,
+    expires_at,
+    extract_params,
+    introspection_params,
+    provider,
+    validator,
+)
 
 router = APIRouter()
 
@@ -15,18 +35,30 @@ log = get_logger()
 
 SESSION_KEY = "oauth2_credentials"
 
+discovery_documents = DiscoveryDocumentCache(provider, max_age=guardian.oauth.DISCOVERY_MAX_AGE)
+batch_introspection = BatchIntrospectEndpoint(validator, max_tokens=guardian.oauth.INTROSPECTION_BATCH_SIZE)
+
 
 @router.get("/authorize", response_class=HTMLResponse)
-async def authorization_request(request: Request, templates: Annotated[Jinja2Templates, Depends(get_jinja2_templates)]):
+async def authorization_request(
+    request: Request,
+    session: Annotated[Session, Depends(get_session)],
+    templates: Annotated[StreamingJinja2Templates, Depends(get_jinja2_templates)],
+    executor: Annotated[ProviderExecutor, Depends(get_provider_executor)],
+):
     uri, http_method, body, headers = await extract_params(request)
     try:
-        scopes, credentials = provider.validate_authorization_request(uri, http_method, body, headers)
+        scopes, credentials = await executor.run(
+            provider.validate_authorization_request, uri, http_method, body, headers
+        )
 
         # Not necessarily in session but they need to be
         # accessible in the POST view after form submit.
-        request.session[SESSION_KEY] = credentials
+        # The oauthlib request itself is not serializable and is rebuilt there.
+        credentials.pop("request", None)
+        session[SESSION_KEY] = credentials
 
-        return templates.TemplateResponse(
+        return templates.stream(
             "authorize.html",
             {
                 "request": request,
@@ -43,13 +75,18 @@ async def authorization_request(request: Request, templates: Annotated[Jinja2Tem
 
 
 @router.post("/authorize")
-async def authorize(request: Request, scopes: Annotated[list[str], Form()]):
+async def authorize(
+    request: Request,
+    session: Annotated[Session, Depends(get_session)],
+    executor: Annotated[ProviderExecutor, Depends(get_provider_executor)],
+    scopes: Annotated[list[str], Form()],
+):
     uri, http_method, body, headers = await extract_params(request)
-    credentials = request.session.get(SESSION_KEY, {})
+    credentials = session.get(SESSION_KEY, {})
 
     try:
-        headers, body, status = provider.create_authorization_response(
-            uri, http_method, body, headers, scopes, credentials
+        headers, body, status = await executor.run(
+            provider.create_authorization_response, uri, http_method, body, headers, scopes, credentials
         )
         return Response(content=body, status_code=status, headers=headers)
 
@@ -58,56 +95,73 @@ async def authorize(request: Request, scopes: Annotated[list[str], Form()]):
 
 
 @router.post("/token")
-async def token(request: Request):
+async def token(request: Request, executor: Annotated[ProviderExecutor, Depends(get_provider_executor)]):
     uri, http_method, body, headers = await extract_params(request)
 
     # If you wish to include request specific extra credentials for
     # use in the validator, do so here.
     credentials = {"foo": "bar"}
 
-    headers, body, status = provider.create_token_response(uri, http_method, body, headers, credentials)
+    try:
+        headers, body, status = await executor.run(
+            provider.create_token_response, uri, http_method, body, headers, credentials
+        )
+    except OAuth2Error as e:
+        # Raised when saving the token finds its grant was redeemed concurrently
+        return Response(content=e.json, status_code=e.status_code, headers=e.headers)
 
     return Response(content=body, status_code=status, headers=headers)
 
 
 @router.post("/introspect")
-async def introspect(request: Request):
+async def introspect(
+    request: Request,
+    executor: Annotated[ProviderExecutor, Depends(get_provider_executor)],
+    cache: Annotated[IntrospectionCache, Depends(get_introspection_cache)],
+):
+    uri, http_method, body, headers = await extract_params(request)
+    params = introspection_params(body, headers)
+    generation = None
+    if params is not None:
+        cached, generation = await cache.get(*params)
+        if cached is not None:
+            return Response(content=cached, status_code=200, headers=INTROSPECTION_HEADERS)
+
+    headers, body, status = await executor.run(provider.create_introspect_response, uri, http_method, body, headers)
+    # Only answers to authenticated clients are cached, keyed by the credentials they used
+    if generation is not None and status == 200:
+        await cache.set(*params, body, expires_at=expires_at(body), generation=generation)
+    return Response(content=body, status_code=status, headers=headers)
+
+
+@router.post("/introspect/batch")
+async def introspect_batch(request: Request, executor: Annotated[ProviderExecutor, Depends(get_provider_executor)]):
     uri, http_method, body, headers = await extract_params(request)
-    headers, body, status = provider.create_introspect_response(uri, http_method, body, headers)
+    headers, body, status = await executor.run(
+        batch_introspection.create_batch_introspect_response, uri, http_method, body, headers
+    )
     return Response(content=body, status_code=status, headers=headers)
 
 
 @router.post("/revoke")
-async def revoke_token(request: Request):
+async def revoke_token(request: Request, executor: Annotated[ProviderExecutor, Depends(get_provider_executor)]):
     uri, http_method, body, headers = await extract_params(request)
-    headers, body, status = provider.create_revocation_response(uri, http_method, body, headers)
+    headers, body, status = await executor.run(provider.create_revocation_response, uri, http_method, body, headers)
     return Response(content=body, status_code=status, headers=headers)
 
 
 @router.post("/userinfo")
-async def userinfo(request: Request):
+async def userinfo(request: Request, executor: Annotated[ProviderExecutor, Depends(get_provider_executor)]):
     uri, http_method, body, headers = await extract_params(request)
-    headers, body, status = provider.create_userinfo_response(uri, http_method, body, headers)
+    headers, body, status = await executor.run(provider.create_userinfo_response, uri, http_method, body, headers)
     return Response(content=body, status_code=status, headers=headers)
 
 
 @router.get("/.well-known")
 async def metadata(request: Request):
-    claims = {
-        "issuer": f"{request.base_url}",
-        "scopes_supported": ["openid", "email", "profile"],
-        "grant_types_supported": [
-            "authorization_code",
-            "client_credentials",
-        ],
-        "token_endpoint": f"{request.url_for('token')}",
-        "authorization_endpoint": f"{request.url_for('authorize')}",
-        "revocation_endpoint": f"{request.url_for('revoke_token')}",
-        "introspection_endpoint": f"{request.url_for('introspect')}",
-        "userinfo_endpoint": f"{request.url_for('userinfo')}",
-    }
-    endpoint = MetadataEndpoint([provider], claims=claims)
+    return discovery_documents.get(request).response(request)
 
-    uri, http_method, body, headers = await extract_params(request)
-    headers, body, status = endpoint.create_metadata_response(uri, http_method, body, headers)
-    return Response(content=body, status_code=status, headers=headers)
+
+@router.get("/jwks")
+async def jwks(request: Request, keys: Annotated[KeyManager, Depends(get_key_manager)]):
+    return keys.jwks.response(request)
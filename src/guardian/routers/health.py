@@ -1,18 +1,36 @@
 from typing import Annotated
 
-from aiodynamo.client import Table
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response, status
 
-from guardian.dependencies import dynamodb_table
+from guardian.database import SchemaMonitor
+from guardian.dependencies import get_schema_monitor
+from guardian.metrics import registry
 
 router = APIRouter()
 
 
 @router.get("/health")
-async def health():
-    return {"status": "UP"}
+async def health(response: Response, monitor: Annotated[SchemaMonitor, Depends(get_schema_monitor)]):
+    # Serves the readiness probe: only a missing table or a missing index that requests query takes the pod out
+    # of the service, drift and backfills are reported as DEGRADED, see SchemaStatus
+    schema = monitor.status
+    if schema is None or not schema.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        state = "DOWN"
+    else:
+        state = "UP" if schema.ok else "DEGRADED"
+    return {
+        "status": state,
+        "components": {"dynamodb": schema},
+    }
 
 
 @router.post("/table")
-async def post_table(table: Annotated[Table, Depends(dynamodb_table)]):
-    return {"table": table.name, "exists": await table.exists()}
+async def post_table(monitor: Annotated[SchemaMonitor, Depends(get_schema_monitor)]):
+    # Forces a schema check instead of waiting for the next background one
+    return await monitor.check()
+
+
+@router.get("/metrics")
+async def metrics():
+    return registry.snapshot()
@@ -0,0 +1,225 @@
+import importlib.util
+import math
+import os
+import random
+import signal
+import socket
+import time
+from pathlib import Path
+from typing import Any
+
+from structlog import get_logger
+from uvicorn import Config, Server
+from uvicorn.importer import import_from_string
+
+log = get_logger()
+
+CGROUP_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+
+STARTUP_FAILURE = 3  # exit status of a worker whose lifespan startup failed, as uvicorn's own CLI uses
+EARLY_EXIT = 5.0  # seconds, a worker exiting sooner is backed off before it is replaced
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+
+
+def available_cpus() -> int:
+    """The CPUs this process may use, capped by the container's CPU limit (cgroup v2)."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        quota, period = CGROUP_CPU_MAX.read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def loop_implementation() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_implementation() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+class Prefork:
+    """Runs `workers` uvicorn processes forked from one supervisor, all accepting on one socket.
+
+    With `preload` the application is imported before forking and
+    `preload_hook` called, e.g. to import what the application defers to its
+    lifespan, so the workers share its modules and precompiled code
+    copy-on-write; the lifespan, with every connection pool and background
+    task, still starts in each worker.
+    A worker exits after `max_requests` requests, plus up to
+    `max_requests_jitter` so they do not all restart together, and after a
+    crash, and is replaced. Workers exiting early are replaced after an
+    exponential backoff, and after `max_startup_failures` consecutive failed
+    startups, e.g. while DynamoDB or Redis is unreachable, the supervisor
+    exits with STARTUP_FAILURE so the orchestrator restarts it with its own
+    backoff. SIGTERM and SIGINT shut the workers down gracefully, SIGHUP
+    replaces them one at a time.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        app: str,
+        host: str,
+        port: int,
+        workers: int,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        preload: bool = True,
+        preload_hook: str | None = None,
+        graceful_timeout: float = 30.0,
+        log_level: str | int | None = None,
+        max_startup_failures: int = 5,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.preload = preload
+        self.preload_hook = preload_hook
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.max_startup_failures = max_startup_failures
+        self.early_exits = 0  # consecutive workers failing to start or exiting within EARLY_EXIT seconds
+        self.startup_failures = 0  # consecutive workers failing their lifespan startup
+        self.exit_code = 0
+        self.pids: dict[int, float] = {}  # worker pid to start time
+        self.should_exit = False
+        self.reload_pending = False
+
+    def run(self) -> int:
+        """Serve until told to stop, returns the supervisor's exit status."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.set_inheritable(True)
+        app = self.app
+        if self.preload:
+            app = import_from_string(self.app)
+            if self.preload_hook is not None:
+                import_from_string(self.preload_hook)()
+        log.info(
+            f"Serving on {self.host}:{self.port} with {self.workers} workers, "
+            f"{loop_implementation()} and {http_implementation()}, preload={self.preload}"
+        )
+
+        signal.signal(signal.SIGTERM, self._exit)
+        signal.signal(signal.SIGINT, self._exit)
+        signal.signal(signal.SIGHUP, self._reload)
+        try:
+            for _ in range(self.workers):
+                self._spawn(app, sock)
+            self._supervise(app, sock)
+        finally:
+            self._stop_workers()
+            sock.close()
+        return self.exit_code
+
+    def _exit(self, *_):
+        self.should_exit = True
+
+    def _reload(self, *_):
+        self.reload_pending = True
+
+    def _spawn(self, app: Any, sock: socket.socket):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = time.monotonic()
+            return
+
+        # The worker installs its own handlers for a graceful shutdown
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        jitter = random.randint(0, self.max_requests_jitter) if self.max_requests_jitter > 0 else 0
+        config = Config(
+            app,
+            loop=loop_implementation(),
+            http=http_implementation(),
+            log_level=self.log_level,
+            limit_max_requests=self.max_requests + jitter if self.max_requests > 0 else None,
+        )
+        status = 0
+        try:
+            server = Server(config)
+            server.run(sockets=[sock])
+            # uvicorn returns normally when the lifespan startup fails
+            status = 0 if server.started else STARTUP_FAILURE
+        except BaseException:  # pylint: disable=broad-except
+            status = 1
+        finally:
+            # Never return into the supervisor's code or run its exit handlers
+            os._exit(status)  # pylint: disable=protected-access
+
+    def _supervise(self, app: Any, sock: socket.socket):
+        while not self.should_exit:
+            if self.reload_pending:
+                self.reload_pending = False
+                self._replace_workers(app, sock)
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = 0, 0
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+
+            started = self.pids.pop(pid, time.monotonic())
+            if self.should_exit:
+                break
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0:
+                log.warning(f"Worker {pid} exited with {code}, replacing it")
+            self.startup_failures = self.startup_failures + 1 if code == STARTUP_FAILURE else 0
+            if self.startup_failures >= self.max_startup_failures:
+                log.error(f"{self.startup_failures} workers in a row failed to start, stopping")
+                self.exit_code = STARTUP_FAILURE
+                break
+            # Workers failing to start or exiting right away are not restarted in a tight loop
+            failed = code == STARTUP_FAILURE or time.monotonic() - started < EARLY_EXIT
+            self.early_exits = self.early_exits + 1 if failed else 0
+            if self.early_exits:
+                self._sleep(min(BACKOFF_INITIAL * 2 ** (self.early_exits - 1), BACKOFF_MAX))
+            if not self.should_exit:
+                self._spawn(app, sock)
+
+    def _sleep(self, seconds: float):
+        deadline = time.monotonic() + seconds
+        while not self.should_exit and time.monotonic() < deadline:
+            time.sleep(min(0.1, max(deadline - time.monotonic(), 0)))
+
+    def _replace_workers(self, app: Any, sock: socket.socket):
+        for pid in list(self.pids):
+            self._spawn(app, sock)
+            os.kill(pid, signal.SIGTERM)
+            self._wait(pid, self.graceful_timeout)
+
+    def _wait(self, pid: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self.pids.pop(pid, None)
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _stop_workers(self):
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.pids.pop(pid, None)
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in list(self.pids):
+            if not self._wait(pid, max(deadline - time.monotonic(), 0)):
+                log.warning(f"Worker {pid} did not stop within {self.graceful_timeout}s, killing it")
+                os.kill(pid, signal.SIGKILL)
+                self._wait(pid, 5)
@@ -0,0 +1,56 @@
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from structlog import get_logger
+
+from guardian.metrics import Registry, registry
+
+log = get_logger()
+
+
+class StartupTimer:
+    """Times the phases of starting a worker, reported once it is ready to serve.
+
+    Phases accumulate, so one name can be timed at several places, and nest:
+    time spent in an inner phase counts towards it and not the outer one.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter, metrics: Registry = registry):
+        self.clock = clock
+        self.metrics = metrics
+        self.phases: dict[str, float] = {}
+        self._stack: list[tuple[str, float, float]] = []  # name, start, time spent in nested phases
+
+    def begin(self, name: str):
+        self._stack.append((name, self.clock(), 0.0))
+
+    def end(self, name: str):
+        current, start, nested = self._stack.pop()
+        if current != name:
+            raise RuntimeError(f"Ending startup phase {name!r} while {current!r} is running")
+        elapsed = self.clock() - start
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+        if self._stack:
+            outer, outer_start, outer_nested = self._stack[-1]
+            self._stack[-1] = (outer, outer_start, outer_nested + elapsed)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def report(self):
+        total = sum(self.phases.values())
+        for name, seconds in self.phases.items():
+            self.metrics.gauge(f"startup_{name}_seconds").set(seconds)
+        self.metrics.gauge("startup_seconds").set(total)
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())
+        log.info(f"Started in {total:.3f}s: {phases}")
+
+
+# Created with the guardian package, so the import phase covers the application's imports
+startup = StartupTimer()
@@ -0,0 +1,211 @@
+"""Report DynamoDB round trips and consumed capacity per OAuth flow.
+
+Runs each flow against DynamoDB Local (docker-compose exposes it on port
+8000, or any endpoint given with --endpoint) twice: once on a table created
+from SCHEMA, whose indexes project what ACCESS_PATTERNS read, and once on a
+table whose indexes are all KEYS_ONLY, where index lookups fetch every result
+with a follow-up read. Every request asks for ReturnConsumedCapacity=TOTAL, so
+writes include the index updates the projections cost.
+
+    docker compose up -d dynamodb
+    python -m tests.benchmarks.dynamodb_capacity --iterations 20 --tokens 10
+"""
+
+import argparse
+import asyncio
+import base64
+import dataclasses
+import json
+import uuid
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any, Mapping
+from urllib.parse import urlencode
+
+from aiodynamo.client import Client
+from aiodynamo.expressions import HashKey, RangeKey
+from aiodynamo.http.httpx import HTTPX
+from aiodynamo.models import Projection, ProjectionType
+from httpx import AsyncClient
+from oauthlib.openid import Server
+from yarl import URL
+
+from guardian.database import SCHEMA, EntityRef, Repository
+from guardian.database.repository import BEARER_TOKEN
+from guardian.database.schema import Attributes
+from guardian.models import Client as OAuthClient
+from guardian.models import GrantType, User
+from guardian.openid import DynamoDBRequestValidator, KeyManager, ProviderExecutor
+from guardian.passwords import hash_client_secret, hash_password
+
+from .dynamodb_client import CREDENTIALS, REGION
+
+READS = {"GetItem", "BatchGetItem", "Query", "Scan", "TransactGetItems"}
+METERED = READS | {"PutItem", "UpdateItem", "DeleteItem", "BatchWriteItem", "TransactWriteItems"}
+TOKEN_URI = "https://guardian.test/oauth/token"
+INTROSPECT_URI = "https://guardian.test/oauth/introspect"
+USERNAME = "bench@example.com"
+PASSWORD = "correct horse battery"  # pragma: allowlist secret
+CLIENT_SECRET = "bench-secret"  # pragma: allowlist secret
+
+
+@dataclass
+class Meter:
+    round_trips: int = 0
+    read_units: float = 0.0
+    write_units: float = 0.0
+    actions: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def reset(self):
+        self.round_trips, self.read_units, self.write_units = 0, 0.0, 0.0
+        self.actions.clear()
+
+    def record(self, action: str, response: dict):
+        self.round_trips += 1
+        self.actions[action] += 1
+        consumed = response.get("ConsumedCapacity", [])
+        units = sum(entry.get("CapacityUnits", 0) for entry in ([consumed] if isinstance(consumed, dict) else consumed))
+        if action in READS:
+            self.read_units += units
+        else:
+            self.write_units += units
+
+
+@dataclass(frozen=True)
+class MeteredClient(Client):
+    """An aiodynamo client recording every request and the capacity it consumed."""
+
+    meter: Meter = field(default_factory=Meter)
+
+    async def send_request(self, *, action: str, payload: Mapping[str, Any]) -> dict[str, Any]:
+        if action in METERED:
+            payload = {**payload, "ReturnConsumedCapacity": "TOTAL"}
+        response = await super().send_request(action=action, payload=payload)
+        self.meter.record(action, response)
+        return response
+
+
+def keys_only(schema: dict) -> dict:
+    gsis = [dataclasses.replace(gsi, projection=Projection(type=ProjectionType.keys_only)) for gsi in schema["gsis"]]
+    return {**schema, "gsis": gsis}
+
+
+def basic_auth(client_id: str, secret: str) -> dict[str, str]:
+    credentials = base64.b64encode(f"{client_id}:{secret}".encode()).decode()
+    return {"Authorization": f"Basic {credentials}", "Content-Type": "application/x-www-form-urlencoded"}
+
+
+class Flows:
+    """The OAuth flows and index lookups, each run through the provider the way a request would."""
+
+    def __init__(self, server: Server, repository: Repository, executor: ProviderExecutor, projected: bool):
+        self.server = server
+        self.repository = repository
+        self.executor = executor
+        self.projected = projected
+        self.token: dict = {}
+
+    async def _token_request(self, **params) -> dict:
+        headers = basic_auth("bench", CLIENT_SECRET)
+        _, body, status = await self.executor.run(
+            self.server.create_token_response, TOKEN_URI, "POST", urlencode(params), headers
+        )
+        if status != 200:
+            raise RuntimeError(f"{params['grant_type']} grant failed: {body}")
+        return json.loads(body)
+
+    async def password_grant(self):
+        self.token = await self._token_request(grant_type="password", username=USERNAME, password=PASSWORD)
+
+    async def refresh_grant(self):
+        self.token = await self._token_request(grant_type="refresh_token", refresh_token=self.token["refresh_token"])
+
+    async def introspection(self):
+        body = urlencode({"token": self.token["access_token"]})
+        _, response, status = await self.executor.run(
+            self.server.create_introspect_response, INTROSPECT_URI, "POST", body, basic_auth("bench", CLIENT_SECRET)
+        )
+        if status != 200 or not json.loads(response)["active"]:
+            raise RuntimeError(f"introspection failed: {response}")
+
+    async def tokens_by_username(self):
+        await self._tokens_by(Attributes.Username, USERNAME, self.repository.get_tokens_by_username)
+
+    async def tokens_by_client(self):
+        await self._tokens_by(Attributes.ClientId, "bench", self.repository.get_tokens_by_client)
+
+    async def _tokens_by(self, attribute: str, value: str, projected: Callable[[str], Awaitable[list]]):
+        if self.projected:
+            await projected(value)
+            return
+        # What every lookup cost before the projections: the index yields keys, the table the tokens
+        key_condition = HashKey(attribute, value) & RangeKey(Attributes.EntityType).equals(BEARER_TOKEN)
+        items = self.repository.client.query(self.repository.table_name, key_condition, index=attribute + "Index")
+        await self.repository.get_many([EntityRef.from_item(item) async for item in items])
+
+
+async def seed(repository: Repository, tokens: int, executor: ProviderExecutor, flows: Flows):
+    await repository.put_client(
+        OAuthClient(
+            client_id="bench",
+            client_secret=hash_client_secret(CLIENT_SECRET),
+            grant_type=GrantType.PASSWORD,
+            response_type="token",
+            scopes=["email"],
+            default_scopes=["email"],
+            redirect_uris=[],
+            default_redirect_uri=[],
+        )
+    )
+    await repository.put_user(User(email=USERNAME, password=hash_password(PASSWORD)))
+    for _ in range(tokens):
+        await flows.password_grant()
+
+
+async def measure(
+    client: MeteredClient, schema: dict, projected: bool, args: argparse.Namespace, executor: ProviderExecutor
+):
+    table_name = f"{args.table}-{uuid.uuid4().hex[:8]}"
+    await client.table(table_name).create(**schema)
+    try:
+        repository = Repository(client, table_name)
+        validator = DynamoDBRequestValidator()
+        validator.bind(repository, executor.run_coroutine, keys=KeyManager(refresh_interval=0))
+        flows = Flows(Server(validator), repository, executor, projected)
+        await seed(repository, args.tokens, executor, flows)
+
+        print(f"\n{'projected indexes' if projected else 'keys-only indexes'} ({args.tokens} tokens per user)")
+        print(f"{'flow':>20}  {'round trips':>11}  {'RCU':>7}  {'WCU':>7}  requests")
+        for name in ("password_grant", "refresh_grant", "introspection", "tokens_by_username", "tokens_by_client"):
+            client.meter.reset()
+            for _ in range(args.iterations):
+                await getattr(flows, name)()
+            meter, n = client.meter, args.iterations
+            actions = ", ".join(f"{action} {count / n:g}" for action, count in sorted(meter.actions.items()))
+            print(
+                f"{name:>20}  {meter.round_trips / n:11.1f}  {meter.read_units / n:7.2f}  "
+                f"{meter.write_units / n:7.2f}  {actions}"
+            )
+    finally:
+        await client.send_request(action="DeleteTable", payload={"TableName": table_name})
+
+
+async def main(args: argparse.Namespace):
+    executor = ProviderExecutor(max_workers=2, max_pending=16)
+    await executor.start()
+    async with AsyncClient() as http:
+        client = MeteredClient(http=HTTPX(http), credentials=CREDENTIALS, region=REGION, endpoint=URL(args.endpoint))
+        print(f"DynamoDB round trips and consumed capacity per flow against {args.endpoint}")
+        await measure(client, SCHEMA, True, args, executor)
+        await measure(client, keys_only(SCHEMA), False, args, executor)
+    await executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20, help="runs of each flow, results are per run")
+    parser.add_argument("--tokens", type=int, default=10, help="tokens issued to the user before measuring")
+    parser.add_argument("--endpoint", default="http://localhost:8000", help="DynamoDB Local endpoint")
+    parser.add_argument("--table", default="capacity-benchmark")
+    asyncio.run(main(parser.parse_args()))
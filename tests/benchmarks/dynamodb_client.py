@@ -0,0 +1,98 @@
+"""Compare per-request and pooled DynamoDB client latency.
+
+Runs a GetItem workload against a local DynamoDB stand-in (or any endpoint
+given with --endpoint, e.g. DynamoDB Local from docker-compose), once opening
+a new client for every call, the way the request dependency used to, and once
+through a single application-scoped client with a keep-alive connection pool.
+
+    python -m tests.benchmarks.dynamodb_client --requests 2000 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from contextlib import asynccontextmanager, nullcontext
+
+from aiodynamo.client import Client
+from aiodynamo.credentials import Key, StaticCredentials
+from httpx import Limits, Timeout
+from yarl import URL
+
+from guardian.database import dynamodb_client
+
+from .dynamodb_stand_in import dynamodb_stand_in
+
+REGION = "eu-central-1"
+CREDENTIALS = StaticCredentials(Key("benchmark", "benchmark"))  # pragma: allowlist secret
+KEY = {"PK": "CLIENT#benchmark", "SK": "CLIENT#benchmark"}
+
+
+async def per_request(endpoint: URL, table_name: str, _: Client | None) -> None:
+    async with dynamodb_client(REGION, endpoint, CREDENTIALS) as client:
+        await client.table(table_name).get_item(KEY)
+
+
+async def pooled(_: URL, table_name: str, client: Client | None) -> None:
+    await client.table(table_name).get_item(KEY)
+
+
+async def run(mode, endpoint: URL, table_name: str, requests: int, concurrency: int) -> list[float]:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    if mode is pooled:
+        context = dynamodb_client(REGION, endpoint, CREDENTIALS, limits=limits, timeout=Timeout(5.0))
+    else:
+        context = nullcontext()
+
+    async with context as client:
+        # Warm up, so the pooled run starts with open connections like a live worker
+        await asyncio.gather(*(mode(endpoint, table_name, client) for _ in range(concurrency)))
+
+        async def timed():
+            async with semaphore:
+                start = time.perf_counter()
+                await mode(endpoint, table_name, client)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(timed() for _ in range(requests)))
+    return latencies
+
+
+def report(name: str, latencies: list[float], elapsed: float):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:>12}: {len(latencies) / elapsed:8.0f} req/s  "
+        f"mean {statistics.mean(latencies) * 1000:6.2f} ms  "
+        f"p50 {statistics.median(latencies) * 1000:6.2f} ms  "
+        f"p95 {p95 * 1000:6.2f} ms"
+    )
+
+
+async def main(args: argparse.Namespace):
+    @asynccontextmanager
+    async def endpoint():
+        if args.endpoint:
+            yield URL(args.endpoint)
+        else:
+            async with dynamodb_stand_in() as url:
+                yield url
+
+    async with endpoint() as url:
+        print(f"GetItem x {args.requests} against {url} with concurrency {args.concurrency}")
+        for name, mode in (("per-request", per_request), ("pooled", pooled)):
+            start = time.perf_counter()
+            latencies = await run(mode, url, args.table, args.requests, args.concurrency)
+            report(name, latencies, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--endpoint", help="DynamoDB endpoint, defaults to an in-process stand-in")
+    parser.add_argument("--table", default="openid")
+    asyncio.run(main(parser.parse_args()))
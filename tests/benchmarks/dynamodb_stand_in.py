@@ -0,0 +1,90 @@
+"""A minimal DynamoDB stand-in served over HTTP on the loopback interface.
+
+It understands just enough of the DynamoDB JSON protocol to answer the calls
+the benchmarks make, so latency numbers reflect the HTTP client and connection
+handling rather than DynamoDB itself.
+"""
+
+import asyncio
+import json
+import socket
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from uvicorn import Config, Server
+from yarl import URL
+
+CONTENT_TYPE = "application/x-amz-json-1.0"
+
+
+def describe_table(payload: dict) -> dict:
+    return {
+        "Table": {
+            "TableName": payload["TableName"],
+            "TableStatus": "ACTIVE",
+            "ItemCount": 1,
+        }
+    }
+
+
+def bearer_token(key: dict) -> dict:
+    access_token = key["PK"]["S"].split("#", 1)[1]
+    return {
+        **key,
+        "EntityType": {"S": "BearerToken"},
+        "client_id": {"S": "benchmark"},
+        "scopes": {"L": [{"S": "email"}]},
+        "access_token": {"S": access_token},
+        "expires_at": {"S": "2999-01-01T00:00:00"},
+    }
+
+
+def get_item(payload: dict) -> dict:
+    if payload["Key"]["PK"]["S"].startswith("BearerToken#"):
+        return {"Item": bearer_token(payload["Key"])}
+    return {"Item": {**payload["Key"], "EntityType": {"S": "Client"}}}
+
+
+def put_item(_: dict) -> dict:
+    return {}
+
+
+HANDLERS = {
+    "DescribeTable": describe_table,
+    "GetItem": get_item,
+    "PutItem": put_item,
+}
+
+
+async def dispatch(request: Request) -> Response:
+    action = request.headers["x-amz-target"].rsplit(".", 1)[-1]
+    payload = json.loads(await request.body())
+    if action not in HANDLERS:
+        body = {"__type": "com.amazon.coral.service#UnknownOperationException", "message": action}
+        return Response(json.dumps(body), status_code=400, media_type=CONTENT_TYPE)
+    return Response(json.dumps(HANDLERS[action](payload)), media_type=CONTENT_TYPE)
+
+
+@asynccontextmanager
+async def dynamodb_stand_in(host: str = "127.0.0.1") -> AsyncGenerator[URL, None]:
+    """Serve the stand-in on a free port and yield its endpoint."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+
+    app = Starlette(routes=[Route("/", dispatch, methods=["POST"])])
+    server = Server(Config(app, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield URL(f"http://{host}:{port}")
+    finally:
+        server.should_exit = True
+        await task
+        sock.close()
@@ -0,0 +1,59 @@
+"""Time importing the application in fresh interpreters.
+
+Importing guardian.main is what every prefork worker and every restart pays
+before the lifespan runs, so subsystems are imported there and not here. Each
+run starts a new interpreter; with --top the slowest modules of the last run
+are listed from `python -X importtime`.
+
+    python -m tests.benchmarks.import_time --runs 10 --top 15
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+SCRIPT = """
+import time
+
+start = time.perf_counter()
+import guardian.main
+print(time.perf_counter() - start)
+"""
+
+
+def import_once(importtime: bool = False) -> tuple[float, str]:
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", SCRIPT]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return float(result.stdout), result.stderr
+
+
+def slowest_modules(importtime: str, top: int) -> list[tuple[int, str]]:
+    # Lines read "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main(args: argparse.Namespace):
+    timings = [import_once()[0] for _ in range(args.runs)]
+    print(
+        f"import guardian.main over {args.runs} runs: min {min(timings) * 1e3:.1f} ms, "
+        f"median {statistics.median(timings) * 1e3:.1f} ms, max {max(timings) * 1e3:.1f} ms"
+    )
+    if args.top:
+        _, importtime = import_once(importtime=True)
+        print(f"{'cumulative ms':>13}  module")
+        for cumulative, name in slowest_modules(importtime, args.top):
+            print(f"{cumulative / 1e3:>13.1f}  {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=0, help="list the modules slowest to import, cumulatively")
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+"""Encode/decode cost and stored size of a session per codec and compression.
+
+The payload mirrors what GET /oauth/authorize keeps in the session. With
+--redis-url each encoded session is also written to Redis to report the
+server-side memory per key (MEMORY USAGE).
+
+    python -m tests.benchmarks.session_codecs --redis-url redis://localhost:6379/0
+"""
+
+import argparse
+import asyncio
+import timeit
+
+from redis import asyncio as redis
+
+from guardian.codecs import CodecUnavailableError, Serializer
+
+CREDENTIALS = {
+    "client_id": "3f6d2a0e-5f57-4c1a-9bd4-0d0c2f0e8a11",
+    "redirect_uri": "https://relying-party.example.com/oauth/callback?tenant=42",
+    "response_type": "code",
+    "state": "af0ifjsldkj-Tg3Yc0Ww3JXmzvz7bpP1d0kL6Ee8QgE",
+    "nonce": "n-0S6_WzA2Mj",
+    "prompt": ["consent"],
+    "display": "page",
+    "claims": {"userinfo": {"email": {"essential": True}, "name": None}},
+    "code_challenge": "E9Melhoa2OwvFrEMTJguCHaoeK1t8URWbuGJSstw-cM",
+    "code_challenge_method": "S256",
+    "scopes": ["openid", "email", "profile"],
+}
+SESSIONS = {
+    "authorize": {"oauth2_credentials": CREDENTIALS},
+    "large": {"oauth2_credentials": CREDENTIALS, "history": [CREDENTIALS] * 20},
+}
+CONFIGURATIONS = [
+    (codec, compression) for codec in ("json", "orjson", "msgpack") for compression in ("none", "zlib", "lz4")
+]
+
+
+async def redis_memory(client: redis.Redis, key: str, value: bytes) -> int:
+    await client.set(key, value)
+    try:
+        return await client.memory_usage(key)
+    finally:
+        await client.delete(key)
+
+
+async def main(args: argparse.Namespace):
+    client = redis.from_url(args.redis_url) if args.redis_url else None
+    print(
+        f"{'session':>9} {'codec':>8} {'compression':>11} {'bytes':>6} "
+        f"{'encode µs':>10} {'decode µs':>10} {'redis B':>8}"
+    )
+    for session_name, session in SESSIONS.items():
+        for codec, compression in CONFIGURATIONS:
+            try:
+                serializer = Serializer(codec, compression, compression_threshold=args.threshold)
+            except CodecUnavailableError:
+                continue
+            encoded = serializer.dumps(session)
+            assert serializer.loads(encoded) == session
+            encode = min(timeit.repeat(lambda s=serializer, d=session: s.dumps(d), number=args.number, repeat=3))
+            decode = min(timeit.repeat(lambda s=serializer, d=encoded: s.loads(d), number=args.number, repeat=3))
+            memory = await redis_memory(client, "guardian:benchmark:session", encoded) if client else "-"
+            print(
+                f"{session_name:>9} {codec:>8} {compression:>11} {len(encoded):>6} "
+                f"{encode / args.number * 1e6:>10.2f} {decode / args.number * 1e6:>10.2f} {memory:>8}"
+            )
+    if client:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--threshold", type=int, default=512, help="compression threshold in bytes")
+    parser.add_argument("--redis-url", help="measure MEMORY USAGE per session in this Redis")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+"""Compare opaque and JWT access token validation throughput.
+
+Validates bearer tokens through the request validator the way the provider
+threads do. Opaque tokens are looked up in DynamoDB (a local stand-in, or any
+endpoint given with --endpoint), one GetItem per validation. JWT access tokens
+are verified in process against the cached public key and checked against the
+local revocation list, without any I/O.
+
+    python -m tests.benchmarks.token_validation --requests 5000 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from httpx import Limits, Timeout
+from oauthlib.common import Request
+from yarl import URL
+
+from guardian.database import Repository, RevocationList, dynamodb_client
+from guardian.openid import DynamoDBRequestValidator, JWTAccessTokens, KeyManager, ProviderExecutor
+
+from .dynamodb_client import CREDENTIALS, REGION, report
+from .dynamodb_stand_in import dynamodb_stand_in
+
+TOKEN_URI = "https://guardian.test/oauth/token"
+
+
+def issue_jwt(tokens: JWTAccessTokens) -> str:
+    request = Request(TOKEN_URI)
+    request.client_id = "benchmark"
+    request.scopes = ["email"]
+    request.expires_in = 3600
+    return tokens(request)
+
+
+async def run(
+    validator: DynamoDBRequestValidator, token: str, requests: int, executor: ProviderExecutor
+) -> list[float]:
+    def validate() -> float:
+        start = time.perf_counter()
+        if not validator.validate_bearer_token(token, ["email"], Request(TOKEN_URI)):
+            raise RuntimeError("token did not validate")
+        return time.perf_counter() - start
+
+    # Warm up the threads and connections
+    await asyncio.gather(*(executor.run(validate) for _ in range(executor.max_workers)))
+    return await asyncio.gather(*(executor.run(validate) for _ in range(requests)))
+
+
+async def main(args: argparse.Namespace):
+    @asynccontextmanager
+    async def endpoint():
+        if args.endpoint:
+            yield URL(args.endpoint)
+        else:
+            async with dynamodb_stand_in() as url:
+                yield url
+
+    executor = ProviderExecutor(max_workers=args.concurrency, max_pending=args.requests + args.concurrency)
+    await executor.start()
+    limits = Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    jwt_tokens = JWTAccessTokens(KeyManager())
+    revocations = RevocationList(None, "revoked", "revoked")
+    for i in range(args.revoked):
+        revocations.add(f"revoked-{i}")
+
+    async with endpoint() as url:
+        async with dynamodb_client(REGION, url, CREDENTIALS, limits=limits, timeout=Timeout(5.0)) as client:
+            repository = Repository(client, args.table)
+            modes = (
+                ("opaque", "opaque-benchmark-token", {}),
+                ("jwt", issue_jwt(jwt_tokens), {"jwt_tokens": jwt_tokens, "revocations": revocations}),
+            )
+            print(f"validate_bearer_token x {args.requests} against {url} with {args.concurrency} threads")
+            for name, token, kwargs in modes:
+                validator = DynamoDBRequestValidator()
+                validator.bind(repository, executor.run_coroutine, **kwargs)
+                start = time.perf_counter()
+                latencies = await run(validator, token, args.requests, executor)
+                report(name, latencies, time.perf_counter() - start)
+    await executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--revoked", type=int, default=10000, help="ids in the revocation filter")
+    parser.add_argument("--endpoint", help="DynamoDB endpoint, defaults to an in-process stand-in")
+    parser.add_argument("--table", default="openid")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,264 @@
+"""In-memory fakes of Redis and the aiodynamo client, shared by the unit tests."""
+
+import pytest
+from aiodynamo.errors import ConditionalCheckFailed, ItemNotFound, TransactionCanceled
+from aiodynamo.models import BatchGetResponse, ProjectionType
+from aiodynamo.operations import Delete, Put
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import WatchError
+
+from guardian.database import SCHEMA
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _encode(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+class FakePipeline:
+    """Queues commands until `execute`, between WATCH and MULTI they run right away."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.watched = None
+        self.immediate = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        if self.immediate:
+            return command
+        return lambda *args: self.commands.append((command, args))
+
+    async def watch(self, key):
+        self.watched = (key, self.redis.values.get(key))
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    async def execute(self):
+        self.redis.check()
+        if self.watched is not None and self.redis.values.get(self.watched[0]) != self.watched[1]:
+            raise WatchError("watched key changed")
+        return [await command(*args) for command, args in self.commands]
+
+
+class FakeRedis:
+    """Strings, hashes and sorted sets in memory, recording the commands sent.
+
+    Setting `down` fails every command like a lost connection.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.sorted_sets = {}
+        self.ttls = {}
+        self.published = []
+        self.calls = []
+        self.down = False
+
+    def check(self):
+        if self.down:
+            raise RedisConnectionError("Redis is down")
+
+    def _call(self, name):
+        self.check()
+        self.calls.append(name)
+
+    def _exists(self, key):
+        return key in self.values or key in self.hashes or key in self.sorted_sets
+
+    async def get(self, key):
+        self._call("GET")
+        return self.values.get(key)
+
+    async def mget(self, keys):
+        self._call("MGET")
+        return [self.values.get(key) for key in keys]
+
+    async def setex(self, key, ttl, value):
+        self._call("SETEX")
+        self.values[key] = _encode(value)
+        self.ttls[key] = ttl
+        return True
+
+    async def incr(self, key):
+        self._call("INCR")
+        value = int(self.values.get(key, b"0")) + 1
+        self.values[key] = str(value).encode()
+        return value
+
+    async def getdel(self, key):
+        self._call("GETDEL")
+        self.ttls.pop(key, None)
+        return self.values.pop(key, None)
+
+    async def hget(self, key, field):
+        self._call("HGET")
+        return self.hashes.get(key, {}).get(field)
+
+    async def hset(self, key, field, value):
+        self._call("HSET")
+        self.hashes.setdefault(key, {})[field] = _encode(value)
+        return 1
+
+    async def expire(self, key, ttl):
+        self._call("EXPIRE")
+        if not self._exists(key):
+            return False
+        self.ttls[key] = ttl
+        return True
+
+    async def ttl(self, key):
+        self._call("TTL")
+        return self.ttls.get(key, -1) if self._exists(key) else -2
+
+    async def delete(self, *keys):
+        self._call("DEL")
+        deleted = 0
+        for key in keys:
+            deleted += self._exists(key)
+            for store in (self.values, self.hashes, self.sorted_sets, self.ttls):
+                store.pop(key, None)
+        return deleted
+
+    async def publish(self, channel, message):
+        self._call("PUBLISH")
+        self.published.append((channel, message))
+        return 0
+
+    async def zadd(self, key, mapping):
+        self._call("ZADD")
+        self.sorted_sets.setdefault(key, {}).update(mapping)
+        return len(mapping)
+
+    async def zremrangebyscore(self, key, low, high):
+        self._call("ZREMRANGEBYSCORE")
+        members = self.sorted_sets.get(key, {})
+        removed = [member for member, score in members.items() if float(low) <= score <= float(high)]
+        for member in removed:
+            del members[member]
+        return len(removed)
+
+    async def zscore(self, key, member):
+        self._call("ZSCORE")
+        return self.sorted_sets.get(key, {}).get(member)
+
+    async def zrangebyscore(self, key, low, high):
+        self._call("ZRANGEBYSCORE")
+        members = self.sorted_sets.get(key, {})
+        return [_encode(member) for member, score in members.items() if float(low) <= score <= float(high)]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+def _index_attributes(index):
+    # Replacements of a changed index are named after it, see schema_manager.index_versions
+    gsi = next(gsi for gsi in SCHEMA["gsis"] if index == gsi.name or index.startswith(gsi.name + "-"))
+    keys = (SCHEMA["keys"], gsi.schema)
+    names = {key.name for schema in keys for key in (schema.hash_key, schema.range_key) if key is not None}
+    if gsi.projection.type is ProjectionType.include:
+        names.update(gsi.projection.attrs)
+    return names
+
+
+class FakeDynamoDB:
+    """In-memory stand-in for the aiodynamo client, recording the actions sent.
+
+    Queries return what the declared index projects and leave filter expressions to subclasses.
+    """
+
+    def __init__(self, *items):
+        self.items = {self._key(item): item for item in items}
+        self.calls = []
+
+    @staticmethod
+    def _key(key):
+        return key["PK"], key["SK"]
+
+    async def get_item(self, table, key, consistent_read=False):
+        self.calls.append(("GetItem", consistent_read))
+        try:
+            return dict(self.items[self._key(key)])
+        except KeyError:
+            raise ItemNotFound(key) from None
+
+    async def batch_get(self, request):
+        (table, get_request), *_ = request.items()
+        self.calls.append(("BatchGetItem", get_request.consistent_read))
+        items = [dict(self.items[self._key(key)]) for key in get_request.keys if self._key(key) in self.items]
+        return BatchGetResponse(items={table: items}, unprocessed_keys={})
+
+    async def put_item(self, table, item, condition=None):
+        self.calls.append(("PutItem", None))
+        self.items[self._key(item)] = item
+
+    async def delete_item(self, table, key, condition=None):
+        self.calls.append(("DeleteItem", None))
+        if condition is not None and self._key(key) not in self.items:
+            raise ConditionalCheckFailed(key)
+        self.items.pop(self._key(key), None)
+
+    async def transact_write_items(self, operations):
+        self.calls.append(("TransactWriteItems", len(operations)))
+        for operation in operations:
+            if isinstance(operation, Delete) and operation.condition is not None:
+                if self._key(operation.key) not in self.items:
+                    raise TransactionCanceled(operation.key)
+        for operation in operations:
+            if isinstance(operation, Put):
+                self.items[self._key(operation.item)] = operation.item
+            else:
+                self.items.pop(self._key(operation.key), None)
+
+    async def query(self, table, key_condition, index=None, filter_expression=None, projection=None):
+        self.calls.append(("Query", index))
+        hash_key = getattr(key_condition, "hash_key", key_condition)
+        range_key = getattr(key_condition, "range_key_condition", None)
+        attributes = _index_attributes(index) if index else None
+        for item in list(self.items.values()):
+            if item.get(hash_key.name) != hash_key.value:
+                continue
+            if range_key is not None and item.get(range_key.field.path.root) != range_key.other:
+                continue
+            yield {name: value for name, value in item.items() if attributes is None or name in attributes}
+
+    async def batch_write(self, request):
+        for write in request.values():
+            self.calls.append(("BatchWriteItem", len(write.keys_to_delete or []) + len(write.items_to_put or [])))
+            for key in write.keys_to_delete or []:
+                self.items.pop(self._key(key), None)
+            for item in write.items_to_put or []:
+                self.items[self._key(item)] = item
+        return {}
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def dynamodb():
+    return FakeDynamoDB()
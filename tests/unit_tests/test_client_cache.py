@@ -0,0 +1,140 @@
+import pytest
+
+from guardian.database import ClientCache, ClientCacheInvalidation, Repository
+from guardian.database.repository import client_item
+from guardian.metrics import Registry
+from guardian.models import Client
+from tests.unit_tests.conftest import FakeDynamoDB
+
+
+def make_client(client_id="app", **fields):
+    fields = {"scopes": [], **fields}
+    return Client(
+        client_id=client_id,
+        response_type="code",
+        default_scopes=[],
+        redirect_uris=[],
+        default_redirect_uri=[],
+        **fields,
+    )
+
+
+@pytest.fixture
+def metrics():
+    return Registry()
+
+
+@pytest.fixture
+def cache(clock, metrics):
+    return ClientCache(maxsize=2, ttl=60, negative_ttl=5, metrics=metrics, clock=clock)
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.set("app", make_client())
+
+    assert cache.get("app")[0]
+
+    clock.now = 60
+
+    assert cache.get("app") == (False, None)
+
+
+def test_unknown_clients_are_cached_for_negative_ttl(cache, clock):
+    cache.set("unknown", None)
+
+    assert cache.get("unknown") == (True, None)
+
+    clock.now = 5
+
+    assert cache.get("unknown") == (False, None)
+
+
+def test_least_recently_used_entry_is_evicted(cache, metrics):
+    cache.set("a", make_client("a"))
+    cache.set("b", make_client("b"))
+    cache.get("a")
+    cache.set("c", make_client("c"))
+
+    assert list(cache.entries) == ["a", "c"]
+    assert metrics.snapshot()["client_cache_evictions_total"] == 1
+
+
+def test_counts_hits_and_misses(cache, metrics):
+    cache.get("app")
+    cache.set("app", make_client())
+    cache.get("app")
+    cache.set("unknown", None)
+    cache.get("unknown")
+
+    snapshot = metrics.snapshot()
+    assert snapshot["client_cache_hits_total"] == 1
+    assert snapshot["client_cache_negative_hits_total"] == 1
+    assert snapshot["client_cache_misses_total"] == 1
+    assert snapshot["client_cache_size"] == 2
+
+
+async def test_repository_reads_clients_through_the_cache(cache):
+    dynamodb = FakeDynamoDB(client_item(make_client()))
+    repository = Repository(dynamodb, "guardian", client_cache=cache)
+
+    assert (await repository.get_client("app")).client_id == "app"
+    assert (await repository.get_client("app")).client_id == "app"
+    assert await repository.get_client("unknown") is None
+    assert await repository.get_client("unknown") is None
+    assert dynamodb.calls == [("GetItem", False)] * 2
+
+
+async def test_client_changes_are_published(cache, redis):
+    dynamodb = FakeDynamoDB(client_item(make_client()))
+    invalidation = ClientCacheInvalidation(cache, redis, "clients")
+    repository = Repository(dynamodb, "guardian", client_cache=cache, client_invalidation=invalidation)
+    await repository.get_client("app")
+
+    await repository.put_client(make_client(scopes=["email"]))
+
+    assert redis.published == [("clients", "app")]
+    assert (await repository.get_client("app")).scopes == ["email"]
+
+
+class ChangedWhileReading(FakeDynamoDB):
+    """Another worker changes the client after the first read, before it returns."""
+
+    def __init__(self, invalidation, *items):
+        super().__init__(*items)
+        self.invalidation = invalidation
+        self.changed = False
+
+    async def get_item(self, table, key, consistent_read=False):
+        item = await super().get_item(table, key, consistent_read)
+        if not self.changed:
+            self.changed = True
+            self.items[self._key(key)] = client_item(make_client(scopes=["email"]))
+            self.invalidation.handle({"type": "message", "channel": b"clients", "data": b"app"})
+        return item
+
+
+async def test_clients_changed_during_a_read_are_not_cached(cache, redis, metrics):
+    invalidation = ClientCacheInvalidation(cache, redis, "clients")
+    dynamodb = ChangedWhileReading(invalidation, client_item(make_client()))
+    repository = Repository(dynamodb, "guardian", client_cache=cache, client_invalidation=invalidation)
+
+    assert (await repository.get_client("app")).scopes == []
+    assert cache.get("app") == (False, None)
+    assert metrics.snapshot()["client_cache_races_total"] == 1
+
+    assert (await repository.get_client("app")).scopes == ["email"]
+    assert cache.get("app")[1].scopes == ["email"]
+
+
+def test_published_changes_invalidate_other_workers(cache, redis):
+    invalidation = ClientCacheInvalidation(cache, redis, "clients")
+    cache.set("a", make_client("a"))
+    cache.set("b", make_client("b"))
+
+    invalidation.handle({"type": "message", "channel": b"clients", "data": b"a"})
+
+    assert list(cache.entries) == ["b"]
+
+    invalidation.handle({"type": "message", "channel": b"clients", "data": b"*"})
+
+    assert not cache.entries
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from guardian.codecs import CodecUnavailableError, Serializer
+
+SESSION = {"oauth2_credentials": {"client_id": "client", "scopes": ["openid", "email"], "state": "x" * 64}}
+
+
+@pytest.mark.parametrize("codec", ["json", "orjson", "msgpack"])
+@pytest.mark.parametrize("compression", ["none", "zlib", "lz4"])
+def test_round_trip(codec, compression):
+    try:
+        serializer = Serializer(codec, compression, compression_threshold=16)
+    except CodecUnavailableError:
+        pytest.skip(f"{codec}/{compression} is not installed")
+
+    assert serializer.loads(serializer.dumps(SESSION)) == SESSION
+
+
+def test_legacy_json_is_readable():
+    assert Serializer("orjson").loads(json.dumps(SESSION).encode()) == SESSION
+
+
+def test_payloads_are_readable_after_changing_the_configuration():
+    written = Serializer("json", "zlib", compression_threshold=16).dumps(SESSION)
+
+    assert Serializer("orjson", "none").loads(written) == SESSION
+
+
+def test_small_payloads_are_not_compressed():
+    serializer = Serializer("json", "zlib", compression_threshold=4096)
+
+    assert serializer.dumps(SESSION)[2] == 0
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        bytes((0xFF, 1, 1)) + b"not a zlib stream",
+        b"\xff",
+        b"\xff\x01",
+        bytes((0xFF, 1, 0)) + b"{not json",
+    ],
+    ids=["corrupt zlib", "truncated header", "header without compression", "corrupt json"],
+)
+def test_corrupt_payloads_raise_value_error(payload):
+    with pytest.raises(ValueError):
+        Serializer().loads(payload)
@@ -0,0 +1,52 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from guardian.openid import DiscoveryDocumentCache, provider
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    documents = DiscoveryDocumentCache(provider, max_age=60)
+    app = FastAPI()
+
+    @app.get("/.well-known")
+    async def metadata(request: Request):
+        return documents.get(request).response(request)
+
+    for name in ("token", "authorize", "revoke_token", "introspect", "userinfo", "jwks"):
+        app.add_api_route(f"/{name}", lambda: None, name=name)
+
+    client = TestClient(app)
+    client.documents = documents
+    return client
+
+
+def test_discovery_document_is_rendered_once_per_base_url(client):
+    first = client.get("/.well-known")
+    second = client.get("/.well-known")
+
+    assert first.status_code == second.status_code == 200
+    assert first.json()["token_endpoint"] == "http://testserver/token"
+    assert first.json()["jwks_uri"] == "http://testserver/jwks"
+    assert first.headers["etag"] == second.headers["etag"]
+    assert first.headers["cache-control"] == "public, max-age=60"
+    assert list(client.documents.documents) == ["http://testserver/"]
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", "W/{etag}", '"other", {etag}', "*"])
+def test_discovery_document_not_modified(client, if_none_match):
+    etag = client.get("/.well-known").headers["etag"]
+
+    response = client.get("/.well-known", headers={"If-None-Match": if_none_match.format(etag=etag)})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_discovery_document_modified(client):
+    response = client.get("/.well-known", headers={"If-None-Match": '"stale"'})
+
+    assert response.status_code == 200
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import pytest
+
+from guardian.metrics import Registry
+from guardian.openid import ProviderBusyError, ProviderExecutor
+
+
+@pytest.fixture
+async def executor():
+    executor = ProviderExecutor(max_workers=2, max_pending=2, bridge_timeout=1, metrics=Registry())
+    await executor.start()
+    yield executor
+    await executor.shutdown()
+
+
+async def test_runs_off_the_event_loop(executor):
+    loop_thread = threading.get_ident()
+
+    assert await executor.run(threading.get_ident) != loop_thread
+
+
+async def test_bridge_runs_coroutines_on_the_event_loop(executor):
+    async def on_loop():
+        return threading.get_ident()
+
+    assert await executor.run(lambda: executor.run_coroutine(on_loop())) == threading.get_ident()
+
+
+async def test_bridge_refuses_to_block_the_event_loop(executor):
+    async def noop():
+        pass
+
+    with pytest.raises(RuntimeError):
+        executor.run_coroutine(noop())
+
+
+async def test_rejects_calls_beyond_max_pending(executor):
+    release = threading.Event()
+    running = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(ProviderBusyError):
+        await executor.run(release.wait)
+
+    release.set()
+    await asyncio.gather(*running)
+    assert executor.rejected.value == 1
+    assert executor.wait_time.count == 2
+
+
+async def test_cancelled_calls_stay_pending_until_their_thread_finishes(executor):
+    started, release = threading.Event(), threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(5)
+
+    call = asyncio.ensure_future(executor.run(blocking))
+    await asyncio.to_thread(started.wait, 5)
+    call.cancel()
+    await asyncio.sleep(0)
+
+    assert call.cancelled()
+    assert executor.pending == 1
+
+    release.set()
+    while executor.pending:
+        await asyncio.sleep(0.01)
+
+
+async def test_bridge_cancels_coroutines_that_time_out():
+    executor = ProviderExecutor(max_workers=1, max_pending=1, bridge_timeout=0.05, metrics=Registry())
+    await executor.start()
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    try:
+        with pytest.raises(TimeoutError):
+            await executor.run(lambda: executor.run_coroutine(slow()))
+        await asyncio.wait_for(cancelled.wait(), 1)
+    finally:
+        await executor.shutdown()
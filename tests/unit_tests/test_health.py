@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from guardian.database import SchemaStatus
+from guardian.dependencies import get_schema_monitor
+from guardian.routers import health
+
+
+def get_health(status):
+    app = FastAPI()
+    app.include_router(health.router, prefix="/management")
+    app.dependency_overrides[get_schema_monitor] = lambda: SimpleNamespace(status=status)
+    response = TestClient(app).get("/management/health")
+    return response.status_code, response.json()["status"]
+
+
+@pytest.mark.parametrize(
+    "status, expected",
+    [
+        (SchemaStatus(table="guardian", ok=True, ready=True), (200, "UP")),
+        (SchemaStatus(table="guardian", ok=False, ready=True, outdated_indexes=["UsernameIndex"]), (200, "DEGRADED")),
+        (
+            SchemaStatus(table="guardian", ok=False, ready=True, pending_changes=["Switch to PROVISIONED"]),
+            (200, "DEGRADED"),
+        ),
+        (SchemaStatus(table="guardian", ok=False, ready=False, missing_indexes=["UsernameIndex"]), (503, "DOWN")),
+        (SchemaStatus(table="guardian", ok=False, error="Table does not exist"), (503, "DOWN")),
+        (None, (503, "DOWN")),
+    ],
+    ids=["matching", "outdated-projection", "capacity-drift", "missing-index", "missing-table", "not-checked"],
+)
+def test_health_fails_only_when_the_table_cannot_serve(status, expected):
+    assert get_health(status) == expected
@@ -0,0 +1,120 @@
+import pytest
+
+from guardian.database import IntrospectionCache
+from guardian.database.introspection_cache import digest
+from guardian.metrics import Registry
+from guardian.openid import introspection_params
+
+
+@pytest.fixture
+def cache(redis, clock):
+    return IntrospectionCache(redis, "introspection", ttl=30, local_ttl=5, maxsize=10, metrics=Registry(), clock=clock)
+
+
+ACTIVE = '{"active": true}'
+
+
+async def test_responses_are_served_from_the_worker(cache, redis):
+    await cache.set("access", "access", "client-1", ACTIVE)
+
+    assert (await cache.get("access", "access", "client-1"))[0] == ACTIVE
+    assert redis.calls.count("HGET") == 0
+
+
+async def test_responses_are_shared_through_redis(cache, redis, clock):
+    await cache.set("access", "access", "client-1", ACTIVE)
+    clock.now += 5
+
+    assert (await cache.get("access", "access", "client-1"))[0] == ACTIVE
+    assert redis.calls.count("HGET") == 1
+    assert redis.ttls[cache.prefix + digest("access")] == 30
+
+
+async def test_responses_are_only_served_to_the_same_credentials(cache):
+    await cache.set("access", "access", "client-1", ACTIVE)
+
+    assert (await cache.get("access", "access", "client-2"))[0] is None
+
+
+async def test_ttl_is_capped_by_the_token_lifetime(cache, redis, clock):
+    await cache.set("access", "access", "client-1", ACTIVE, expires_at=clock.now + 10)
+    await cache.set("expired", "expired", "client-1", ACTIVE, expires_at=clock.now - 1)
+
+    assert redis.ttls == {cache.prefix + digest("access"): 10}
+
+
+async def test_invalidation_drops_both_tiers_and_is_announced(cache, redis):
+    await cache.set("access", "access", "client-1", ACTIVE)
+
+    await cache.invalidate(["access"])
+
+    assert (await cache.get("access", "access", "client-1"))[0] is None
+    assert redis.published == [(cache.channel, digest("access"))]
+
+
+async def test_announced_invalidations_drop_the_worker_tier(cache, redis):
+    await cache.set("access", "access", "client-1", ACTIVE)
+    redis.hashes.clear()
+
+    cache.handle({"type": "message", "data": digest("access").encode()})
+
+    assert (await cache.get("access", "access", "client-1"))[0] is None
+
+
+async def test_responses_looked_up_before_an_invalidation_are_not_cached(cache, redis, clock):
+    _, generation = await cache.get("access", "access", "client-1")
+    # The token is revoked while the introspection response is being looked up
+    await cache.invalidate(["access"])
+
+    await cache.set("access", "access", "client-1", ACTIVE, generation=generation)
+
+    assert (await cache.get("access", "access", "client-1"))[0] is None
+    assert redis.hashes == {}
+
+
+async def test_invalidations_between_the_read_and_the_write_fail_the_write(cache, redis):
+    _, generation = await cache.get("access", "access", "client-1")
+    read = redis.get
+
+    async def revoked_after_the_read(key):
+        value = await read(key)
+        await redis.incr(key)
+        return value
+
+    redis.get = revoked_after_the_read
+    await cache.set("access", "access", "client-1", ACTIVE, generation=generation)
+
+    assert redis.hashes == {}
+
+
+async def test_responses_are_cached_when_nothing_was_invalidated(cache, redis, clock):
+    await cache.invalidate(["other"])
+    _, generation = await cache.get("access", "access", "client-1")
+
+    await cache.set("access", "access", "client-1", ACTIVE, generation=generation)
+    clock.now += 5
+
+    assert (await cache.get("access", "access", "client-1"))[0] == ACTIVE
+    assert redis.calls.count("HGET") == 2
+
+
+def test_jwt_access_tokens_are_grouped_by_their_id():
+    token = "eyJhbGciOiJub25lIn0.eyJqdGkiOiJqdGktMSJ9."
+
+    token_id, _, credentials = introspection_params(
+        f"token={token}&client_id=app".encode(), {"authorization": "Basic abc"}
+    )
+
+    assert token_id == "jti-1"
+    assert credentials == "Basic abc\0app\0"
+
+
+async def test_a_forged_token_in_the_same_group_does_not_extend_other_entries(cache, redis, clock):
+    # Any client can present a JWT with someone else's jti, which puts its response in their group
+    await cache.set("jti", "signed", "client-1", ACTIVE, expires_at=clock.now + 10)
+    await cache.set("jti", "forged", "client-2", '{"active": false}')
+    clock.now += 10
+
+    assert redis.ttls[cache.prefix + digest("jti")] == 30
+    assert (await cache.get("jti", "signed", "client-1"))[0] is None
+    assert (await cache.get("jti", "forged", "client-2"))[0] == '{"active": false}'
@@ -0,0 +1,100 @@
+import json
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from guardian.openid import KeyManager
+from tests.unit_tests.conftest import Clock
+
+
+@pytest.fixture
+def clock():
+    return Clock(1_000_000.0)
+
+
+@pytest.fixture
+def keys(clock):
+    return KeyManager(activation_delay=60, rotation_interval=3600, retention=600, clock=clock)
+
+
+def jwks_kids(keys):
+    return [key["kid"] for key in json.loads(keys.jwks.body)["keys"]]
+
+
+def test_tokens_are_signed_with_the_key_they_name(keys):
+    token = keys.sign({"sub": "jane"})
+
+    assert jwt.get_unverified_header(token)["kid"] == keys.signing_key.kid
+    assert keys.verify(token) == {"sub": "jane"}
+
+
+def test_rotated_key_is_published_before_it_signs(keys, clock):
+    old = keys.signing_key
+    clock.now += 3600
+    keys.refresh()
+
+    assert keys.signing_key is old
+    assert len(jwks_kids(keys)) == 2
+
+    clock.now += 60
+    keys.refresh()
+
+    assert keys.signing_key is not old
+
+
+def test_replaced_key_verifies_until_it_is_retired(keys, clock):
+    token = keys.sign({"sub": "jane"})
+    clock.now += 3600
+    keys.refresh()
+    clock.now += 60 + 599
+    keys.refresh()
+
+    assert keys.verify(token) == {"sub": "jane"}
+
+    clock.now += 1
+    keys.refresh()
+
+    with pytest.raises(jwt.InvalidTokenError):
+        keys.verify(token)
+    assert jwks_kids(keys) == [keys.signing_key.kid]
+
+
+def test_keys_are_loaded_from_a_directory(tmp_path):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    (tmp_path / "2024-01.pem").write_bytes(pem)
+
+    keys = KeyManager(directory=tmp_path)
+
+    assert keys.verify(keys.sign({"sub": "jane"})) == {"sub": "jane"}
+    assert jwt.PyJWK(keys.signing_key.jwk).key.public_numbers() == private_key.public_key().public_numbers()
+
+
+def test_empty_key_directory_is_rejected(tmp_path):
+    with pytest.raises(RuntimeError):
+        KeyManager(directory=tmp_path)
+
+
+def test_generated_keys_are_rejected_when_keys_must_be_shared():
+    with pytest.raises(RuntimeError):
+        KeyManager(allow_generated=False)
+
+
+def test_jwks_is_served_with_an_etag(keys):
+    app = FastAPI()
+
+    @app.get("/jwks")
+    async def jwks(request: Request):
+        return keys.jwks.response(request)
+
+    client = TestClient(app)
+    response = client.get("/jwks")
+
+    assert response.json()["keys"][0]["kid"] == keys.signing_key.kid
+    assert client.get("/jwks", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
@@ -0,0 +1,233 @@
+import asyncio
+from typing import Annotated
+
+import pytest
+from cryptography.fernet import Fernet
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from guardian.dependencies.session import get_session
+from guardian.metrics import Registry
+from guardian.middleware import AdmissionMiddleware, RouteLimit, Session, SessionMiddleware
+
+
+def create_client(redis, **options):
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {}
+
+    @app.get("/read")
+    async def read(session: Annotated[Session, Depends(get_session)]):
+        return dict(session)
+
+    @app.get("/write/{value}")
+    async def write(value: str, session: Annotated[Session, Depends(get_session)]):
+        session["value"] = value
+
+    @app.get("/clear")
+    async def clear(session: Annotated[Session, Depends(get_session)]):
+        session.clear()
+
+    app.add_middleware(SessionMiddleware, secret_key="secret", session_cookie="SESSION", **options)
+
+    async def with_redis(scope, receive, send):
+        scope["redis"] = redis
+        await app(scope, receive, send)
+
+    return TestClient(with_redis)
+
+
+@pytest.fixture
+def client(redis):
+    return create_client(redis)
+
+
+@pytest.fixture(params=[None, Fernet.generate_key().decode()], ids=["signed", "encrypted"])
+def cookie_client(request, redis):
+    return create_client(redis, backend="cookie", encryption_key=request.param)
+
+
+def test_session_is_not_loaded_when_unused(client, redis):
+    client.get("/write/a")
+    redis.calls.clear()
+
+    response = client.get("/health")
+
+    assert redis.calls == []
+    assert "set-cookie" not in response.headers
+
+
+def test_unchanged_session_keeps_its_id_and_only_refreshes_the_ttl(client, redis):
+    client.get("/write/a")
+    keys = set(redis.values)
+    redis.calls.clear()
+
+    response = client.get("/read")
+
+    assert response.json() == {"value": "a"}
+    assert redis.calls == ["GET", "EXPIRE"]
+    assert set(redis.values) == keys
+
+
+def test_modified_session_is_written_under_the_same_id(client, redis):
+    client.get("/write/a")
+    keys = set(redis.values)
+    redis.calls.clear()
+
+    client.get("/write/b")
+
+    assert redis.calls == ["GET", "SETEX"]
+    assert set(redis.values) == keys
+    assert client.get("/read").json() == {"value": "b"}
+
+
+def test_cleared_session_is_deleted(client, redis):
+    client.get("/write/a")
+    redis.calls.clear()
+
+    response = client.get("/clear")
+
+    assert redis.calls == ["GET", "DEL"]
+    assert redis.values == {}
+    assert "expires=Thu, 01 Jan 1970" in response.headers["set-cookie"]
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [b"\xff\x7f\x00payload", b"\xff\x01\x01payload", b"\xff"],
+    ids=["unknown codec", "corrupt zlib", "truncated header"],
+)
+def test_undecodable_session_is_replaced_by_a_new_one(client, redis, payload):
+    client.get("/write/a")
+    (key,) = redis.values
+    redis.values[key] = payload
+    redis.calls.clear()
+
+    assert client.get("/read").json() == {}
+    assert redis.calls == ["GET", "DEL"]
+
+    client.get("/write/b")
+
+    assert key not in redis.values
+    assert client.get("/read").json() == {"value": "b"}
+
+
+def test_cookie_session_round_trip_without_redis(cookie_client, redis):
+    cookie_client.get("/write/a")
+
+    assert cookie_client.get("/read").json() == {"value": "a"}
+    assert redis.calls == []
+
+
+def test_cookie_session_is_not_resent_when_unchanged(cookie_client):
+    cookie_client.get("/write/a")
+
+    assert "set-cookie" not in cookie_client.get("/read").headers
+
+
+def test_oversized_cookie_session_falls_back_to_redis(cookie_client, redis):
+    cookie_client.get(f"/write/{'a' * 5000}")
+
+    assert redis.calls == ["SETEX"]
+    assert cookie_client.get("/read").json() == {"value": "a" * 5000}
+
+    redis.calls.clear()
+    cookie_client.get("/write/small")
+
+    assert redis.calls == ["GET", "DEL"]
+    assert redis.values == {}
+    assert cookie_client.get("/read").json() == {"value": "small"}
+
+
+def test_cleared_cookie_session_expires_the_cookie(cookie_client):
+    cookie_client.get("/write/a")
+
+    response = cookie_client.get("/clear")
+
+    assert "expires=Thu, 01 Jan 1970" in response.headers["set-cookie"]
+    assert cookie_client.get("/read").json() == {}
+
+
+class BlockingApp:
+    """An ASGI app whose requests run until released, recording the order they started in."""
+
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        self.started.append(scope["path"])
+        await self.release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def call(app, path):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await app({"type": "http", "path": path, "headers": []}, None, send)
+    return messages[0]
+
+
+def admission(app, concurrency=2):
+    routes = {
+        "/introspect": RouteLimit("introspect", concurrency=2, queue_time=1.0),
+        "/token": RouteLimit("token", concurrency=1, queue_time=0.05, priority=1),
+    }
+    return AdmissionMiddleware(app, routes=routes, concurrency=concurrency, metrics=Registry())
+
+
+def test_admission_rejects_requests_over_the_route_budget():
+    async def scenario():
+        app = BlockingApp()
+        middleware = admission(app)
+        first = asyncio.create_task(call(middleware, "/token"))
+        await asyncio.sleep(0)
+
+        rejected = await call(middleware, "/token")
+        app.release.set()
+        return rejected, await first, middleware
+
+    rejected, admitted, middleware = asyncio.run(scenario())
+
+    assert rejected["status"] == 503
+    assert (b"retry-after", b"1") in rejected["headers"]
+    assert admitted["status"] == 200
+    assert middleware.rejected.snapshot() == 1
+    assert middleware.active == 0
+
+
+def test_admission_hands_freed_slots_to_introspection_first():
+    async def scenario():
+        app = BlockingApp()
+        middleware = admission(app, concurrency=1)
+        running = asyncio.create_task(call(middleware, "/introspect"))
+        await asyncio.sleep(0)
+        token = asyncio.create_task(call(middleware, "/token"))
+        await asyncio.sleep(0)
+        introspect = asyncio.create_task(call(middleware, "/introspect"))
+        await asyncio.sleep(0)
+
+        app.release.set()
+        return await asyncio.gather(running, introspect, token), app.started, middleware
+
+    (running, introspect, token), started, middleware = asyncio.run(scenario())
+
+    assert started == ["/introspect", "/introspect", "/token"]
+    assert [running["status"], introspect["status"], token["status"]] == [200, 200, 200]
+    assert middleware.waiters == []
+
+
+def test_admission_passes_other_paths_through():
+    async def scenario():
+        app = BlockingApp()
+        app.release.set()
+        middleware = admission(app, concurrency=0)
+        return await call(middleware, "/health")
+
+    assert asyncio.run(scenario())["status"] == 200
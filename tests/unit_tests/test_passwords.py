@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+from guardian.metrics import Registry
+from guardian.passwords import PasswordHasher, PasswordHasherBusyError, hash_password, parameters, verify_password
+
+# Cheap cost parameters, the tests are about the plumbing rather than the hash
+N, R, P = 2**4, 8, 1
+
+
+@pytest.fixture
+def metrics():
+    return Registry()
+
+
+def test_hash_round_trips():
+    encoded = hash_password("correct horse", n=N)
+
+    assert verify_password("correct horse", encoded)
+    assert not verify_password("wrong", encoded)
+    assert parameters(encoded) == (N, R, P)
+    assert parameters("not-a-hash") is None
+
+
+def test_hasher_verifies_inline_and_records_hash_times(metrics):
+    hasher = PasswordHasher(processes=0, max_pending=1, n=N, metrics=metrics)
+
+    assert hasher.verify("correct horse", hasher.hash("correct horse"))
+    assert metrics.snapshot()["password_hash_seconds"]["count"] == 2
+    assert metrics.snapshot()["password_hash_pending"] == 0
+
+
+def test_hasher_detects_changed_cost_parameters(metrics):
+    hasher = PasswordHasher(processes=0, max_pending=1, n=N, metrics=metrics)
+
+    assert not hasher.needs_rehash(hash_password("pw", n=N))
+    assert hasher.needs_rehash(hash_password("pw", n=N * 2))
+    assert hasher.needs_rehash("legacy-hash")
+
+
+def test_hasher_rejects_checks_beyond_the_bound(metrics, monkeypatch):
+    hasher = PasswordHasher(processes=0, max_pending=1, n=N, metrics=metrics)
+    encoded = hash_password("pw", n=N)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_verify(password, encoded):
+        started.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr("guardian.passwords.verify_password", slow_verify)
+    login = threading.Thread(target=hasher.verify, args=("pw", encoded))
+    login.start()
+    started.wait(5)
+    try:
+        with pytest.raises(PasswordHasherBusyError):
+            hasher.verify("pw", encoded)
+    finally:
+        release.set()
+        login.join()
+
+    assert metrics.snapshot()["password_hash_rejected_total"] == 1
+    assert hasher.pending == 0
+
+
+def test_hasher_runs_in_a_process_pool(metrics):
+    hasher = PasswordHasher(processes=1, max_pending=1, n=N, metrics=metrics)
+    hasher.start()
+    try:
+        assert hasher.verify("pw", hasher.hash("pw"))
+    finally:
+        hasher.shutdown()
+
+
+def test_hasher_warm_up_starts_every_process(metrics):
+    hasher = PasswordHasher(processes=2, max_pending=1, n=N, metrics=metrics)
+    hasher.start()
+    try:
+        hasher.warm_up()
+
+        assert len(hasher._executor._processes) == 2  # pylint: disable=protected-access
+    finally:
+        hasher.shutdown()
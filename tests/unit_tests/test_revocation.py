@@ -0,0 +1,73 @@
+from guardian.database import BloomFilter, RevocationList
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"token-{i}")
+
+    assert all(f"token-{i}" in bloom for i in range(1000))
+    assert len(bloom) == 1000
+
+
+def test_bloom_filter_false_positive_rate_is_close_to_the_target():
+    bloom = BloomFilter(10_000, 0.01)
+    for i in range(10_000):
+        bloom.add(f"revoked-{i}")
+
+    false_positives = sum(f"valid-{i}" in bloom for i in range(100_000))
+
+    assert false_positives / 100_000 < 0.02
+    assert bloom.size_bytes < 12_000  # about 9.6 bits per item at 1%
+
+
+def test_published_revocations_are_added():
+    revocations = RevocationList(None, "revoked", "revoked")
+
+    revocations.handle({"type": "message", "data": b"jti-1"})
+
+    assert revocations.might_be_revoked("jti-1")
+    assert not revocations.might_be_revoked("jti-2")
+
+
+async def test_revoked_ids_are_stored_and_published(redis):
+    revocations = RevocationList(redis, "revoked", "revoked")
+
+    await revocations.revoke("jti-1", 2_000_000_000.0)
+
+    assert revocations.might_be_revoked("jti-1")
+    assert redis.sorted_sets["revoked"] == {"jti-1": 2_000_000_000.0}
+    assert redis.published == [("revoked", "jti-1")]
+
+
+async def test_rebuild_drops_expired_ids(redis):
+    revocations = RevocationList(redis, "revoked", "revoked")
+    revocations.add("expired")
+    redis.sorted_sets["revoked"] = {"expired": 100.0, "live": 2_000_000_000.0}
+
+    await revocations.rebuild()
+
+    assert not revocations.might_be_revoked("expired")
+    assert revocations.might_be_revoked("live")
+
+
+async def test_full_filter_is_rebuilt(redis):
+    revocations = RevocationList(redis, "revoked", "revoked", capacity=10)
+    redis.sorted_sets["revoked"] = {"live": 2_000_000_000.0}
+    for i in range(10):
+        revocations.add(f"expired-{i}")
+
+    await revocations._rebuild_task
+
+    assert len(revocations.filter) == 1
+
+
+async def test_own_revocations_are_not_added_again_when_echoed(redis):
+    revocations = RevocationList(redis, "revoked", "revoked")
+
+    await revocations.revoke("jti-1", 2_000_000_000.0)
+    revocations.handle({"type": "message", "data": b"jti-1"})
+    revocations.handle({"type": "message", "data": b"jti-2"})
+
+    assert revocations.might_be_revoked("jti-2")
+    assert len(revocations.filter) == 2
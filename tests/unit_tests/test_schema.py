@@ -0,0 +1,299 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from aiodynamo.errors import TableNotFound
+from aiodynamo.models import ProjectionType, Throughput
+
+from guardian.database import SCHEMA, Capacity, Repository, SchemaMonitor, apply, check_schema, plan
+from guardian.database.schema import ACCESS_PATTERNS
+from guardian.models import BearerToken
+from tests.unit_tests.conftest import FakeDynamoDB
+
+TABLE = "guardian"
+
+
+def test_indexes_project_the_attributes_their_access_patterns_read():
+    projections = {gsi.name: gsi.projection for gsi in SCHEMA["gsis"]}
+
+    for pattern in ACCESS_PATTERNS.values():
+        assert projections[pattern.index].type is ProjectionType.include
+        assert set(pattern.attributes) <= set(projections[pattern.index].attrs)
+    assert projections["TokenIdIndex"].type is ProjectionType.keys_only
+
+
+def live_index(gsi, projection_type=None, attributes=None):
+    projection = {"ProjectionType": projection_type or gsi.projection.type.value}
+    if attributes or gsi.projection.attrs:
+        projection["NonKeyAttributes"] = attributes or gsi.projection.attrs
+    return {"IndexName": gsi.name, "IndexStatus": "ACTIVE", "KeySchema": gsi.schema.encode(), "Projection": projection}
+
+
+def test_check_schema_reports_indexes_with_outdated_projections():
+    indexes = [live_index(gsi) for gsi in SCHEMA["gsis"] if gsi.name != "ClientIdIndex"]
+    indexes[1] = live_index(SCHEMA["gsis"][1], projection_type="KEYS_ONLY")
+
+    status = asyncio.run(check_schema(FakeTable(live_table(indexes=indexes), TTL_ENABLED), TABLE, SCHEMA))
+
+    assert not status.ok and not status.ready
+    assert status.missing_indexes == ["ClientIdIndex"]
+    assert status.outdated_indexes == [SCHEMA["gsis"][1].name]
+    assert status.ttl_status == "ENABLED"
+
+
+def test_tokens_by_username_are_read_from_the_index_alone():
+    dynamodb = FakeDynamoDB()
+    repository = Repository(dynamodb, TABLE)
+    token = BearerToken(
+        client_id="client",
+        scopes=["email"],
+        access_token="access",
+        refresh_token="refresh",
+        expires_at=datetime.utcnow() + timedelta(hours=1),
+        username="jane@example.com",
+    )
+    asyncio.run(repository.save_token(token))
+
+    assert asyncio.run(repository.get_tokens_by_username("jane@example.com")) == [token]
+    assert dynamodb.calls[-1] == ("Query", "UsernameIndex")
+
+
+def live_table(billing_mode="PROVISIONED", indexes=None):
+    return {
+        "TableStatus": "ACTIVE",
+        "BillingModeSummary": {"BillingMode": billing_mode},
+        "ProvisionedThroughput": {"ReadCapacityUnits": 1, "WriteCapacityUnits": 1},
+        "GlobalSecondaryIndexes": (
+            [
+                {**live_index(gsi), "ProvisionedThroughput": {"ReadCapacityUnits": 1, "WriteCapacityUnits": 1}}
+                for gsi in SCHEMA["gsis"]
+            ]
+            if indexes is None
+            else indexes
+        ),
+    }
+
+
+TTL_ENABLED = {"TimeToLiveStatus": "ENABLED"}
+
+
+def test_plan_creates_a_missing_table_on_demand():
+    changes = plan(TABLE, SCHEMA, Capacity("PAY_PER_REQUEST"), None)
+
+    assert [change.action for change in changes] == ["CreateTable", "UpdateTimeToLive"]
+    payload = changes[0].payload
+    assert payload["BillingMode"] == "PAY_PER_REQUEST"
+    assert "ProvisionedThroughput" not in payload
+    assert all("ProvisionedThroughput" not in index for index in payload["GlobalSecondaryIndexes"])
+
+
+def test_plan_is_empty_for_a_matching_table():
+    assert plan(TABLE, SCHEMA, Capacity.from_schema(SCHEMA), live_table(), TTL_ENABLED) == []
+
+
+def test_plan_replaces_changed_indexes_under_a_new_name_and_sets_capacity():
+    live = live_table()
+    outdated = live["GlobalSecondaryIndexes"][1]
+    outdated["Projection"] = {"ProjectionType": "KEYS_ONLY"}
+    live["GlobalSecondaryIndexes"].append(live_index(SCHEMA["gsis"][0]) | {"IndexName": "LegacyIndex"})
+    capacity = Capacity(table=Throughput(read=10, write=5), indexes={"TokenIdIndex": Throughput(read=20, write=5)})
+
+    changes = plan(TABLE, SCHEMA, capacity, live, TTL_ENABLED)
+
+    # The old index is only dropped once its replacement has backfilled
+    assert [change.summary.split(" (")[0] for change in changes] == [
+        "Delete index LegacyIndex",
+        "Set table capacity to 10 RCU / 5 WCU",
+        *(
+            f"Set index {gsi.name} capacity to {20 if gsi.name == 'TokenIdIndex' else 10} RCU / 5 WCU"
+            for gsi in SCHEMA["gsis"]
+        ),
+        f"Create index {outdated['IndexName']}-2 and wait for its backfill",
+        f"Delete index {outdated['IndexName']}",
+    ]
+    assert [change.after_switch for change in changes] == [False] * (len(changes) - 1) + [True]
+    create = changes[-2].payload["GlobalSecondaryIndexUpdates"][0]["Create"]
+    assert create["IndexName"] == f"{outdated['IndexName']}-2"
+    assert create["Projection"] == SCHEMA["gsis"][1].projection.encode()
+    assert create["ProvisionedThroughput"] == {"ReadCapacityUnits": 10, "WriteCapacityUnits": 5}
+
+
+def test_plan_finishes_an_interrupted_index_replacement():
+    gsi = SCHEMA["gsis"][1]
+    indexes = [live_index(declared) for declared in SCHEMA["gsis"]]
+    indexes[1] = live_index(gsi, projection_type="KEYS_ONLY")
+    indexes.append(live_index(gsi) | {"IndexName": f"{gsi.name}-2"})
+
+    changes = plan(TABLE, SCHEMA, Capacity("PAY_PER_REQUEST"), live_table("PAY_PER_REQUEST", indexes), TTL_ENABLED)
+    status = asyncio.run(check_schema(FakeTable(live_table("PAY_PER_REQUEST", indexes), TTL_ENABLED), TABLE, SCHEMA))
+
+    assert [change.summary.split(" (")[0] for change in changes] == [f"Delete index {gsi.name}"]
+    assert status.ready and not status.outdated_indexes
+    assert status.index_names[gsi.name] == f"{gsi.name}-2"
+
+
+def test_queries_stay_on_the_old_index_until_its_replacement_has_backfilled():
+    indexes = [live_index(gsi) for gsi in SCHEMA["gsis"]]
+    username = next(index for index in indexes if index["IndexName"] == "UsernameIndex")
+    username["Projection"] = {"ProjectionType": "KEYS_ONLY"}
+    replacement = live_index(next(gsi for gsi in SCHEMA["gsis"] if gsi.name == "UsernameIndex"))
+    indexes.append(replacement | {"IndexName": "UsernameIndex-2", "IndexStatus": "CREATING"})
+    table = FakeTable(live_table(indexes=indexes), TTL_ENABLED)
+    monitor = SchemaMonitor(table, TABLE, SCHEMA, interval=0)
+    dynamodb = FakeDynamoDB()
+    repository = Repository(dynamodb, TABLE, index_names=monitor.index_names)
+
+    backfilling = asyncio.run(monitor.check())
+    asyncio.run(repository.get_tokens_by_username("jane@example.com"))
+    assert backfilling.ready and backfilling.error == "Indexes not active: UsernameIndex-2"
+    assert dynamodb.calls[-1] == ("Query", "UsernameIndex")
+
+    indexes[-1]["IndexStatus"] = "ACTIVE"
+    asyncio.run(monitor.check())
+    asyncio.run(repository.get_tokens_by_username("jane@example.com"))
+    assert dynamodb.calls[-1] == ("Query", "UsernameIndex-2")
+
+
+def test_plan_switches_billing_with_index_capacity():
+    changes = plan(TABLE, SCHEMA, Capacity.from_schema(SCHEMA), live_table("PAY_PER_REQUEST"), TTL_ENABLED)
+
+    assert len(changes) == 1
+    assert changes[0].payload["BillingMode"] == "PROVISIONED"
+    assert len(changes[0].payload["GlobalSecondaryIndexUpdates"]) == len(SCHEMA["gsis"])
+
+
+class FakeControlPlane:
+    """Answers DescribeTable with a backfilling index for a few polls after every change."""
+
+    def __init__(self):
+        self.requests = []
+        self.backfilling = 0
+
+    async def send_request(self, action, payload):
+        self.requests.append(action)
+        if action == "DescribeTable":
+            self.backfilling = max(self.backfilling - 1, 0)
+            index = {"IndexName": "TokenIdIndex", "IndexStatus": "CREATING" if self.backfilling else "ACTIVE"}
+            return {"Table": {"TableStatus": "ACTIVE", "GlobalSecondaryIndexes": [index]}}
+        self.backfilling = 3
+        return {}
+
+
+def test_apply_waits_for_every_change_to_settle():
+    control_plane = FakeControlPlane()
+    changes = plan(TABLE, SCHEMA, Capacity("PAY_PER_REQUEST"), live_table("PAY_PER_REQUEST", []), TTL_ENABLED)
+
+    asyncio.run(apply(control_plane, TABLE, changes[:2], poll_interval=0))
+
+    assert control_plane.requests == [
+        "DescribeTable",
+        "UpdateTable",
+        *["DescribeTable"] * 3,
+        "DescribeTable",
+        "UpdateTable",
+        *["DescribeTable"] * 3,
+    ]
+
+
+class FakeTable:
+    """A table that exists once created, with TTL off until it is turned on."""
+
+    def __init__(self, description=None, ttl=None):
+        self.description = description
+        self.ttl = ttl or {"TimeToLiveStatus": "DISABLED"}
+        self.requests = []
+
+    async def send_request(self, action, payload):
+        self.requests.append(action)
+        if action == "DescribeTable":
+            if self.description is None:
+                raise TableNotFound()
+            return {"Table": self.description}
+        if action == "DescribeTimeToLive":
+            return {"TimeToLiveDescription": self.ttl}
+        if action == "CreateTable":
+            self.description = live_table()
+        elif action == "UpdateTimeToLive":
+            self.ttl = TTL_ENABLED
+        return {}
+
+
+def test_schema_monitor_bootstrap_creates_a_missing_table():
+    table = FakeTable()
+    monitor = SchemaMonitor(table, TABLE, SCHEMA, interval=0, capacity=Capacity.from_schema(SCHEMA))
+
+    status = asyncio.run(monitor.bootstrap())
+
+    assert "CreateTable" in table.requests and "UpdateTimeToLive" in table.requests
+    assert status.ok and status.ready
+    assert monitor.status is status
+
+
+def test_schema_monitor_bootstrap_without_create_reports_a_missing_table():
+    table = FakeTable()
+    monitor = SchemaMonitor(table, TABLE, SCHEMA, interval=0)
+
+    status = asyncio.run(monitor.bootstrap(create=False))
+
+    assert table.requests == ["DescribeTable"]
+    assert not status.ready and not status.ok
+    assert status.error == "Table does not exist"
+
+
+def test_capacity_drift_leaves_the_table_ready():
+    table = FakeTable(live_table(), TTL_ENABLED)
+    monitor = SchemaMonitor(table, TABLE, SCHEMA, interval=0, capacity=Capacity("PAY_PER_REQUEST"))
+
+    status = asyncio.run(monitor.check())
+
+    assert status.ready and not status.ok
+    assert len(status.pending_changes) == 1
+
+
+def test_table_updating_its_capacity_stays_ready():
+    table = FakeTable({**live_table(), "TableStatus": "UPDATING"}, TTL_ENABLED)
+
+    status = asyncio.run(check_schema(table, TABLE, SCHEMA))
+
+    assert status.ready and not status.ok
+
+
+def test_backfilling_index_stays_ready():
+    indexes = [live_index(gsi) for gsi in SCHEMA["gsis"]]
+    indexes[0] = {**indexes[0], "IndexStatus": "CREATING"}
+
+    status = asyncio.run(check_schema(FakeTable(live_table(indexes=indexes), TTL_ENABLED), TABLE, SCHEMA))
+
+    assert status.ready and not status.ok
+
+
+def test_only_indexes_queried_by_requests_are_required():
+    background = [live_index(gsi) for gsi in SCHEMA["gsis"] if gsi.name != "EntityTypeIndex"]
+    requests = [live_index(gsi) for gsi in SCHEMA["gsis"] if gsi.name != "UsernameIndex"]
+
+    without_background = asyncio.run(
+        check_schema(FakeTable(live_table(indexes=background), TTL_ENABLED), TABLE, SCHEMA)
+    )
+    without_requests = asyncio.run(check_schema(FakeTable(live_table(indexes=requests), TTL_ENABLED), TABLE, SCHEMA))
+
+    assert without_background.ready and not without_background.ok
+    assert not without_requests.ready
+
+
+class ThrottledTable(FakeTable):
+    throttled = False
+
+    async def send_request(self, action, payload):
+        if self.throttled:
+            raise RuntimeError("ThrottlingException")
+        return await super().send_request(action, payload)
+
+
+def test_schema_monitor_keeps_the_last_status_when_dynamodb_fails():
+    table = ThrottledTable(live_table(), TTL_ENABLED)
+    monitor = SchemaMonitor(table, TABLE, SCHEMA, interval=0)
+    ready = asyncio.run(monitor.check())
+
+    table.throttled = True
+    asyncio.run(monitor.check())
+
+    assert monitor.status is ready and ready.ready
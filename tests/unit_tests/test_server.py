@@ -0,0 +1,48 @@
+import os
+import signal
+
+import pytest
+
+from guardian import server
+
+
+@pytest.fixture
+def cpus(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda _: set(range(8)), raising=False)
+
+
+@pytest.mark.parametrize(("cpu_max", "expected"), [("max 100000", 8), ("150000 100000", 2), ("50000 100000", 1)])
+def test_available_cpus_follow_the_container_cpu_limit(cpus, tmp_path, monkeypatch, cpu_max, expected):
+    (tmp_path / "cpu.max").write_text(cpu_max + "\n")
+    monkeypatch.setattr(server, "CGROUP_CPU_MAX", tmp_path / "cpu.max")
+
+    assert server.available_cpus() == expected
+
+
+def test_available_cpus_without_a_cgroup_limit(cpus, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "CGROUP_CPU_MAX", tmp_path / "missing")
+
+    assert server.available_cpus() == 8
+
+
+async def failing_app(scope, receive, send):
+    # An application whose lifespan startup fails, like one that cannot reach DynamoDB
+    if scope["type"] == "lifespan":
+        await receive()
+        await send({"type": "lifespan.startup.failed", "message": "DynamoDB is unreachable"})
+
+
+def test_prefork_stops_after_consecutive_startup_failures(monkeypatch):
+    monkeypatch.setattr(server, "BACKOFF_INITIAL", 0.01)
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)}
+    prefork = server.Prefork(
+        f"{__name__}:failing_app", "127.0.0.1", 0, workers=2, graceful_timeout=1, max_startup_failures=3
+    )
+    try:
+        assert prefork.run() == server.STARTUP_FAILURE
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    assert prefork.startup_failures == 3
+    assert not prefork.pids
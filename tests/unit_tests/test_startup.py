@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from guardian.metrics import Registry
+from guardian.startup import StartupTimer
+
+# Generous for a cold interpreter on a busy CI runner, override it on slower ones; deferring nothing takes twice as long
+IMPORT_TIME_BUDGET = float(os.environ.get("GUARDIAN_IMPORT_TIME_BUDGET", "1.0"))
+
+# Imported by the lifespan, never by importing the application
+DEFERRED_MODULES = (
+    "aiodynamo",
+    "cryptography.fernet",
+    "cryptography.hazmat",
+    "httpx",
+    "jinja2",
+    "jwt",
+    "oauthlib",
+    "yarl",
+    "guardian.database",
+    "guardian.routers",
+)
+
+IMPORT_SCRIPT = f"""
+import sys, time
+
+start = time.perf_counter()
+import guardian.main
+elapsed = time.perf_counter() - start
+print(elapsed, *[name for name in {DEFERRED_MODULES!r} if name in sys.modules])
+"""
+
+
+def test_phases_accumulate_and_exclude_nested_phases(clock):
+    metrics = Registry()
+    timer = StartupTimer(clock=clock, metrics=metrics)
+
+    timer.begin("import")
+    clock.now += 1
+    with timer.phase("configuration"):
+        clock.now += 0.5
+    clock.now += 1
+    timer.end("import")
+    with timer.phase("import"):
+        clock.now += 0.25
+    timer.report()
+
+    assert timer.phases == {"configuration": 0.5, "import": 2.25}
+    snapshot = metrics.snapshot()
+    assert snapshot["startup_import_seconds"] == 2.25
+    assert snapshot["startup_seconds"] == 2.75
+
+
+def test_ending_a_phase_that_is_not_running_fails(clock):
+    timer = StartupTimer(clock=clock, metrics=Registry())
+    timer.begin("pools")
+
+    with pytest.raises(RuntimeError):
+        timer.end("warmup")
+
+
+def import_application() -> tuple[float, list[str]]:
+    # A fresh interpreter, this one has long imported everything
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, text=True, check=True, env=os.environ.copy()
+    )
+    elapsed, *loaded = result.stdout.split()
+    return float(elapsed), loaded
+
+
+def test_importing_the_application_defers_heavy_subsystems():
+    _, loaded = import_application()
+
+    assert loaded == []
+
+
+def test_importing_the_application_stays_within_budget():
+    # The best of three runs, see tests/benchmarks/import_time.py for where the time goes
+    elapsed = min(import_application()[0] for _ in range(3))
+
+    assert elapsed < IMPORT_TIME_BUDGET, f"import guardian.main took {elapsed:.3f}s, budget {IMPORT_TIME_BUDGET}s"
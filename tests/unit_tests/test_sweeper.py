@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from aiodynamo.models import BatchWriteRequest, BatchWriteResult
+
+from guardian.database import EntityRef, ExpirySweeper, Repository
+from guardian.database.repository import AUTHORIZATION_CODE, BEARER_TOKEN, REFRESH_TOKEN
+from guardian.metrics import Registry
+from guardian.models import AuthorizationCode, BearerToken
+from tests.unit_tests.conftest import FakeDynamoDB
+
+TABLE = "guardian"
+NOW = 1_700_000_000
+
+
+class ThrottledDynamoDB(FakeDynamoDB):
+    """Filters queries to expired items and leaves one key unprocessed in the first batch."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.throttle = True
+
+    async def query(self, table, key_condition, index=None, filter_expression=None, projection=None):
+        async for item in super().query(table, key_condition, index):
+            if item.get("ExpiresAt", NOW) < NOW:
+                yield item
+
+    async def batch_write(self, request):
+        keys = request[TABLE].keys_to_delete
+        self.batches.append(len(keys))
+        if not self.throttle:
+            return await super().batch_write(request)
+        self.throttle = False
+        await super().batch_write({TABLE: BatchWriteRequest(keys_to_delete=keys[:-1])})
+        return {TABLE: BatchWriteResult(undeleted_keys=keys[-1:], unput_items=[])}
+
+
+def token(name, expires_at):
+    return BearerToken(
+        client_id="client", scopes=[], access_token=name, refresh_token=f"{name}-refresh", expires_at=expires_at
+    )
+
+
+def test_sweeper_deletes_expired_tokens_and_codes_in_batches():
+    dynamodb = ThrottledDynamoDB()
+    repository = Repository(dynamodb, TABLE)
+    expired = datetime.utcfromtimestamp(NOW) - timedelta(minutes=1)
+    valid = datetime.utcfromtimestamp(NOW) + timedelta(minutes=1)
+
+    async def scenario():
+        for i in range(5):
+            await repository.save_token(token(f"expired-{i}", expired))
+        await repository.save_token(token("valid", valid))
+        await repository.put_authorization_code(
+            AuthorizationCode(client_id="client", scopes=[], redirect_uri="", code="code", expires_at=expired)
+        )
+        sweeper = ExpirySweeper(dynamodb, TABLE, interval=0, batch_size=2, metrics=Registry(), clock=lambda: NOW)
+        return await sweeper.sweep(), sweeper
+
+    deleted, sweeper = asyncio.run(scenario())
+
+    remaining = {EntityRef.from_item(item) for item in dynamodb.items.values()}
+    assert deleted == 6
+    assert sweeper.deleted.snapshot() == 6
+    assert dynamodb.batches == [2, 1, 2, 1, 1]
+    assert remaining == {EntityRef(BEARER_TOKEN, "valid"), EntityRef(REFRESH_TOKEN, "valid-refresh")} | {
+        EntityRef(REFRESH_TOKEN, f"expired-{i}-refresh") for i in range(5)
+    }
+    assert AUTHORIZATION_CODE not in {ref.type for ref in remaining}
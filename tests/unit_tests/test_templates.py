@@ -0,0 +1,34 @@
+import pytest
+
+from guardian.config import guardian
+from guardian.dependencies import create_jinja2_templates
+
+TEMPLATES_DIR = guardian.server.JINJA2_TEMPLATES_DIR
+
+
+def test_precompile_writes_every_bundled_template_to_the_bytecode_cache(tmp_path):
+    cache_dir = tmp_path / "bytecode"
+
+    names = create_jinja2_templates(TEMPLATES_DIR, bytecode_cache_dir=cache_dir).precompile()
+
+    assert names and all(name.endswith(".html") for name in names)
+    assert len(list(cache_dir.glob("*.cache"))) == len(names)
+
+
+def test_precompiled_templates_are_loaded_without_compiling(tmp_path):
+    create_jinja2_templates(TEMPLATES_DIR, bytecode_cache_dir=tmp_path).precompile()
+    templates = create_jinja2_templates(TEMPLATES_DIR, bytecode_cache_dir=tmp_path)
+
+    def fail_to_compile(*args, **kwargs):
+        pytest.fail("template compiled although its bytecode is cached")
+
+    templates.env.compile = fail_to_compile
+
+    assert templates.precompile()
+
+
+def test_templates_compile_without_a_bytecode_cache(tmp_path):
+    templates = create_jinja2_templates(TEMPLATES_DIR, bytecode_cache_dir=tmp_path, use_bytecode_cache=False)
+
+    assert templates.precompile()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from guardian.database import RevocationList, TokenStore
+from guardian.database.token_store import TOMBSTONE
+from guardian.models import BearerToken
+
+
+class FakeRepository:
+    """Stands in for DynamoDB, `stale` keeps serving revoked tokens like a lagging read."""
+
+    def __init__(self):
+        self.tokens = {}
+        self.reads = 0
+        self.stale = False
+
+    async def get_bearer_token(self, access_token):
+        self.reads += 1
+        return self.tokens.get(access_token)
+
+    async def get_bearer_tokens(self, access_tokens):
+        self.reads += 1
+        return {access_token: self.tokens.get(access_token) for access_token in access_tokens}
+
+    async def save_token(self, token, **kwargs):
+        self.tokens[token.access_token] = token
+
+    async def revoke_token(self, token, include_refresh_token=False):
+        if not self.stale:
+            del self.tokens[token.access_token]
+
+
+class FailingRevocationList:
+    async def revoke(self, token_id, expires_at):
+        raise RedisConnectionError("Redis is down")
+
+
+class RecordingIntrospectionCache:
+    def __init__(self):
+        self.invalidated = []
+
+    async def invalidate(self, token_ids):
+        self.invalidated.extend(token_ids)
+
+
+def make_token(access_token="access", expires_in=3600):
+    return BearerToken(
+        client_id="app",
+        scopes=["email"],
+        access_token=access_token,
+        expires_at=datetime.utcnow() + timedelta(seconds=expires_in),
+    )
+
+
+@pytest.fixture
+def repository():
+    return FakeRepository()
+
+
+@pytest.fixture
+def store(repository, redis):
+    return TokenStore(repository, redis, max_ttl=60)
+
+
+async def test_saved_tokens_are_served_from_redis(store, repository, redis):
+    await store.save_token(make_token())
+
+    assert (await store.get_bearer_token("access")).access_token == "access"
+    assert repository.reads == 0
+    assert redis.ttls["guardian:token:access"] == 60
+
+
+async def test_short_lived_tokens_are_cached_until_they_expire(store, redis):
+    await store.save_token(make_token(expires_in=30))
+
+    assert redis.ttls["guardian:token:access"] in (29, 30)
+
+
+async def test_cache_misses_are_filled_from_dynamodb(store, repository):
+    repository.tokens["access"] = make_token()
+
+    await store.get_bearer_token("access")
+    await store.get_bearer_token("access")
+
+    assert repository.reads == 1
+
+
+async def test_revoked_tokens_stop_validating_before_dynamodb_catches_up(store, repository, redis):
+    token = make_token()
+    await store.save_token(token)
+    repository.stale = True
+
+    await store.revoke_token(token)
+
+    assert redis.values["guardian:token:access"] == TOMBSTONE
+    assert await store.get_bearer_token("access") is None
+
+
+async def test_falls_back_to_dynamodb_while_redis_is_down(store, repository, redis):
+    token = make_token()
+    await store.save_token(token)
+    redis.down = True
+
+    assert (await store.get_bearer_token("access")).access_token == "access"
+
+    await store.revoke_token(token)
+
+    assert await store.get_bearer_token("access") is None
+
+
+async def test_revoking_invalidates_cached_introspection_responses(repository, redis):
+    introspection = RecordingIntrospectionCache()
+    store = TokenStore(repository, redis, max_ttl=60, introspection=introspection)
+    token = make_token()
+    token.refresh_token = "refresh"
+    await store.save_token(token)
+
+    await store.revoke_token(token, include_refresh_token=True)
+
+    assert introspection.invalidated == ["access", "refresh"]
+
+
+async def test_batches_read_redis_once_and_dynamodb_for_the_misses(store, repository, redis):
+    await store.save_token(make_token("cached"))
+    repository.tokens["stored"] = make_token("stored")
+
+    found = await store.get_bearer_tokens(["cached", "stored", "unknown"])
+
+    assert found["cached"].access_token == "cached"
+    assert found["stored"].access_token == "stored"
+    assert found["unknown"] is None
+    assert repository.reads == 1
+    assert "guardian:token:stored" in redis.values
+
+
+async def test_revocations_that_cannot_reach_the_filter_fail(repository, redis):
+    store = TokenStore(repository, redis, max_ttl=60, revocations=FailingRevocationList())
+    token = make_token()
+    await store.save_token(token)
+
+    with pytest.raises(RedisConnectionError):
+        await store.revoke_token(token)
+
+    # Still in DynamoDB, so the client can retry the revocation
+    assert "access" in repository.tokens
+
+
+async def test_revoked_jwts_without_a_tombstone_are_found_in_the_revocation_set(repository, redis):
+    store = TokenStore(repository, redis, max_ttl=60, revocations=RevocationList(redis, "revoked", "revoked"))
+    token = make_token("jti-1")
+    await store.save_token(token)
+
+    async def unreachable(*args):
+        raise RedisConnectionError("Redis is down")
+
+    redis.setex = unreachable  # the tombstone write fails, the revocation set write succeeds
+    await store.revoke_token(token)
+
+    assert redis.values["guardian:token:jti-1"] != TOMBSTONE
+    assert "jti-1" not in repository.tokens
+    assert await store.is_revoked("jti-1")
+    assert not await store.is_revoked("jti-2")
@@ -0,0 +1,550 @@
+import asyncio
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import jwt
+import pytest
+from oauthlib.common import Request
+from oauthlib.oauth2 import InvalidGrantError
+from oauthlib.openid import Server
+
+from guardian.database import CodeStore, EntityRef, Repository, RevocationList
+from guardian.database.repository import USER
+from guardian.metrics import Registry
+from guardian.models import AuthorizationCode, Client, GrantType, User
+from guardian.openid import BatchIntrospectEndpoint, DynamoDBRequestValidator, JWTAccessTokens, KeyManager
+from guardian.passwords import PasswordHasher, hash_client_secret, hash_password, parameters
+
+TABLE = "guardian"
+TOKEN_URI = "https://guardian.test/oauth/token"
+
+
+def basic_auth(client_id, secret):
+    return {"Authorization": "Basic " + base64.b64encode(f"{client_id}:{secret}".encode()).decode()}
+
+
+@pytest.fixture
+def repository(dynamodb):
+    repository = Repository(dynamodb, TABLE)
+    asyncio.run(
+        repository.put_client(
+            Client(
+                client_id="confidential",
+                client_secret=hash_client_secret("client-secret"),
+                grant_type=GrantType.PASSWORD,
+                response_type="code",
+                scopes=["openid", "email", "profile"],
+                default_scopes=["openid"],
+                redirect_uris=["https://app.test/callback"],
+                default_redirect_uri=[],
+            )
+        )
+    )
+    asyncio.run(
+        repository.put_client(
+            Client(
+                client_id="public",
+                response_type="code",
+                scopes=["openid", "email"],
+                default_scopes=["openid"],
+                redirect_uris=["https://app.test/callback"],
+                default_redirect_uri=[],
+            )
+        )
+    )
+    asyncio.run(
+        repository.put_client(
+            Client(
+                client_id="service",
+                client_secret=hash_client_secret("service-secret"),
+                grant_type=GrantType.CLIENT_CREDENTIALS,
+                response_type="token",
+                scopes=["email"],
+                default_scopes=["email"],
+                redirect_uris=[],
+                default_redirect_uri=[],
+            )
+        )
+    )
+    asyncio.run(
+        repository.put_client(
+            Client(
+                client_id="gateway",
+                client_secret=hash_client_secret("gateway-secret"),
+                grant_type=GrantType.CLIENT_CREDENTIALS,
+                response_type="token",
+                scopes=[],
+                default_scopes=[],
+                redirect_uris=[],
+                default_redirect_uri=[],
+                can_introspect=True,
+            )
+        )
+    )
+    asyncio.run(repository.put_user(User(email="jane@example.com", password=hash_password("correct horse"))))
+    asyncio.run(
+        repository.put_authorization_code(
+            AuthorizationCode(
+                client_id="public",
+                username="jane@example.com",
+                scopes=["email"],
+                redirect_uri="https://app.test/callback",
+                code="code-1",
+                expires_at=datetime.utcnow() + timedelta(minutes=5),
+            )
+        )
+    )
+    asyncio.run(
+        repository.put_authorization_code(
+            AuthorizationCode(
+                client_id="public",
+                username="jane@example.com",
+                scopes=["openid", "email"],
+                redirect_uri="https://app.test/callback",
+                code="openid-code",
+                nonce="n-0S6_WzA2Mj",
+                expires_at=datetime.utcnow() + timedelta(minutes=5),
+            )
+        )
+    )
+    return repository
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return KeyManager()
+
+
+@pytest.fixture
+def server(repository, keys):
+    validator = DynamoDBRequestValidator()
+    validator.bind(repository, asyncio.run, keys=keys)
+    return Server(validator)
+
+
+def token_request(server, headers=None, **params):
+    headers = {"Content-Type": "application/x-www-form-urlencoded", **(headers or {})}
+    _, body, status = server.create_token_response(TOKEN_URI, "POST", urlencode(params), headers)
+    return status, json.loads(body)
+
+
+def test_password_grant_stores_the_token(server, dynamodb):
+    status, token = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="password",
+        username="jane@example.com",
+        password="correct horse",
+    )
+
+    assert status == 200
+    assert ("BearerToken#" + token["access_token"],) * 2 in dynamodb.items
+    assert ("RefreshToken#" + token["refresh_token"],) * 2 in dynamodb.items
+
+
+def test_password_grant_rehashes_with_new_cost_parameters(repository, keys):
+    validator = DynamoDBRequestValidator()
+    passwords = PasswordHasher(processes=0, max_pending=1, n=2**4, metrics=Registry())
+    validator.bind(repository, asyncio.run, keys=keys, passwords=passwords)
+    params = {"grant_type": "password", "username": "jane@example.com", "password": "correct horse"}
+
+    status, _ = token_request(Server(validator), basic_auth("confidential", "client-secret"), **params)
+
+    user = asyncio.run(repository.get_user("jane@example.com"))
+    assert status == 200
+    assert parameters(user.password) == (2**4, 8, 1)
+    assert passwords.rehashed.snapshot() == 1
+
+    token_request(Server(validator), basic_auth("confidential", "client-secret"), **params)
+    assert passwords.rehashed.snapshot() == 1
+
+
+def reads(dynamodb):
+    return [call for call in dynamodb.calls if call[0] in ("GetItem", "BatchGetItem")]
+
+
+def test_authorization_request_reads_the_client_once(server, dynamodb):
+    dynamodb.calls.clear()
+
+    scopes, _ = server.validate_authorization_request(
+        "https://guardian.test/oauth/authorize?"
+        + urlencode({"response_type": "code", "client_id": "public", "scope": "email"})
+    )
+
+    assert scopes == ["email"]
+    assert reads(dynamodb) == [("GetItem", False)]
+
+
+@pytest.mark.parametrize(
+    "grant_type, expected_reads",
+    [
+        ("password", [("BatchGetItem", False)]),
+        ("authorization_code", [("BatchGetItem", True)]),
+        ("refresh_token", [("BatchGetItem", True)]),
+        ("client_credentials", [("GetItem", False)]),
+    ],
+)
+def test_token_request_reads_each_entity_once(server, dynamodb, grant_type, expected_reads):
+    params = {
+        "password": {"username": "jane@example.com", "password": "correct horse"},
+        "authorization_code": {"client_id": "public", "code": "code-1"},
+        "client_credentials": {},
+    }.get(grant_type)
+    headers = {
+        "authorization_code": {},
+        "client_credentials": basic_auth("service", "service-secret"),
+    }.get(grant_type, basic_auth("confidential", "client-secret"))
+    if grant_type == "refresh_token":
+        _, token = token_request(
+            server, headers, grant_type="password", username="jane@example.com", password="correct horse", scope="email"
+        )
+        params = {"refresh_token": token["refresh_token"]}
+    dynamodb.calls.clear()
+
+    status, _ = token_request(server, headers, grant_type=grant_type, **params)
+
+    assert status == 200
+    assert reads(dynamodb) == expected_reads
+
+
+def test_protected_resource_request_reads_token_and_user_once(server, dynamodb):
+    _, token = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="password",
+        username="jane@example.com",
+        password="correct horse",
+        scope="openid profile",
+    )
+    dynamodb.calls.clear()
+
+    _, _, status = server.create_userinfo_response(
+        "https://guardian.test/oauth/userinfo", headers={"Authorization": f"Bearer {token['access_token']}"}
+    )
+
+    assert status == 200
+    assert reads(dynamodb) == [("GetItem", False), ("GetItem", False)]
+
+
+def test_wrong_password_is_rejected(server):
+    status, body = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="password",
+        username="jane@example.com",
+        password="wrong",
+    )
+
+    assert status == 400
+    assert body["error"] == "invalid_grant"
+
+
+def test_wrong_client_secret_is_rejected(server):
+    status, body = token_request(
+        server, basic_auth("confidential", "wrong"), grant_type="password", username="jane@example.com", password="x"
+    )
+
+    assert status == 401
+    assert body["error"] == "invalid_client"
+
+
+def test_authorization_code_is_redeemed_once(server, dynamodb):
+    dynamodb.calls.clear()
+    params = {"grant_type": "authorization_code", "client_id": "public", "code": "code-1"}
+
+    status, token = token_request(server, **params)
+
+    assert status == 200
+    assert token["scope"] == "email"
+    assert dynamodb.calls == [("BatchGetItem", True), ("TransactWriteItems", 3)]
+    assert ("AuthorizationCode#code-1",) * 2 not in dynamodb.items
+
+    status, body = token_request(server, **params)
+
+    assert status == 400
+    assert body["error"] == "invalid_grant"
+
+
+def test_concurrently_redeemed_code_is_rejected(server, repository):
+    params = {"grant_type": "authorization_code", "client_id": "public", "code": "code-1"}
+    redeem = server.request_validator.save_bearer_token
+
+    def redeemed_concurrently(token, request, *args, **kwargs):
+        asyncio.run(
+            repository.client.delete_item(TABLE, {"PK": "AuthorizationCode#code-1", "SK": "AuthorizationCode#code-1"})
+        )
+        return redeem(token, request, *args, **kwargs)
+
+    server.request_validator.save_bearer_token = redeemed_concurrently
+
+    with pytest.raises(InvalidGrantError):
+        token_request(server, **params)
+
+
+def test_refresh_token_rotates(server):
+    _, token = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="password",
+        username="jane@example.com",
+        password="correct horse",
+        scope="email",
+    )
+
+    status, refreshed = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="refresh_token",
+        refresh_token=token["refresh_token"],
+    )
+
+    assert status == 200
+    assert refreshed["refresh_token"] != token["refresh_token"]
+
+    status, body = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="refresh_token",
+        refresh_token=token["refresh_token"],
+    )
+
+    assert status == 400
+    assert body["error"] == "invalid_grant"
+
+
+def test_userinfo_and_revocation(server):
+    _, token = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="password",
+        username="jane@example.com",
+        password="correct horse",
+        scope="openid email",
+    )
+    bearer = {"Authorization": f"Bearer {token['access_token']}"}
+
+    _, body, status = server.create_userinfo_response("https://guardian.test/oauth/userinfo", headers=bearer)
+
+    assert status == 200
+    assert json.loads(body) == {"sub": "jane@example.com", "email": "jane@example.com"}
+
+    _, _, status = server.create_revocation_response(
+        "https://guardian.test/oauth/revoke",
+        "POST",
+        urlencode({"token": token["access_token"]}),
+        {"Content-Type": "application/x-www-form-urlencoded", **basic_auth("confidential", "client-secret")},
+    )
+
+    assert status == 200
+    assert not server.request_validator.validate_bearer_token(token["access_token"], ["openid"], Request(TOKEN_URI))
+
+
+def test_id_token_is_signed_with_the_current_key(server, keys):
+    status, token = token_request(server, grant_type="authorization_code", client_id="public", code="openid-code")
+
+    assert status == 200
+    claims = keys.verify(token["id_token"], audience="public")
+    assert claims["iss"] == "https://guardian.test/"
+    assert claims["sub"] == "jane@example.com"
+    assert claims["nonce"] == "n-0S6_WzA2Mj"
+    assert claims["exp"] > claims["iat"]
+    assert jwt.get_unverified_header(token["id_token"])["kid"] == keys.signing_key.kid
+
+
+@pytest.fixture(scope="module")
+def jwt_tokens(keys):
+    return JWTAccessTokens(keys)
+
+
+@pytest.fixture
+def jwt_server(repository, jwt_tokens):
+    validator = DynamoDBRequestValidator()
+    validator.bind(repository, asyncio.run, jwt_tokens=jwt_tokens)
+    return Server(validator, token_generator=jwt_tokens)
+
+
+def test_jwt_access_tokens_are_verified_without_reading_the_token(jwt_server, dynamodb):
+    _, token = token_request(jwt_server, basic_auth("service", "service-secret"), grant_type="client_credentials")
+    request = Request(TOKEN_URI)
+    dynamodb.calls.clear()
+    jwt_server.request_validator.revocations = RevocationList(None, "revoked", "revoked")
+
+    assert jwt_server.request_validator.validate_bearer_token(token["access_token"], ["email"], request)
+    assert request.client_id == "service"
+    assert reads(dynamodb) == []
+
+
+def test_revocation_filter_hits_are_looked_up(jwt_server, dynamodb):
+    _, token = token_request(jwt_server, basic_auth("service", "service-secret"), grant_type="client_credentials")
+    jwt_server.request_validator.revocations = RevocationList(None, "revoked", "revoked")
+    jwt_server.request_validator.revocations.add(JWTAccessTokens.token_id(token["access_token"]))
+    dynamodb.calls.clear()
+
+    assert jwt_server.request_validator.validate_bearer_token(token["access_token"], ["email"], Request(TOKEN_URI))
+    assert reads(dynamodb) == [("GetItem", False)]
+
+
+def test_revoked_jwt_access_tokens_are_rejected(jwt_server, dynamodb):
+    _, token = token_request(jwt_server, basic_auth("service", "service-secret"), grant_type="client_credentials")
+
+    _, _, status = jwt_server.create_revocation_response(
+        "https://guardian.test/oauth/revoke",
+        "POST",
+        urlencode({"token": token["access_token"]}),
+        {"Content-Type": "application/x-www-form-urlencoded", **basic_auth("service", "service-secret")},
+    )
+
+    assert status == 200
+    assert not jwt_server.request_validator.validate_bearer_token(token["access_token"], [], Request(TOKEN_URI))
+
+
+def test_tampered_jwt_access_tokens_are_rejected(jwt_server):
+    _, token = token_request(jwt_server, basic_auth("service", "service-secret"), grant_type="client_credentials")
+    header, payload, signature = token["access_token"].split(".")
+    tampered = ".".join((header, payload, signature[::-1]))
+
+    assert not jwt_server.request_validator.validate_bearer_token(tampered, [], Request(TOKEN_URI))
+
+
+def test_jwt_access_tokens_are_introspected_locally(jwt_server, dynamodb):
+    headers = {"Content-Type": "application/x-www-form-urlencoded", **basic_auth("service", "service-secret")}
+    _, token = token_request(jwt_server, basic_auth("service", "service-secret"), grant_type="client_credentials")
+    jwt_server.request_validator.revocations = RevocationList(None, "revoked", "revoked")
+    dynamodb.calls.clear()
+
+    _, body, status = jwt_server.create_introspect_response(
+        "https://guardian.test/oauth/introspect", "POST", urlencode({"token": token["access_token"]}), headers
+    )
+
+    assert status == 200
+    assert json.loads(body)["active"]
+    assert reads(dynamodb) == [("GetItem", False)]  # the client, to authenticate it
+
+
+def introspect(server, client_id, secret, token):
+    headers = {"Content-Type": "application/x-www-form-urlencoded", **basic_auth(client_id, secret)}
+    _, body, status = server.create_introspect_response(
+        "https://guardian.test/oauth/introspect", "POST", urlencode({"token": token}), headers
+    )
+    assert status == 200
+    return json.loads(body)
+
+
+def test_resource_servers_introspect_tokens_of_other_clients(server):
+    _, token = token_request(server, basic_auth("service", "service-secret"), grant_type="client_credentials")
+
+    introspection = introspect(server, "gateway", "gateway-secret", token["access_token"])
+
+    assert introspection["active"]
+    assert introspection["client_id"] == "service"
+
+
+def test_other_clients_cannot_introspect_a_clients_tokens(server):
+    _, token = token_request(
+        server,
+        basic_auth("confidential", "client-secret"),
+        grant_type="password",
+        username="jane@example.com",
+        password="correct horse",
+    )
+
+    assert introspect(server, "confidential", "client-secret", token["access_token"])["active"]
+    assert not introspect(server, "service", "service-secret", token["access_token"])["active"]
+
+
+def test_batch_introspection_reads_tokens_in_bulk(server, dynamodb):
+    service = basic_auth("service", "service-secret")
+    tokens = [token_request(server, service, grant_type="client_credentials")[1]["access_token"] for _ in range(3)]
+    endpoint = BatchIntrospectEndpoint(server.request_validator, max_tokens=10)
+    dynamodb.calls.clear()
+
+    _, body, status = endpoint.create_batch_introspect_response(
+        "https://guardian.test/oauth/introspect/batch",
+        "POST",
+        urlencode([("token", token) for token in [*tokens, "unknown"]]),
+        {"Content-Type": "application/x-www-form-urlencoded", **service},
+    )
+
+    assert status == 200
+    results = json.loads(body)["results"]
+    assert [result["active"] for result in results] == [True, True, True, False]
+    assert results[0]["client_id"] == "service"
+    # The client, the access tokens, a strong read of the misses, and the misses as refresh tokens
+    assert reads(dynamodb) == [("GetItem", False), ("BatchGetItem", False), ("GetItem", True), ("GetItem", True)]
+
+
+def test_batch_introspection_limits_the_batch_size(server):
+    endpoint = BatchIntrospectEndpoint(server.request_validator, max_tokens=2)
+
+    _, body, status = endpoint.create_batch_introspect_response(
+        "https://guardian.test/oauth/introspect/batch",
+        "POST",
+        urlencode([("token", "a"), ("token", "b"), ("token", "c")]),
+        {"Content-Type": "application/x-www-form-urlencoded", **basic_auth("service", "service-secret")},
+    )
+
+    assert status == 400
+    assert json.loads(body)["error"] == "invalid_request"
+
+
+def test_large_batches_are_split_into_batch_get_item_calls(repository, dynamodb):
+    dynamodb.calls.clear()
+
+    asyncio.run(repository.get_many([EntityRef(USER, f"user-{i}@example.com") for i in range(150)]))
+
+    assert reads(dynamodb) == [("BatchGetItem", False), ("BatchGetItem", False)]
+
+
+@pytest.fixture
+def code_server(repository, keys, redis):
+    validator = DynamoDBRequestValidator()
+    validator.bind(repository, asyncio.run, keys=keys, codes=CodeStore(redis))
+    return Server(validator)
+
+
+def authorize(server, **params):
+    uri = "https://guardian.test/oauth/authorize?" + urlencode(
+        {"response_type": "code", "client_id": "public", "redirect_uri": "https://app.test/callback", **params}
+    )
+    headers, _, status = server.create_authorization_response(
+        uri, scopes=["email"], credentials={"user": "jane@example.com"}
+    )
+    assert status == 302
+    return dict(parse_qsl(urlsplit(headers["Location"]).query))["code"]
+
+
+def test_redis_codes_are_redeemed_with_one_round_trip(code_server, dynamodb, redis):
+    code = authorize(code_server)
+    dynamodb.calls.clear()
+    redis.calls.clear()
+
+    status, _ = token_request(code_server, grant_type="authorization_code", client_id="public", code=code)
+
+    assert status == 200
+    assert redis.calls == ["GETDEL"]
+    assert dynamodb.calls == [("GetItem", False), ("TransactWriteItems", 2)]  # the client, the token items
+
+
+def test_redis_codes_cannot_be_replayed(code_server):
+    code = authorize(code_server)
+    params = {"grant_type": "authorization_code", "client_id": "public", "code": code}
+
+    assert token_request(code_server, **params)[0] == 200
+    status, body = token_request(code_server, **params)
+
+    assert status == 400
+    assert body["error"] == "invalid_grant"
+
+
+def test_redis_codes_keep_the_pkce_challenge(code_server):
+    verifier = "a" * 64
+    challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).rstrip(b"=").decode()
+    code = authorize(code_server, code_challenge=challenge, code_challenge_method="S256")
+    params = {"grant_type": "authorization_code", "client_id": "public", "code": code}
+
+    assert token_request(code_server, **params, code_verifier="wrong" * 10)[0] == 400
+    code = authorize(code_server, code_challenge=challenge, code_challenge_method="S256")
+    assert token_request(code_server, **{**params, "code": code}, code_verifier=verifier)[0] == 200